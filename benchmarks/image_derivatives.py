@@ -0,0 +1,102 @@
+"""Compares derivative rendering before and after draft decoding and
+cascaded resizing, on synthetic 40 and 100 megapixel JPEG originals.
+
+Each run happens in a fresh process so its peak RSS can be measured on its
+own. Run from the repository root:
+
+    python -m benchmarks.image_derivatives
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+from flask_app.image_utils import render_profiles
+
+MEGAPIXELS = (40, 100)
+
+# The synthetic originals are deliberately past Pillow's bomb warning
+Image.MAX_IMAGE_PIXELS = None
+
+# The two upload paths as they were before the profile registry
+PROFILES = {
+    "art": {
+        "full": {"formats": {"JPEG": 75}},
+        "large": {"max_axis": 1000, "formats": {"JPEG": 75}},
+        "thumbnail": {"max_axis": 64, "formats": {"JPEG": 75}}
+    },
+    "psalm demo": {
+        "large": {"max_axis": 800, "formats": {"JPEG": 75}},
+        "thumbnail": {"max_axis": 64, "formats": {"JPEG": 75}}
+    }
+}
+
+
+def make_original(path, megapixels):
+    """Saves a 3:2 synthetic painting scan of roughly the given size"""
+    width = int((megapixels * 1e6 * 1.5) ** 0.5)
+    height = int(width / 1.5)
+    gradient = Image.radial_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 48)
+    Image.merge("RGB", (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT))).save(path, quality=90)
+    return width, height
+
+
+def render_baseline(source_path, base_name, profiles):
+    """The previous pipeline: a full decode and a resize from full size for
+    every output, with Pillow's default filter"""
+    with Image.open(source_path) as im:
+        for name, profile in profiles.items():
+            filename = "{}-{}.jpg".format(base_name, name)
+            if "max_axis" not in profile:
+                im.save(filename)
+                continue
+            w, h = im.size
+            if w > h:
+                size = (profile["max_axis"], round(profile["max_axis"] * (h / w)))
+            else:
+                size = (round(profile["max_axis"] * (w / h)), profile["max_axis"])
+            im.resize(size).save(filename)
+
+
+def measure(pipeline, source_path, base_name, profiles, results):
+    """Runs one pipeline and reports its wall time and peak RSS in MiB"""
+    start = time.perf_counter()
+    pipeline(source_path, base_name, profiles)
+    elapsed = time.perf_counter() - start
+    results.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def run(pipeline, source_path, base_name, profiles):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=measure, args=(pipeline, source_path, base_name, profiles, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    with tempfile.TemporaryDirectory() as work_dir:
+        print("{:>6} {:<11} {:>14} {:>14} {:>16} {:>16}".format(
+            "MP", "profile", "before (s)", "after (s)", "before RSS (MiB)", "after RSS (MiB)"))
+
+        for megapixels in MEGAPIXELS:
+            source_path = os.path.join(work_dir, "original-{}.jpg".format(megapixels))
+            make_original(source_path, megapixels)
+
+            for profile, profiles in PROFILES.items():
+                base_name = os.path.join(work_dir, "derivative-{}".format(megapixels))
+                before_time, before_rss = run(render_baseline, source_path, base_name, profiles)
+                after_time, after_rss = run(render_profiles, source_path, base_name, profiles)
+                print("{:>6} {:<11} {:>14.2f} {:>14.2f} {:>16.0f} {:>16.0f}".format(
+                    megapixels, profile, before_time, after_time, before_rss, after_rss))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
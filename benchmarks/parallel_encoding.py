@@ -0,0 +1,64 @@
+"""Measures the wall time of rendering one art upload's derivatives with the
+configured profiles, encoding on 1 thread and on the shared encoding pool.
+The speedup depends on the number of CPUs, which is printed first.
+
+Each run happens in a fresh process so the pools start cold. Run from the
+repository root:
+
+    python -m benchmarks.parallel_encoding
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+from benchmarks.image_derivatives import make_original
+from config import Config
+from flask_app.image_utils import render_profiles
+
+MEGAPIXELS = (12, 40)
+THREADS = (1, 2, 4)
+
+# The synthetic originals are deliberately past Pillow's bomb warning
+Image.MAX_IMAGE_PIXELS = None
+
+
+def measure(source_path, base_name, profiles, threads, results):
+    """Renders every profile once and reports the wall time"""
+    start = time.perf_counter()
+    render_profiles(source_path, base_name, profiles, threads)
+    results.put(time.perf_counter() - start)
+
+
+def run(source_path, base_name, profiles, threads):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=measure, args=(source_path, base_name, profiles, threads, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    print("{} CPUs".format(os.cpu_count()))
+    with tempfile.TemporaryDirectory() as work_dir:
+        print("{:>6} {:>8} {:>10} {:>8}".format("MP", "threads", "time (s)", "speedup"))
+
+        for megapixels in MEGAPIXELS:
+            source_path = os.path.join(work_dir, "original-{}.jpg".format(megapixels))
+            base_name = os.path.join(work_dir, "derivative-{}".format(megapixels))
+            make_original(source_path, megapixels)
+
+            serial = None
+            for threads in THREADS:
+                elapsed = run(source_path, base_name, Config.IMAGE_PROFILES["art"], threads)
+                serial = serial or elapsed
+                print("{:>6} {:>8} {:>10.2f} {:>7.2f}x".format(megapixels, threads, elapsed, serial / elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
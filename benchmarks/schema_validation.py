@@ -0,0 +1,79 @@
+"""Compares loading bulk /art/update and /psalms/update payloads of 1,000
+and 10,000 items with a new schema per request, as the handlers used to,
+and with the fast bulk loaders. Each result is checked against the
+schema's before it is timed. Run from the repository root:
+
+    python -m benchmarks.schema_validation
+"""
+import sys
+import time
+
+from marshmallow import RAISE
+
+from flask_app.schemas import PiecesSchema, PsalmsListSchema, load_pieces, load_psalms
+
+SIZES = (1000, 10000)
+REPEAT = 5
+
+
+def make_pieces(count):
+    return {"pieces": [
+        {
+            "key": i,
+            "title": "Piece {}".format(i),
+            "medium": "Acrylic on canvas",
+            "size": "20\" x 20\"",
+            "price": 1500 + i,
+            "thumbnailColor": "#1482cd",
+            "collection": "Psalms" if i % 3 == 0 else "Florals",
+            "series": str(i // 3)
+        }
+        for i in range(count)
+    ]}
+
+
+def make_psalms(count):
+    return {"psalms": [
+        {
+            "number": i + 1,
+            "demoThumbnailColor": "#f0e0d0",
+            "statement": {
+                "title": "Psalm {}".format(i + 1),
+                "text": [{"key": key, "text": "Paragraph {}".format(key)} for key in range(3)]
+            }
+        }
+        for i in range(count)
+    ]}
+
+
+def best_time(load, data):
+    """Gets the fastest of REPEAT loads"""
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        load(data)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    cases = (
+        ("pieces", make_pieces, PiecesSchema, load_pieces),
+        ("psalms", make_psalms, PsalmsListSchema, load_psalms)
+    )
+    print("{:<8} {:>7} {:>12} {:>12} {:>8}".format("payload", "items", "schema (ms)", "fast (ms)", "speedup"))
+    for name, make, schema_class, fast in cases:
+        for size in SIZES:
+            data = make(size)
+            if schema_class().load(data, unknown=RAISE) != fast(data):
+                print("{}: fast loader output differs from the schema".format(name))
+                return 1
+            schema_time = best_time(lambda payload: schema_class().load(payload, unknown=RAISE), data)
+            fast_time = best_time(fast, data)
+            print("{:<8} {:>7} {:>12.1f} {:>12.1f} {:>7.1f}x".format(
+                name, size, schema_time * 1000, fast_time * 1000, schema_time / fast_time))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,6 +7,7 @@ from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from sentry_sdk import capture_exception
 from sentry_sdk.integrations.flask import FlaskIntegration
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 
 def create_app(test_env=None):
@@ -29,6 +30,9 @@ def create_app(test_env=None):
     if app.secret_key is None or app.config["JWT_SECRET_KEY"] is None:
         raise ValueError("Could not get application secret keys")
 
+    if app.config["PROXY_FIX_X_FOR"]:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_FIX_X_FOR"])
+
     if env == "prod":
         sentry_sdk.init(
                 dsn=app.config["SENTRY_DSN"],
@@ -36,7 +40,7 @@ def create_app(test_env=None):
         )
 
     CORS(app, origins=app.config["ALLOWED_ORIGINS"],
-         allow_headers=["Content-Type", "Authorization"])
+         allow_headers=["Content-Type", "Authorization"], expose_headers=["Retry-After"])
     JWTManager(app)
 
     @app.route("/healthcheck", methods=["GET"])
@@ -54,6 +58,27 @@ def create_app(test_env=None):
     from . import db
     db.init_app(app)
 
+    from . import indexes
+    indexes.init_app(app)
+
+    from . import revocation
+    revocation.init_app(app)
+
+    from . import tokens
+    tokens.init_app(app)
+
+    from . import cache
+    cache.init_app(app)
+
+    from . import jobs
+    jobs.init_app(app)
+
+    from . import passwords
+    passwords.init_app(app)
+
+    from . import uploads
+    uploads.init_app(app)
+
     from . import auth
     app.register_blueprint(auth.build_bp(app))
 
@@ -63,6 +88,9 @@ def create_app(test_env=None):
     from . import psalms
     app.register_blueprint(psalms.build_bp(app))
 
+    from . import images
+    app.register_blueprint(images.build_bp(app))
+
     return app
 
 
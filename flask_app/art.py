@@ -1,17 +1,70 @@
-import os
 import logging
 
-from PIL import Image
 from flask import (
     Blueprint, request, jsonify
 )
-from flask_jwt_extended import jwt_required
 from marshmallow import ValidationError, RAISE
-from sentry_sdk import capture_exception, capture_message
-
-from .db import get_db
-from .image_utils import decorate_image_filename, resize_image
-from .schemas import PiecesSchema, PieceSchema
+from sentry_sdk import capture_exception
+
+from .cache import cached_query, catalog_changed, conditional_catalog_response, make_key
+from .db import bulk_replace, get_db, summarize_bulk_results
+from .image_utils import ImageRejected
+from .pagination import PageArgsError, parse_page_args, set_next_page_link, stream_json_array
+from .schemas import PieceSchema, get_schema, load_pieces
+from .snapshots import Snapshot
+from .tokens import jwt_required
+from .uploads import accepts_uploads, check_upload, store_batch, store_upload, upload_response
+
+# Fields the catalog listing never exposes
+HIDDEN_PIECE_FIELDS = ("_id", "collection", "series")
+
+# Field holding a piece's image record, which only uploads change
+IMAGE_FIELD = "image"
+
+
+def piece_cursor(piece):
+    """Gets the page cursor of a piece. Keys are a display order that
+    repeats across collections and series, so the unique title breaks
+    ties."""
+    return "{}:{}".format(piece["key"], piece["title"])
+
+
+def parse_piece_cursor(value):
+    """Reads a page cursor made by piece_cursor
+
+    :return: (key, title)
+    """
+    key, separator, title = value.partition(":")
+    try:
+        key = int(key)
+    except ValueError:
+        separator = ""
+    if not separator:
+        raise PageArgsError("after must be <key>:<title>")
+    return key, title
+
+
+def build_pieces_pipeline(query_filter, limit=None, after=None):
+    """Builds the catalog listing query. Prices are stored in cents and are
+    converted to dollars and the hidden fields dropped on the server, so the
+    listing is a single round trip with no per-document work in Python.
+
+    Pages are in key then title order: a page holds up to limit pieces that
+    come after the (key, title) cursor after.
+    """
+    pipeline = [{"$match": query_filter}]
+    if after is not None:
+        key, title = after
+        pipeline.append({"$match": {"$or": [{"key": {"$gt": key}}, {"key": key, "title": {"$gt": title}}]}})
+    if limit is not None or after is not None:
+        pipeline.append({"$sort": {"key": 1, "title": 1}})
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    pipeline += [
+        {"$addFields": {"price": {"$divide": ["$price", 100]}}},
+        {"$project": {field: 0 for field in HIDDEN_PIECE_FIELDS}}
+    ]
+    return pipeline
 
 
 def build_bp(app):
@@ -25,31 +78,33 @@ def build_bp(app):
         if not request.is_json:
             return jsonify({"msg": "Request body must be application/json"}), 400
 
-        db = get_db().database
+        try:
+            limit, after, stream = parse_page_args(app.config["CATALOG_MAX_PAGE_SIZE"], parse_piece_cursor)
+        except PageArgsError as e:
+            return jsonify({"msg": str(e)}), 400
 
         query_filter = request.json
-        num_results = db.art.count_documents(query_filter)
+        pipeline = build_pieces_pipeline(query_filter, limit, after)
+        key = make_key("art", query_filter, limit, after, stream)
 
-        if num_results == 0:
+        def not_found():
             return jsonify({
                 "msg": "No artwork matching the parameters was found"
             }), 404
 
-        query_res = db.art.find(query_filter)
+        def build_response():
+            if stream:
+                cursor = get_db().database.art.aggregate(pipeline, batchSize=app.config["CATALOG_STREAM_BATCH_SIZE"])
+                return stream_json_array(cursor) or not_found()
 
-        metadata = []
-        for piece in query_res:
-            piece.pop("_id", None)
-            piece.pop("collection", None)
-            piece.pop("series", None)
-            piece["price"] = round(float(piece["price"]) / 100, ndigits=2)
-            metadata.append(piece)
+            snapshot = cached_query(key, lambda: Snapshot.build(list(get_db().database.art.aggregate(pipeline))))
 
-            if piece["title"] == "Quare Fremuerunt Gentes" \
-                    and piece["series"] == "1":
-                capture_message("The Psalms got messed up")
+            if snapshot.count == 0:
+                return not_found()
 
-        return jsonify(metadata), 200
+            return set_next_page_link(snapshot.to_response(), "art.get_pieces", snapshot, piece_cursor, limit), 200
+
+        return conditional_catalog_response(key, build_response)
 
     @bp.route("/add", methods=["PUT"])
     @jwt_required
@@ -58,7 +113,7 @@ def build_bp(app):
             return jsonify({"msg": "Request body must be application/json"}), 400
 
         try:
-            piece = PieceSchema().load(request.json, unknown=RAISE)
+            piece = get_schema(PieceSchema).load(request.json, unknown=RAISE)
         except ValidationError as e:
             return jsonify(e.messages), 400
 
@@ -68,6 +123,7 @@ def build_bp(app):
             return jsonify({"msg": "Piece with title {} already exists".format(piece["title"])}), 400
 
         art.insert_one(piece)
+        catalog_changed()
         return jsonify({}), 201
 
     @bp.route("/update", methods=["POST"])
@@ -77,16 +133,16 @@ def build_bp(app):
             return jsonify({"msg": "Request body must be application/json"}), 400
 
         try:
-            new_pieces = PiecesSchema().load(request.json, unknown=RAISE)
+            new_pieces = load_pieces(request.json)
         except ValidationError as e:
             return jsonify(e.messages), 400
 
         art = get_db().database.art
+        results = bulk_replace(art, "title", new_pieces["pieces"], app.config["BULK_WRITE_CHUNK_SIZE"],
+                               preserve=(IMAGE_FIELD,))
+        catalog_changed()
 
-        for new_piece in new_pieces["pieces"]:
-            art.replace_one({"title": new_piece["title"]}, new_piece)
-
-        return jsonify({}), 200
+        return jsonify(summarize_bulk_results(results)), 200
 
     @bp.route("/delete", methods=["DELETE"])
     @jwt_required
@@ -97,12 +153,17 @@ def build_bp(app):
         title = request.json.get("title")
         art = get_db().database.art
         art.delete_one({"title": title})
+        catalog_changed()
         return jsonify({}), 200
 
     @bp.route("/upload", methods=["POST"])
     @jwt_required
+    @accepts_uploads
     def upload_piece_to_image_store():
-        """Uploads an image to the image store. Function is idempotent."""
+        """Uploads an image to the image store. The original is stored
+        under its content hash straight away and the derivatives are
+        rendered by an image job. Uploading the same bytes again does
+        nothing."""
         if not request.content_type.startswith("multipart/form-data"):
             return jsonify({"msg": "Please use multipart/form-data"}), 400
 
@@ -122,31 +183,46 @@ def build_bp(app):
             return jsonify({"msg": "Piece with title \"{}\" not found".format(title)}), 404
 
         try:
-            with Image.open(file.stream) as im:
-                base_dir = app.config["IMAGE_STORE_DIR"]
-
-                if not os.path.isdir(base_dir):
-                    os.mkdir(base_dir)
-
-                base_name = os.path.join(base_dir, piece["path"])
-
-                try:
-                    full_img = im
-                    large_img = resize_image(im, 1000)
-                    thumbnail_img = resize_image(im, 64)
-
-                    full_img.save(decorate_image_filename(base_name, "full"))
-                    large_img.save(decorate_image_filename(base_name, "large"))
-                    thumbnail_img.save(decorate_image_filename(base_name, "thumbnail"))
-                except IOError as e:
-                    logging.exception("Error processing or saving image: %s", e)
-                    if app.config["ENV"] == "prod":
-                        capture_exception(e)
-                    return jsonify({"msg": "Error saving image"}), 500
+            extension = check_upload(file.stream)
+        except ImageRejected as e:
+            return jsonify({"msg": str(e)}), 400
         except IOError:
             return jsonify({"msg": "Please upload a valid image file."}), 400
 
-        return jsonify({}), 201
+        try:
+            result = store_upload(file.stream, extension, art, piece, "title", IMAGE_FIELD, piece["path"],
+                                  "art", app.config["IMAGE_PROFILES"]["art"])
+        except IOError as e:
+            logging.exception("Error saving original image: %s", e)
+            if app.config["ENV"] == "prod":
+                capture_exception(e)
+            return jsonify({"msg": "Error saving image"}), 500
+        return upload_response(result)
+
+    @bp.route("/upload/batch", methods=["POST"])
+    @jwt_required
+    @accepts_uploads
+    def upload_pieces_to_image_store():
+        """Uploads images for many pieces at once. Each file part is
+        matched to the title part in the same position, and the response
+        lists the outcome for each file."""
+        if not request.content_type.startswith("multipart/form-data"):
+            return jsonify({"msg": "Please use multipart/form-data"}), 400
+
+        files = request.files.getlist("file")
+        titles = request.form.getlist("title")
+
+        if not files:
+            return jsonify({"msg": "Request must include a file to upload"}), 400
+        if len(files) > app.config["IMAGE_UPLOAD_BATCH_MAX"]:
+            return jsonify({"msg": "Please upload at most {} files at once"
+                            .format(app.config["IMAGE_UPLOAD_BATCH_MAX"])}), 400
+        if len(titles) != len(files) or not all(titles):
+            return jsonify({"msg": "Please specify a piece for each file"}), 400
+
+        profiles = app.config["IMAGE_PROFILES"]["art"]
+        items = [(title, file, IMAGE_FIELD, "path", "art", profiles) for title, file in zip(titles, files)]
+        return jsonify({"results": store_batch(get_db().database.art, "title", items)}), 200
 
     # End route definitions
 
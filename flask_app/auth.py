@@ -1,16 +1,16 @@
 import datetime
 import re
-from time import sleep
 
 from flask import (
     Blueprint, request, jsonify
 )
-from flask_jwt_extended import (
-    create_access_token, jwt_required
-)
-from werkzeug.security import check_password_hash, generate_password_hash
+from flask_jwt_extended import create_access_token, get_jwt_identity, get_raw_jwt
 
 from .db import get_db
+from .passwords import HashQueueFull, get_hasher, hashing_busy
+from .revocation import revoke_token, revoke_user_tokens
+from .throttle import check_login, login_failed, login_succeeded, throttle_keys, too_many_attempts
+from .tokens import jwt_required
 
 USERNAME_PATTERN = re.compile("[a-zA-Z0-9_$]+")
 
@@ -43,9 +43,14 @@ def build_bp(app):
         if auth.find_one({"username": username}):
             return jsonify({"msg": "User {} is already registered".format(username)}), 400
 
+        try:
+            password_hash = get_hasher().generate(password)
+        except HashQueueFull:
+            return hashing_busy()
+
         auth.insert_one({
             "username": username,
-            "password": generate_password_hash(password),
+            "password": password_hash,
             "created": datetime.datetime.utcnow(),
             "passwordLastUpdated": datetime.datetime.utcnow()
         })
@@ -63,8 +68,15 @@ def build_bp(app):
         if not username:
             return jsonify({"msg": "Username required for login"}), 400
 
+        # Throttled clients are turned away before any hashing
+        database = get_db().database
+        keys = throttle_keys(username, request.remote_addr)
+        wait = check_login(database, keys)
+        if wait is not None:
+            return too_many_attempts(wait)
+
         # Check user credentials
-        auth = get_db().database.apiAuth
+        auth = database.apiAuth
         try:
             user = auth.find_one({"username": username})
         except Exception as e:
@@ -73,13 +85,28 @@ def build_bp(app):
         if user is not None and user.get("password") is not None:
             password_hash = user["password"]
 
-        if password_hash != "" and check_password_hash(password_hash, password):
+        hasher = get_hasher()
+        try:
+            valid = password_hash != "" and hasher.check(password_hash, password)
+        except HashQueueFull:
+            return hashing_busy()
+
+        if valid:
+            login_succeeded(database, keys)
+            if hasher.needs_rehash(password_hash):
+                # The password is at hand, so move it to the current parameters
+                try:
+                    auth.update_one({"username": username}, {"$set": {"password": hasher.generate(password)}})
+                except HashQueueFull:
+                    pass
             tokens = {
                 "accessToken": create_access_token(identity=username)
             }
             return jsonify(tokens), 200
-        else:
-            sleep(0.5)
+
+        wait = login_failed(database, keys)
+        if wait is not None:
+            return too_many_attempts(wait)
 
         return jsonify({"msg": "Incorrect username or password"}), 400
 
@@ -88,6 +115,22 @@ def build_bp(app):
     def verify_token():
         return jsonify({}), 200
 
+    @bp.route("/logout", methods=["POST"])
+    @jwt_required
+    def logout():
+        """Revokes the access token the request was made with."""
+        revoke_token(get_raw_jwt())
+        return jsonify({"msg": "Logged out"}), 200
+
+    @bp.route("/revoke-all", methods=["POST"])
+    @jwt_required
+    def revoke_all():
+        """Revokes every access token issued to the requesting user before
+        this second, and the one the request was made with."""
+        revoke_user_tokens(get_jwt_identity())
+        revoke_token(get_raw_jwt())
+        return jsonify({"msg": "Every token for {} has been revoked".format(get_jwt_identity())}), 200
+
     # End route definitions
 
     return bp
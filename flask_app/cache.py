@@ -0,0 +1,212 @@
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, jsonify, make_response, request
+from pymongo import ReturnDocument
+
+from .db import get_db
+from .tokens import jwt_required
+
+# _id of the document in the meta collection that tracks catalog changes
+CATALOG_META_ID = "catalog"
+
+
+class CatalogCache:
+    """Per-worker cache of catalog query results.
+
+    Entries expire after a TTL and the least recently used entry is evicted
+    once the cache is full. Every entry belongs to a catalog generation, a
+    counter kept in the database and bumped by every catalog write; when a
+    worker sees the generation move, it drops everything it has cached.
+    Workers re-read the generation at most once per check interval, so a
+    write made through another worker is picked up within that interval.
+    """
+
+    def __init__(self, max_entries, ttl, check_interval):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.generation = None
+        self.updated = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._last_check = None
+        self._lock = threading.Lock()
+
+    def sync_generation(self, database, force=False):
+        """Reloads the catalog generation if the check interval has passed,
+        clearing the cache if another worker has changed the catalog"""
+        now = time.monotonic()
+        if not force and self._last_check is not None and now - self._last_check < self.check_interval:
+            return self.generation
+
+        meta = database.meta.find_one({"_id": CATALOG_META_ID}) or {}
+        self._set_generation(meta.get("generation", 0), meta.get("updated"), now)
+        return self.generation
+
+    def bump_generation(self, database):
+        """Records a catalog change in the database and drops this worker's
+        cached entries"""
+        meta = increment_generation(database)
+        self._set_generation(meta["generation"], meta["updated"], time.monotonic())
+        return self.generation
+
+    def _set_generation(self, generation, updated, checked_at):
+        with self._lock:
+            if generation != self.generation:
+                self._entries.clear()
+                self.generation = generation
+            self.updated = updated
+            self._last_check = checked_at
+
+    def get(self, key):
+        """Gets a cached value, or None if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != self.generation or entry[1] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value):
+        """Caches a value for the current generation"""
+        with self._lock:
+            self._entries[key] = (self.generation, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """Gets the hit and miss counters for this worker"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "pid": os.getpid(),
+                "generation": self.generation,
+                "entries": len(self._entries),
+                "maxEntries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0
+            }
+
+
+def increment_generation(database):
+    """Records a catalog change in the database without an app context, e.g.
+    from an image job callback. Workers see it on their next generation check.
+
+    :return: The catalog meta document after the change
+    """
+    return database.meta.find_one_and_update(
+        {"_id": CATALOG_META_ID},
+        {"$inc": {"generation": 1}, "$set": {"updated": datetime.datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def get_cache():
+    """Gets the catalog cache for the current app"""
+    return current_app.extensions["catalog_cache"]
+
+
+def make_key(*parts):
+    """Builds a cache key from JSON-serializable parts, e.g. a query filter"""
+    return json.dumps(parts, sort_keys=True, separators=(",", ":"))
+
+
+def cached_query(key, loader):
+    """Gets a catalog query result from the cache, calling loader to run the
+    query on a miss"""
+    cache = get_cache()
+    cache.sync_generation(get_db().database)
+
+    value = cache.get(key)
+    if value is None:
+        value = loader()
+        cache.set(key, value)
+    return value
+
+
+def catalog_changed():
+    """Bumps the catalog generation after a write"""
+    return get_cache().bump_generation(get_db().database)
+
+
+def catalog_etag(key):
+    """Builds a strong ETag for a catalog response. The same query always
+    returns the same body within a catalog generation, so the generation
+    and the cache key identify the body without serializing it."""
+    generation = get_cache().sync_generation(get_db().database)
+    return hashlib.sha1(make_key(generation, key).encode("utf-8")).hexdigest()
+
+
+def matching_etag(etag):
+    """Gets the ETag from If-None-Match that matches the current catalog.
+    Compressed variants are distinct representations, so their ETags carry
+    the content coding as a suffix. If-None-Match uses weak comparison, so a
+    tag weakened on the way, e.g. by a proxy that compressed the response,
+    still matches."""
+    for candidate in (etag, etag + "-gzip", etag + "-br"):
+        if request.if_none_match.contains_weak(candidate):
+            return candidate
+    return None
+
+
+def is_not_modified(etag, last_modified):
+    """Checks the request's validators against the current catalog.
+    If-None-Match takes precedence over If-Modified-Since when both are sent."""
+    if request.if_none_match:
+        return matching_etag(etag) is not None
+    if last_modified is not None and request.if_modified_since is not None:
+        # HTTP dates have whole-second precision
+        return last_modified.replace(microsecond=0, tzinfo=None) <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def conditional_catalog_response(key, build_response):
+    """Answers a catalog request, returning 304 Not Modified without calling
+    build_response (so without querying or serializing) when the client's
+    copy is current. Successful responses carry the ETag and Last-Modified
+    validators and ask clients to revalidate before reuse."""
+    etag = catalog_etag(key)
+    last_modified = get_cache().updated
+
+    if is_not_modified(etag, last_modified):
+        response = current_app.response_class(status=304)
+        response.vary.add("Accept-Encoding")
+        etag = matching_etag(etag) or etag
+    else:
+        response = make_response(build_response())
+        if response.status_code != 200:
+            return response
+        if "Content-Encoding" in response.headers:
+            etag += "-" + response.headers["Content-Encoding"]
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+def init_app(app):
+    """Sets up the catalog cache and its stats route"""
+    app.extensions["catalog_cache"] = CatalogCache(app.config["CATALOG_CACHE_MAX_ENTRIES"],
+                                                   app.config["CATALOG_CACHE_TTL"],
+                                                   app.config["CATALOG_GENERATION_CHECK_INTERVAL"])
+
+    @app.route("/cache/stats", methods=["GET"])
+    @jwt_required
+    def cache_stats():
+        """Route for this worker's catalog cache counters."""
+        return jsonify(get_cache().stats()), 200
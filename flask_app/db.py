@@ -1,16 +1,51 @@
+import atexit
 import logging
+import os
+import threading
 
 from flask import current_app, g
-from pymongo import MongoClient
+from pymongo import MongoClient, ReplaceOne
 from sentry_sdk import capture_exception
 
+_client_lock = threading.Lock()
+
+
+def build_client(config):
+    """Builds a pooled client from the app config. connect=False defers the
+    first connection (and pymongo's monitor threads) until the first query,
+    so a client is never carried across a uWSGI fork."""
+    client = MongoClient(config["MONGO_URI"],
+                         connect=False,
+                         maxPoolSize=config["MONGO_MAX_POOL_SIZE"],
+                         minPoolSize=config["MONGO_MIN_POOL_SIZE"],
+                         maxIdleTimeMS=config["MONGO_MAX_IDLE_TIME_MS"],
+                         connectTimeoutMS=config["MONGO_CONNECT_TIMEOUT_MS"],
+                         socketTimeoutMS=config["MONGO_SOCKET_TIMEOUT_MS"],
+                         serverSelectionTimeoutMS=config["MONGO_SERVER_SELECTION_TIMEOUT_MS"])
+    client.database = client[config["DB_NAME"]]
+    return client
+
+
+def get_client():
+    """Gets the pooled client for the current worker process, creating it on
+    first use. The owning pid is recorded so a client inherited through a
+    fork is replaced rather than shared with the parent."""
+    state = current_app.extensions["mongo"]
+    pid = os.getpid()
+
+    if state["client"] is None or state["pid"] != pid:
+        with _client_lock:
+            if state["client"] is None or state["pid"] != pid:
+                state["client"] = build_client(current_app.config)
+                state["pid"] = pid
+    return state["client"]
+
 
 def get_db():
     """Gets the connection to the art database"""
     if "db" not in g:
         try:
-            g.db = MongoClient(current_app.config["MONGO_URI"])
-            g.db.database = g.db[current_app.config["DB_NAME"]]
+            g.db = get_client()
         except Exception as e:
             logging.exception("There was a problem accessing the database: %s", e)
             if current_app.config["ENV"] == "prod":
@@ -19,13 +54,85 @@ def get_db():
 
 
 def close_db(_):
-    """Closes the connection to the art database"""
-    db = g.pop("db", None)
+    """Releases the request's handle on the art database. The pooled client
+    stays open for the next request."""
+    g.pop("db", None)
+
+
+def close_client(app):
+    """Closes the worker's pooled client, e.g. on worker shutdown"""
+    state = app.extensions.get("mongo")
+    if state is not None and state["client"] is not None:
+        state["client"].close()
+        state["client"] = None
+        state["pid"] = None
+
+
+def bulk_replace(collection, key, documents, chunk_size, preserve=()):
+    """Replaces the documents matching each document's key field, one
+    unordered bulk write per chunk.
+
+    The current documents in each chunk are read first so every item can be
+    reported as "modified", "matched" (already identical, nothing written)
+    or "notFound". If a key appears more than once, each copy is compared
+    with the one before it and the last one wins, as with sequential
+    replaces; a key whose last copy matches the stored document is not
+    written at all.
+
+    Fields in preserve are managed by the server rather than the client, e.g.
+    image records, and are carried over from the current documents.
+
+    :return: A list of {key: value, "status": status} in input order.
+    """
+    results = []
+    for start in range(0, len(documents), chunk_size):
+        chunk = documents[start:start + chunk_size]
+        keys = [document[key] for document in chunk]
+        stored = {
+            document[key]: document
+            for document in collection.find({key: {"$in": keys}}, {"_id": 0})
+        }
+        existing = dict(stored)
+
+        replacements = {}
+        for document in chunk:
+            current = existing.get(document[key])
+            if current is not None:
+                document = dict(document, **{field: current[field] for field in preserve if field in current})
+
+            if current is None:
+                status = "notFound"
+            elif current == document:
+                status = "matched"
+            else:
+                status = "modified"
+                existing[document[key]] = document
+                if document == stored[document[key]]:
+                    replacements.pop(document[key], None)
+                else:
+                    replacements[document[key]] = ReplaceOne({key: document[key]}, document)
+            results.append({key: document[key], "status": status})
+
+        if replacements:
+            collection.bulk_write(list(replacements.values()), ordered=False)
+    return results
+
 
-    if db is not None:
-        db.close()
+def summarize_bulk_results(results):
+    """Builds the response body for a bulk update. As with pymongo's
+    counts, "matched" includes the modified documents."""
+    statuses = [result["status"] for result in results]
+    return {
+        "matched": len(statuses) - statuses.count("notFound"),
+        "modified": statuses.count("modified"),
+        "notFound": statuses.count("notFound"),
+        "results": results
+    }
 
 
 def init_app(app):
-    """Adds the close_db method as a teardown step"""
+    """Sets up the per-worker client slot and adds the close_db method as a
+    teardown step"""
+    app.extensions["mongo"] = {"client": None, "pid": None}
     app.teardown_appcontext(close_db)
+    atexit.register(close_client, app)
@@ -1,16 +1,372 @@
-def decorate_image_filename(filename, attribute):
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image
+
+try:
+    from PIL import ImageCms
+except ImportError:  # pragma: no cover - Pillow built without littlecms
+    ImageCms = None
+
+# File extensions for stored originals, by Pillow format name
+ORIGINAL_EXTENSIONS = {
+    "JPEG": "jpg",
+    "PNG": "png",
+    "TIFF": "tif"
+}
+
+# File extensions for derivatives, by Pillow format name
+FORMAT_EXTENSIONS = {
+    "JPEG": "jpg",
+    "WEBP": "webp",
+    "AVIF": "avif"
+}
+
+# Encoder settings for derivatives on top of each profile's quality.
+# Derivatives are encoded once and served many times, so these favour
+# size over encoding time.
+SAVE_OPTIONS = {
+    "JPEG": {"optimize": True, "progressive": True},
+    "WEBP": {"method": 6},
+    "AVIF": {"speed": 4}
+}
+
+
+# Downsampling filter for every derivative
+RESAMPLE = Image.LANCZOS
+
+# Shrink by whole-pixel box reduction first while the image is more than
+# this many times the target size, then finish with RESAMPLE
+REDUCING_GAP = 3.0
+
+
+def decorate_image_filename(filename, attribute, extension="jpg"):
     """Adds attribute and extension to the end of the filename"""
-    return "{}-{}.jpg".format(filename, attribute)
+    return "{}-{}.{}".format(filename, attribute, extension)
 
 
-def resize_image(image, max_axis_length):
+def fit_size(width, height, max_axis_length):
+    """Gets the size of a width x height image scaled so that the longer axis
+    is max_axis_length"""
+    if width > height:
+        return max_axis_length, round(max_axis_length * (height / width))
+    elif height > width:
+        return round(max_axis_length * (width / height)), max_axis_length
+    else:
+        return max_axis_length, max_axis_length
+
+
+def resize_image(image, max_axis_length, resample=RESAMPLE, reducing_gap=None):
     """Resizes an image so that the maximum width of an axis is max_axis_length"""
-    w = image.width
-    h = image.height
+    return image.resize(fit_size(image.width, image.height, max_axis_length),
+                        resample=resample, reducing_gap=reducing_gap)
+
+
+class ImageRejected(ValueError):
+    """Raised when an uploaded image is readable but outside the limits"""
+
+
+def set_max_image_pixels(max_pixels):
+    """Sets Pillow's decompression bomb limit for this process"""
+    Image.MAX_IMAGE_PIXELS = max_pixels
+
+
+def original_extension(stream, formats=None, max_pixels=None, max_dimension=None):
+    """Checks that stream holds an image Pillow can read and, when limits
+    are given, that its format and size are within them. Only the image
+    header is read and the stream is rewound afterwards, so nothing is
+    decoded however large the image is.
+
+    :raises IOError: If the stream is not a readable image.
+    :raises ImageRejected: If the image is outside the limits.
+    :return: The file extension to store the original under.
+    """
+    try:
+        with Image.open(stream) as im:
+            image_format = im.format
+            width, height = im.size
+    except Image.DecompressionBombError as e:
+        raise ImageRejected(str(e))
+    finally:
+        stream.seek(0)
+
+    if formats is not None and image_format not in formats:
+        raise ImageRejected("{} images are not supported".format(image_format))
+    if max_dimension is not None and max(width, height) > max_dimension:
+        raise ImageRejected("Image is {} x {} pixels; each side must be at most {}"
+                            .format(width, height, max_dimension))
+    if max_pixels is not None and width * height > max_pixels:
+        raise ImageRejected("Image has {} pixels; the limit is {}".format(width * height, max_pixels))
+    return ORIGINAL_EXTENSIONS.get(image_format, image_format.lower())
+
+
+def profile_size(width, height, profile):
+    """Gets the output size of a derivative profile for a width x height
+    original. Width profiles never upscale and give None when the original
+    is narrower than the profile."""
+    if "width" in profile:
+        if profile["width"] > width:
+            return None
+        return profile["width"], max(1, round(height * profile["width"] / width))
+    if "max_axis" in profile:
+        return fit_size(width, height, profile["max_axis"])
+    return width, height
+
+
+def profile_filename(base_name, name, profile, image_format="JPEG"):
+    """Gets the file a derivative profile is saved to in a format. The
+    attribute suffix defaults to -<name> and can be overridden with the
+    profile's suffix."""
+    return "{}{}.{}".format(base_name, profile.get("suffix", "-" + name), FORMAT_EXTENSIONS[image_format])
+
+
+def rendered_files(base_name, profiles, rendered):
+    """Lists the files render_profiles saved, from its return value"""
+    return [
+        "{}{}.{}".format(base_name, profiles[name].get("suffix", "-" + name), extension)
+        for name, derivative in rendered["derivatives"].items()
+        for extension in derivative["formats"]
+    ]
+
+
+def supported_formats(formats):
+    """Filters derivative formats down to those this Pillow build can write,
+    e.g. AVIF needs Pillow 11.3 or pillow-avif-plugin"""
+    Image.init()
+    return [image_format for image_format in formats if image_format in Image.SAVE]
+
+
+def strip_metadata(image):
+    """Converts an image with an embedded colour profile to sRGB, so it looks
+    the same without the profile, and drops EXIF, XMP and other metadata"""
+    icc_profile = image.info.get("icc_profile")
+    if icc_profile and ImageCms is not None:
+        try:
+            image = ImageCms.profileToProfile(image, ImageCms.ImageCmsProfile(io.BytesIO(icc_profile)),
+                                              ImageCms.createProfile("sRGB"), outputMode=image.mode)
+        except ImageCms.PyCMSError:
+            pass
+    image.info = {}
+    return image
+
+
+def save_derivative(image, filename, image_format, quality):
+    """Saves a derivative with the format's encoder settings"""
+    image.save(filename, image_format, quality=quality, **SAVE_OPTIONS.get(image_format, {}))
+
+
+_encode_pool = {"executor": None, "pid": None}
+_encode_pool_lock = threading.Lock()
+
+
+def get_encode_executor(threads):
+    """Gets this process's derivative encoding thread pool, starting it on
+    first use. Every render in the process shares the pool, so however many
+    jobs run at once, at most threads encodes run in parallel."""
+    pid = os.getpid()
+    if _encode_pool["executor"] is None or _encode_pool["pid"] != pid:
+        with _encode_pool_lock:
+            if _encode_pool["executor"] is None or _encode_pool["pid"] != pid:
+                _encode_pool["executor"] = ThreadPoolExecutor(max_workers=threads,
+                                                              thread_name_prefix="derivative-encode")
+                _encode_pool["pid"] = pid
+    return _encode_pool["executor"]
+
+
+def pixel_view(image):
+    """Gets another Image over the same pixels. Pillow keeps encoder state
+    on the Image being saved, so each parallel save needs its own."""
+    image.load()
+    return image._new(image.im)
 
-    if w > h:
-        return image.resize((max_axis_length, round(max_axis_length * (h / w))))
-    elif h > w:
-        return image.resize((round(max_axis_length * (w / h)), max_axis_length))
+
+# Longest side of the image placeholders are computed from
+PLACEHOLDER_SIZE = 32
+
+# BlurHash components across and down
+BLURHASH_COMPONENTS = (4, 3)
+
+BASE83_CHARACTERS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+def dominant_color(image):
+    """Gets the most common colour of an image as #rrggbb. The image is
+    quantized to a small palette first, so near-identical shades are counted
+    together."""
+    quantized = image.convert("RGB").quantize(colors=8, method=Image.MEDIANCUT)
+    _, index = max(quantized.getcolors())
+    return "#{:02x}{:02x}{:02x}".format(*quantized.getpalette()[index * 3:index * 3 + 3])
+
+
+def encode_base83(value, length):
+    return "".join(BASE83_CHARACTERS[value // 83 ** (length - i) % 83] for i in range(1, length + 1))
+
+
+def linear_to_srgb(value):
+    value = min(max(value, 0.0), 1.0)
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(image, components=BLURHASH_COMPONENTS):
+    """Encodes an image as a BlurHash string (https://blurha.sh).
+
+    Each component is the image's colour in linear light weighted by a
+    cosine basis; all of them are computed in one tensor contraction over
+    the pixel array rather than pixel by pixel.
+    """
+    components_x, components_y = components
+    pixels = np.asarray(image.convert("RGB"), dtype=np.float64) / 255
+    linear = np.where(pixels <= 0.04045, pixels / 12.92, ((pixels + 0.055) / 1.055) ** 2.4)
+    height, width = linear.shape[:2]
+
+    basis_x = np.cos(np.pi * np.outer(np.arange(components_x), np.arange(width)) / width)
+    basis_y = np.cos(np.pi * np.outer(np.arange(components_y), np.arange(height)) / height)
+    factors = np.einsum("jy,ix,yxc->jic", basis_y, basis_x, linear) * 2 / (width * height)
+    factors[0, 0] /= 2
+    factors = factors.reshape(-1, 3)
+    dc, ac = factors[0], factors[1:]
+
+    result = encode_base83(components_x - 1 + (components_y - 1) * 9, 1)
+    if len(ac):
+        quantised_max = int(max(0, min(82, np.floor(np.abs(ac).max() * 166 - 0.5))))
+        maximum = (quantised_max + 1) / 166
     else:
-        return image.resize((max_axis_length, max_axis_length))
+        quantised_max = 0
+        maximum = 1
+    result += encode_base83(quantised_max, 1)
+
+    r, g, b = (linear_to_srgb(value) for value in dc)
+    result += encode_base83((r << 16) + (g << 8) + b, 4)
+
+    quantised = np.clip(np.floor(np.sign(ac) * np.abs(ac / maximum) ** 0.5 * 9 + 9.5), 0, 18).astype(int)
+    for quant_r, quant_g, quant_b in quantised:
+        result += encode_base83(int(quant_r * 19 * 19 + quant_g * 19 + quant_b), 2)
+    return result
+
+
+def image_placeholder(image):
+    """Computes what a client needs to draw a placeholder while an image
+    loads, from a decoded copy of it
+
+    :return: {"color": dominant colour, "blurhash": BlurHash string}
+    """
+    if max(image.size) > PLACEHOLDER_SIZE:
+        image = resize_image(image, PLACEHOLDER_SIZE, reducing_gap=REDUCING_GAP)
+    return {"color": dominant_color(image), "blurhash": blurhash(image)}
+
+
+def render_profiles(source_path, base_name, profiles, encode_threads=1, progress=None):
+    """Renders every derivative profile of an image.
+
+    The original is decoded once. When no full-size copy is wanted, JPEGs
+    are decoded with draft mode at the smallest DCT scale that still covers
+    the largest output. Outputs are rendered largest first and each one is
+    resized from the one before it rather than from the original. Each
+    size is then encoded in every format of its profile that this Pillow
+    build supports, without metadata.
+
+    With more than one encode thread, the encodes run on the process's
+    shared encoding pool while the next size is resized. Pillow releases
+    the GIL while it resizes and encodes, so these overlap.
+
+    The image placeholder is computed from the smallest output, so it
+    costs no extra decode.
+
+    This runs in the image job pool, so it takes only plain arguments.
+
+    :param source_path: The original image
+    :param base_name: The path derivative filenames are built on
+    :param profiles: Derivative profiles by name. A profile has a quality
+        for each format and either a width, a max_axis length, or neither
+        for a full-size copy.
+    :param encode_threads: The size of the process's encoding pool, or 1 to
+        encode in the calling thread
+    :param progress: Called with (done, total) as each file is saved
+    :return: {"derivatives": the size and formats of each rendered
+        derivative by profile name, "placeholder": see image_placeholder,
+        "originalSize": the original's width and height}
+    """
+    with Image.open(source_path) as im:
+        original_size = {"width": im.width, "height": im.height}
+        sizes = {name: profile_size(im.width, im.height, profile) for name, profile in profiles.items()}
+        ordered = sorted((name for name in profiles if sizes[name] is not None),
+                         key=lambda name: sizes[name][0] * sizes[name][1], reverse=True)
+        formats = {name: supported_formats(profiles[name]["formats"]) for name in ordered}
+
+        done = 0
+        total = sum(len(formats[name]) for name in ordered)
+        if progress is not None:
+            progress(done, total)
+        if total == 0:
+            return {"derivatives": {}, "placeholder": None, "originalSize": original_size}
+
+        if sizes[ordered[0]] != im.size:
+            im.draft("RGB", sizes[ordered[0]])
+
+        source = strip_metadata(im if im.mode in ("RGB", "L") else im.convert("RGB"))
+        executor = get_encode_executor(encode_threads) if encode_threads > 1 else None
+
+        pending = []
+        for name in ordered:
+            if source.size != sizes[name]:
+                source = source.resize(sizes[name], resample=RESAMPLE, reducing_gap=REDUCING_GAP)
+            for image_format in formats[name]:
+                args = (profile_filename(base_name, name, profiles[name], image_format),
+                        image_format, profiles[name]["formats"][image_format])
+                if executor is not None:
+                    pending.append(executor.submit(save_derivative, pixel_view(source), *args))
+                    continue
+                save_derivative(source, *args)
+                done += 1
+                if progress is not None:
+                    progress(done, total)
+
+        placeholder = image_placeholder(source)
+
+        for future in as_completed(pending):
+            future.result()
+            done += 1
+            if progress is not None:
+                progress(done, total)
+
+    derivatives = {
+        name: {
+            "width": sizes[name][0],
+            "height": sizes[name][1],
+            "formats": [FORMAT_EXTENSIONS[image_format] for image_format in formats[name]]
+        }
+        for name in ordered
+    }
+    return {"derivatives": derivatives, "placeholder": placeholder, "originalSize": original_size}
+
+
+def format_report(base_dir):
+    """Compares the bytes used by each derivative format in an image store.
+
+    Only derivatives that also have a JPEG copy are counted, so every format
+    is measured against the same set of images.
+
+    :return: {extension: {"files": count, "bytes": total, "jpegBytes": total}}
+    """
+    by_stem = {}
+    for entry in os.scandir(base_dir):
+        stem, extension = os.path.splitext(entry.name)
+        if entry.is_file() and extension[1:] in FORMAT_EXTENSIONS.values() and not stem.endswith("-original"):
+            by_stem.setdefault(stem, {})[extension[1:]] = entry.stat().st_size
+
+    report = {}
+    for files in by_stem.values():
+        jpeg_bytes = files.get("jpg")
+        if jpeg_bytes is None:
+            continue
+        for extension, size in files.items():
+            totals = report.setdefault(extension, {"files": 0, "bytes": 0, "jpegBytes": 0})
+            totals["files"] += 1
+            totals["bytes"] += size
+            totals["jpegBytes"] += jpeg_bytes
+    return report
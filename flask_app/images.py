@@ -0,0 +1,173 @@
+import mimetypes
+import os
+
+import click
+from flask import (
+    Blueprint, jsonify, request, send_from_directory
+)
+
+from .db import get_db
+from .image_utils import FORMAT_EXTENSIONS, format_report
+from .jobs import get_job
+from .reconcile import (
+    IMAGE_MISSING, IMAGE_NO_ORIGINAL, IMAGE_OK, IMAGE_PENDING, IMAGE_STALE, Checkpoint, delete_orphans, regenerate,
+    scan
+)
+from .storage import cached_file, get_storage
+from .tokens import jwt_required
+
+# Formats served in place of a JPEG derivative when the client lists them
+# in Accept, best first
+NEGOTIATED_FORMATS = (
+    ("avif", "image/avif"),
+    ("webp", "image/webp")
+)
+
+# Not every Python version knows the newer image types
+mimetypes.add_type("image/avif", ".avif")
+mimetypes.add_type("image/webp", ".webp")
+
+
+def negotiate_filename(filename):
+    """Picks the best stored format of a JPEG derivative that the client
+    accepts by name. A */* wildcard only ever gets the JPEG.
+
+    :return: (filename, local path), with a path of None if the file is
+        not stored
+    """
+    stem, extension = os.path.splitext(filename)
+    if extension == ".jpg":
+        accepted = {value for value, quality in request.accept_mimetypes if quality > 0}
+        for candidate_extension, mimetype in NEGOTIATED_FORMATS:
+            candidate = "{}.{}".format(stem, candidate_extension)
+            if mimetype in accepted:
+                path = cached_file(candidate)
+                if path is not None:
+                    return candidate, path
+    return filename, cached_file(filename)
+
+
+def build_bp(app):
+    """Factory wrapper for images blueprint"""
+    bp = Blueprint("images", __name__, url_prefix="/images")
+
+    # Begin route definitions
+
+    @bp.route("/<path:filename>", methods=["GET"])
+    def get_image(filename):
+        """Serves a derivative from the image store. Originals and hidden files
+        are never served.
+
+        In sendfile mode the file goes out through wsgi.file_wrapper, which
+        uWSGI sends with sendfile() (offloaded when offload-threads is set),
+        with Range and conditional request support. In x-accel mode the
+        response only names the file in X-Accel-Redirect for nginx to send.
+        HEAD is answered the same way without a body. Either way the file
+        is served from the image store directory, which caches the storage
+        backend.
+        """
+        base_dir = os.path.abspath(app.config["IMAGE_STORE_DIR"])
+        not_found = jsonify({"msg": "Image {} not found".format(filename)}), 404
+
+        # Only derivatives are served: never originals, hidden files such as
+        # uploads still being streamed in, or anything outside the flat store
+        stem, extension = os.path.splitext(filename)
+        if stem.endswith("-original") or extension[1:] not in FORMAT_EXTENSIONS.values() or \
+                any(part.startswith(".") for part in filename.split("/")):
+            return not_found
+
+        negotiated, path = negotiate_filename(filename)
+        if path is None:
+            return not_found
+
+        if app.config["IMAGE_SERVE_MODE"] == "x-accel":
+            response = app.response_class(mimetype=mimetypes.guess_type(negotiated)[0])
+            response.headers["X-Accel-Redirect"] = app.config["IMAGE_ACCEL_PREFIX"] + negotiated
+        else:
+            response = send_from_directory(base_dir, negotiated, conditional=True)
+
+        response.headers["Cache-Control"] = "public, max-age={}, immutable".format(app.config["IMAGE_CACHE_MAX_AGE"])
+        if negotiated != filename or filename.endswith(".jpg"):
+            response.vary.add("Accept")
+        return response
+
+    @bp.route("/jobs/<job_id>", methods=["GET"])
+    @jwt_required
+    def get_image_job(job_id):
+        """Reports the status and progress of an image processing job."""
+        job = get_job(get_db().database, job_id)
+        if job is None:
+            return jsonify({"msg": "Image job {} not found".format(job_id)}), 404
+
+        return jsonify(job), 200
+
+    # End route definitions
+
+    @bp.cli.command("format-report")
+    def format_report_command():
+        """Compares the bytes used by each derivative format in the store."""
+        report = format_report(app.config["IMAGE_STORE_DIR"])
+        click.echo("{:<8} {:>8} {:>14} {:>10}".format("format", "files", "bytes", "vs JPEG"))
+        for extension, totals in sorted(report.items(), key=lambda item: -item[1]["bytes"]):
+            click.echo("{:<8} {:>8} {:>14,} {:>9.0%}".format(
+                extension, totals["files"], totals["bytes"], totals["bytes"] / totals["jpegBytes"]))
+
+    @bp.cli.command("reconcile")
+    @click.option("--dry-run", is_flag=True, help="Only report what would be regenerated and deleted.")
+    @click.option("--all", "regenerate_all", is_flag=True,
+                  help="Regenerate every image, e.g. after a profile's quality changes.")
+    @click.option("--delete-orphans", "delete", is_flag=True, help="Delete stored files no image points at.")
+    @click.option("--workers", type=int, default=os.cpu_count(), show_default=True,
+                  help="Processes to render with; 0 renders in this process.")
+    @click.option("--checkpoint", "checkpoint_path", type=click.Path(dir_okay=False),
+                  help="File recording finished images. Defaults to .reconcile-checkpoint in the image store.")
+    @click.option("--restart", is_flag=True, help="Ignore the checkpoint of an interrupted run.")
+    def reconcile_command(dry_run, regenerate_all, delete, workers, checkpoint_path, restart):
+        """Checks the image store against the art and psalms images.
+
+        Reports orphaned files and images with missing or stale derivatives,
+        then regenerates those derivatives from the originals. An
+        interrupted run resumes from its checkpoint.
+        """
+        storage = get_storage()
+        database = get_db().database
+        report = scan(database, storage, app.config["IMAGE_PROFILES"])
+
+        for image in report["images"]:
+            if image["status"] != IMAGE_OK:
+                click.echo("{:<16} {} {!r} {}: {}".format(
+                    image["status"], image["collection"], image["value"], image["field"],
+                    ", ".join(image["missing"]) or image["name"]))
+        for key in report["orphans"]:
+            click.echo("{:<16} {}".format("orphan", key))
+
+        statuses = [image["status"] for image in report["images"]]
+        click.echo("{} images: {} ok, {} missing derivatives, {} stale, {} pending, {} missing originals; "
+                   "{} orphans, {} legacy files".format(
+                       len(statuses), statuses.count(IMAGE_OK), statuses.count(IMAGE_MISSING),
+                       statuses.count(IMAGE_STALE), statuses.count(IMAGE_PENDING),
+                       statuses.count(IMAGE_NO_ORIGINAL), len(report["orphans"]), len(report["legacy"])))
+
+        wanted = (IMAGE_MISSING, IMAGE_STALE) + ((IMAGE_OK,) if regenerate_all else ())
+        images = [image for image in report["images"] if image["status"] in wanted]
+        if dry_run:
+            click.echo("Dry run: would regenerate {} images{}".format(
+                len(images), " and delete {} orphans".format(len(report["orphans"])) if delete else ""))
+            return
+
+        checkpoint_path = checkpoint_path or os.path.join(app.config["IMAGE_STORE_DIR"], ".reconcile-checkpoint")
+        checkpoint = Checkpoint(checkpoint_path, restart)
+
+        def echo_result(image, error):
+            status = "failed: " + str(error) if error else "regenerated"
+            click.echo("{:<16} {} {!r} {}".format(status, image["collection"], image["value"], image["field"]))
+
+        failed = regenerate(database, images, app.config, workers, checkpoint, echo_result)
+        if delete:
+            delete_orphans(storage, app.config["IMAGE_STORE_DIR"], report["orphans"])
+            click.echo("Deleted {} orphans".format(len(report["orphans"])))
+        if failed:
+            raise click.ClickException("{} images could not be regenerated; run again to retry them".format(failed))
+        checkpoint.clear()
+
+    return bp
@@ -0,0 +1,110 @@
+import datetime
+import logging
+
+import click
+from pymongo import ASCENDING, IndexModel
+from sentry_sdk import capture_exception
+
+from .art import build_pieces_pipeline
+from .db import build_client, get_db
+from .revocation import live_entries
+
+# Every index the app relies on, by collection. Unique indexes back the
+# lookups the handlers already treat as unique.
+INDEXES = {
+    "art": [
+        IndexModel([("title", ASCENDING)], name="title_unique", unique=True),
+        IndexModel([("collection", ASCENDING), ("series", ASCENDING), ("key", ASCENDING), ("title", ASCENDING)],
+                   name="collection_series_key_title"),
+        IndexModel([("key", ASCENDING), ("title", ASCENDING)], name="key_title")
+    ],
+    "psalms": [
+        IndexModel([("number", ASCENDING)], name="number_unique", unique=True)
+    ],
+    "apiAuth": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True)
+    ],
+    "loginAttempts": [
+        IndexModel([("expires", ASCENDING)], name="expires_ttl", expireAfterSeconds=0)
+    ],
+    "revokedTokens": [
+        IndexModel([("expires", ASCENDING)], name="expires_ttl", expireAfterSeconds=0),
+        IndexModel([("revoked", ASCENDING)], name="revoked")
+    ]
+}
+
+# Representative queries issued by the routes, as (collection, query) pairs.
+# A dict is a find filter and a list is an aggregation pipeline. Unfiltered
+# full-catalog reads scan by design and are left out.
+ROUTE_QUERIES = [
+    ("art", {"title": "Orangerie"}),
+    ("art", build_pieces_pipeline({"collection": "Florals"})),
+    ("art", build_pieces_pipeline({"collection": "Psalms", "series": "1"})),
+    ("art", build_pieces_pipeline({"collection": "Florals"}, limit=20, after=(10, "Orangerie"))),
+    ("psalms", {"number": 1}),
+    ("psalms", {"number": {"$gt": 10}}),
+    ("apiAuth", {"username": "johndoe"}),
+    ("revokedTokens", {"revoked": {"$gte": datetime.datetime(2020, 6, 1)}}),
+    ("revokedTokens", live_entries(datetime.datetime(2020, 6, 1)))
+]
+
+
+def ensure_indexes(database):
+    """Creates every registered index. Creating an index that already exists
+    with the same options is a no-op, so this is safe to run repeatedly."""
+    created = {}
+    for collection, models in INDEXES.items():
+        created[collection] = database[collection].create_indexes(models)
+    return created
+
+
+def explain_query(database, collection, query):
+    """Gets the query planner output for a route query"""
+    if isinstance(query, list):
+        return database.command("aggregate", collection, pipeline=query, explain=True)
+    return database[collection].find(query).explain()
+
+
+def uses_collscan(plan):
+    """Checks whether an explain output contains a collection scan stage"""
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(uses_collscan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(uses_collscan(value) for value in plan)
+    return False
+
+
+def init_app(app):
+    """Adds the index CLI commands and optionally builds indexes at startup"""
+
+    @app.cli.command("ensure-indexes")
+    def ensure_indexes_command():
+        """Creates the indexes in the index registry."""
+        for collection, names in ensure_indexes(get_db().database).items():
+            click.echo("{}: {}".format(collection, ", ".join(names)))
+
+    @app.cli.command("check-indexes")
+    def check_indexes_command():
+        """Explains the route queries and reports any collection scans."""
+        database = get_db().database
+        scans = [(collection, query) for collection, query in ROUTE_QUERIES
+                 if uses_collscan(explain_query(database, collection, query))]
+        for collection, query in scans:
+            click.echo("COLLSCAN on {}: {}".format(collection, query))
+        if scans:
+            raise SystemExit(1)
+        click.echo("All route queries use an index")
+
+    if app.config["ENSURE_INDEXES"]:
+        # Use a throwaway client so no connection outlives the uWSGI fork
+        client = build_client(app.config)
+        try:
+            ensure_indexes(client.database)
+        except Exception as e:
+            logging.exception("Could not build database indexes: %s", e)
+            if app.config["ENV"] == "prod":
+                capture_exception(e)
+        finally:
+            client.close()
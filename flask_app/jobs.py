@@ -0,0 +1,202 @@
+import atexit
+import datetime
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app, jsonify, url_for
+from pymongo import MongoClient
+from sentry_sdk import capture_exception
+
+from .cache import increment_generation
+from .db import get_db
+from .image_utils import set_max_image_pixels
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Image job pools, with the setting that sizes each
+JOB_POOLS = {
+    "jobs": "IMAGE_JOB_WORKERS",
+    "batch": "IMAGE_BATCH_WORKERS"
+}
+DEFAULT_POOL = "jobs"
+
+# Pool processes are started by a clean server process rather than forked
+# from a worker, whose other threads may hold locks the child would inherit
+JOB_START_METHOD = "forkserver"
+
+_executor_lock = threading.Lock()
+
+
+class JobProgress:
+    """Reports a job's progress from inside a pool process.
+
+    Pool processes do not have the app, so each one opens its own client on
+    first use. Progress is best effort: a failed update is logged and the
+    job carries on.
+    """
+
+    _clients = {}
+
+    def __init__(self, mongo_uri, db_name, job_id):
+        self.mongo_uri = mongo_uri
+        self.db_name = db_name
+        self.job_id = job_id
+
+    def __call__(self, done, total):
+        try:
+            client = JobProgress._clients.get(self.mongo_uri)
+            if client is None:
+                client = JobProgress._clients[self.mongo_uri] = MongoClient(self.mongo_uri)
+            set_progress(client[self.db_name], self.job_id, done, total)
+        except Exception as e:
+            logging.warning("Could not report progress for image job %s: %s", self.job_id, e)
+
+
+def get_executor(pool=DEFAULT_POOL):
+    """Gets one of the current worker process's image job pools, starting it
+    on first use. As with the database client, pools inherited through a
+    fork are replaced."""
+    state = current_app.extensions["image_jobs"]
+    pid = os.getpid()
+
+    if state["pid"] != pid or pool not in state["executors"]:
+        with _executor_lock:
+            if state["pid"] != pid:
+                state["executors"] = {}
+                state["pid"] = pid
+            if pool not in state["executors"]:
+                state["executors"][pool] = ProcessPoolExecutor(max_workers=current_app.config[JOB_POOLS[pool]],
+                                                               mp_context=multiprocessing.get_context(JOB_START_METHOD),
+                                                               initializer=set_max_image_pixels,
+                                                               initargs=(current_app.config["IMAGE_MAX_PIXELS"],))
+    return state["executors"][pool]
+
+
+def create_job(database, kind, target):
+    """Records a new queued job
+
+    :return: The job id
+    """
+    now = datetime.datetime.utcnow()
+    job_id = uuid.uuid4().hex
+    database.imageJobs.insert_one({
+        "_id": job_id,
+        "kind": kind,
+        "target": target,
+        "status": JOB_QUEUED,
+        "progress": {"done": 0, "total": None},
+        "result": None,
+        "error": None,
+        "created": now,
+        "updated": now
+    })
+    return job_id
+
+
+def set_progress(database, job_id, done, total):
+    """Marks a job as running and records how far it has got"""
+    database.imageJobs.update_one({"_id": job_id}, {"$set": {
+        "status": JOB_RUNNING,
+        "progress": {"done": done, "total": total},
+        "updated": datetime.datetime.utcnow()
+    }})
+
+
+def record_result(database, record, result):
+    """Stores each part of a finished job's result, e.g. its derivatives, on
+    the image record of the document it rendered, unless a newer upload has
+    replaced the image since.
+
+    :param record: (collection name, query, image field, content hash)
+    """
+    collection, query, field, digest = record
+    updated = database[collection].update_one(dict(query, **{field + ".hash": digest}),
+                                              {"$set": {field + "." + part: value for part, value in result.items()}})
+    if updated.modified_count:
+        increment_generation(database)
+
+
+def finish_job(database, job_id, error, report_errors, result=None, record=None):
+    """Records the outcome of a job, and on success its derivatives on the
+    image record it was submitted for"""
+    update = {"status": JOB_DONE, "result": result, "error": None, "updated": datetime.datetime.utcnow()}
+    if error is not None:
+        logging.error("Image job %s failed: %s", job_id, error)
+        if report_errors:
+            capture_exception(error)
+        update["status"] = JOB_FAILED
+        update["error"] = str(error)
+    database.imageJobs.update_one({"_id": job_id}, {"$set": update})
+    if error is None and record is not None:
+        record_result(database, record, result)
+
+
+def submit_job(job_id, task, *args, record=None, pool=DEFAULT_POOL):
+    """Runs task(*args, progress=...) for a job on one of the worker's process
+    pools and records the outcome when it finishes. With the pool's size
+    setting at 0, the task runs before this returns instead.
+
+    :param record: Where to store the result, as for record_result
+    :param pool: The pool to run on, a key of JOB_POOLS
+
+    :return: The job's future, or None if the task ran inline.
+    """
+    database = get_db().database
+    config = current_app.config
+    report_errors = config["ENV"] == "prod"
+
+    if config[JOB_POOLS[pool]] == 0:
+        try:
+            result = task(*args, progress=lambda done, total: set_progress(database, job_id, done, total))
+        except Exception as e:
+            finish_job(database, job_id, e, report_errors)
+        else:
+            finish_job(database, job_id, None, report_errors, result, record)
+        return None
+
+    progress = JobProgress(config["MONGO_URI"], config["DB_NAME"], job_id)
+    future = get_executor(pool).submit(task, *args, progress=progress)
+    future.add_done_callback(lambda f: finish_job(database, job_id, f.exception(), report_errors,
+                                                  None if f.exception() else f.result(), record))
+    return future
+
+
+def job_accepted(job_id):
+    """Builds the 202 response for a job that has been handed to the pool"""
+    status_url = url_for("images.get_image_job", job_id=job_id)
+    response = jsonify({"jobId": job_id, "status": status_url})
+    response.status_code = 202
+    response.headers["Location"] = status_url
+    return response
+
+
+def get_job(database, job_id):
+    """Gets a job's status document in the shape the API returns"""
+    job = database.imageJobs.find_one({"_id": job_id})
+    if job is None:
+        return None
+    job["id"] = job.pop("_id")
+    return job
+
+
+def shutdown_executor(app):
+    """Stops the worker's image job pools, waiting for running jobs"""
+    state = app.extensions.get("image_jobs")
+    if state is not None and state["pid"] == os.getpid():
+        for executor in state["executors"].values():
+            executor.shutdown(wait=True)
+        state["executors"] = {}
+        state["pid"] = None
+
+
+def init_app(app):
+    """Sets up the per-worker image job pool slots"""
+    app.extensions["image_jobs"] = {"executors": {}, "pid": None}
+    atexit.register(shutdown_executor, app)
@@ -0,0 +1,71 @@
+from flask import Response, json, request, stream_with_context, url_for
+
+TRUE_VALUES = ("1", "true", "yes")
+
+
+class PageArgsError(ValueError):
+    """Raised when the pagination query parameters are invalid"""
+
+
+def int_cursor(value):
+    """Reads a page cursor that is a single integer key"""
+    try:
+        return int(value)
+    except ValueError:
+        raise PageArgsError("after must be an integer")
+
+
+def parse_page_args(max_limit, parse_after=int_cursor):
+    """Reads the keyset pagination parameters from the query string.
+
+    :param parse_after: Reads the after cursor, raising PageArgsError if it
+        is invalid
+    :return: (limit, after, stream). limit and after are None when not given.
+    """
+    limit = request.args.get("limit")
+    after = request.args.get("after")
+    stream = request.args.get("stream", "").lower() in TRUE_VALUES
+
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise PageArgsError("limit must be an integer")
+        if not 0 < limit <= max_limit:
+            raise PageArgsError("limit must be between 1 and {}".format(max_limit))
+
+    if after is not None:
+        after = parse_after(after)
+
+    return limit, after, stream
+
+
+def set_next_page_link(response, endpoint, snapshot, cursor, limit):
+    """Adds a Link header pointing at the next page when the page is full
+
+    :param cursor: Gets the after cursor of the page's last document
+    """
+    if limit is not None and snapshot.count == limit:
+        args = dict(request.args, limit=limit, after=cursor(snapshot.last))
+        response.headers["Link"] = "<{}>; rel=\"next\"".format(url_for(endpoint, **args))
+    return response
+
+
+def stream_json_array(cursor):
+    """Builds a response that writes a JSON array straight from a cursor, so
+    memory use does not grow with the number of documents.
+
+    :return: The response, or None if the cursor is empty.
+    """
+    try:
+        first = next(cursor)
+    except StopIteration:
+        return None
+
+    def generate():
+        yield "[" + json.dumps(first)
+        for document in cursor:
+            yield "," + json.dumps(document)
+        yield "]"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
@@ -0,0 +1,178 @@
+import hashlib
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app, jsonify
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from .slots import HostSlots
+from .tokens import jwt_required
+
+# PBKDF2 iterations timed to estimate the cost of one iteration
+CALIBRATION_ITERATIONS = 20000
+
+# Iteration counts are rounded down to a multiple of this
+ITERATION_STEP = 10000
+
+
+class HashQueueFull(Exception):
+    """Raised when a password hash waited too long for a free slot"""
+
+
+class PasswordHasher:
+    """Hashes and checks passwords on a bounded pool.
+
+    Each worker process runs hashes on its own thread pool, and every hash
+    also takes one of the host-wide slots, so at most slots.count hashes
+    run at once across all workers and catalog requests keep the remaining
+    CPUs. A worker killed mid-hash frees its slot as it dies. A hash that
+    waits longer than max_wait for a slot is refused. The time each hash
+    spent waiting is recorded.
+    """
+
+    def __init__(self, slots, max_wait, iterations):
+        self.concurrency = slots.count
+        self.max_wait = max_wait
+        self.method = "pbkdf2:sha256:{}".format(iterations)
+        self.hashes = 0
+        self.rejected = 0
+        self.total_queue_time = 0.0
+        self.max_queue_time = 0.0
+        self._slots = slots
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        """Gets this process's hashing pool, starting it on first use"""
+        pid = os.getpid()
+        if self._executor is None or self._pid != pid:
+            with self._lock:
+                if self._executor is None or self._pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                                                        thread_name_prefix="password-hash")
+                    self._pid = pid
+        return self._executor
+
+    def run(self, func, *args):
+        """Runs func(*args) on the pool once a slot is free
+
+        :raises HashQueueFull: If no slot came free within max_wait
+        """
+        submitted = time.monotonic()
+
+        def task():
+            slot = self._slots.acquire(timeout=max(0.0, self.max_wait - (time.monotonic() - submitted)))
+            if slot is None:
+                with self._lock:
+                    self.rejected += 1
+                raise HashQueueFull()
+            try:
+                self._record_wait(time.monotonic() - submitted)
+                return func(*args)
+            finally:
+                self._slots.release(slot)
+
+        return self.executor().submit(task).result()
+
+    def _record_wait(self, queue_time):
+        with self._lock:
+            self.hashes += 1
+            self.total_queue_time += queue_time
+            self.max_queue_time = max(self.max_queue_time, queue_time)
+
+    def generate(self, password):
+        """Hashes a password with the current parameters"""
+        return self.run(generate_password_hash, password, self.method)
+
+    def check(self, password_hash, password):
+        """Checks a password against a stored hash"""
+        return self.run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Checks whether a stored hash was made with other parameters"""
+        return password_hash.split("$", 1)[0] != self.method
+
+    def stats(self):
+        """Gets the hash and queue time counters for this worker"""
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "method": self.method,
+                "concurrency": self.concurrency,
+                "hashes": self.hashes,
+                "rejected": self.rejected,
+                "meanQueueTime": self.total_queue_time / self.hashes if self.hashes else 0.0,
+                "maxQueueTime": self.max_queue_time
+            }
+
+
+def get_hasher():
+    """Gets the password hasher for the current app"""
+    return current_app.extensions["password_hasher"]
+
+
+def hashing_busy():
+    """Builds the 503 response for a request whose hash was refused"""
+    response = jsonify({"msg": "The server is busy, please try again"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
+
+def time_pbkdf2(iterations, repeat=3):
+    """Gets the median time in seconds of one PBKDF2-SHA256 hash"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        hashlib.pbkdf2_hmac("sha256", b"correct horse battery staple", os.urandom(8), iterations)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def pick_iterations(target, timer=time_pbkdf2):
+    """Picks the most PBKDF2 iterations, in steps of ITERATION_STEP, that
+    hash within target seconds on this machine
+
+    :return: (iterations, seconds per hash)
+    """
+    per_iteration = timer(CALIBRATION_ITERATIONS) / CALIBRATION_ITERATIONS
+    iterations = max(ITERATION_STEP, int(target / per_iteration) // ITERATION_STEP * ITERATION_STEP)
+    elapsed = timer(iterations)
+    while elapsed > target and iterations > ITERATION_STEP:
+        iterations -= ITERATION_STEP
+        elapsed = timer(iterations)
+    return iterations, elapsed
+
+
+def init_app(app):
+    """Sets up the password hashing pool, its stats route and the hash cost
+    benchmark"""
+    slots = HostSlots(app.config["SLOT_LOCK_DIR"], "password-hash", app.config["PASSWORD_HASH_CONCURRENCY"])
+    app.extensions["password_hasher"] = PasswordHasher(slots,
+                                                       app.config["PASSWORD_HASH_MAX_WAIT"],
+                                                       app.config["PASSWORD_HASH_ITERATIONS"])
+
+    @app.route("/passwords/stats", methods=["GET"])
+    @jwt_required
+    def password_stats():
+        """Route for this worker's password hashing counters."""
+        return jsonify(get_hasher().stats()), 200
+
+    @app.cli.command("password-hash-cost")
+    @click.option("--target-ms", type=float, default=250, show_default=True,
+                  help="The time one password hash should take.")
+    def password_hash_cost_command(target_ms):
+        """Picks PASSWORD_HASH_ITERATIONS for a target hash time on this machine."""
+        iterations, elapsed = pick_iterations(target_ms / 1000)
+        current = app.config["PASSWORD_HASH_ITERATIONS"]
+        click.echo("Current: {:>9,} iterations, {:>6.0f} ms".format(current, time_pbkdf2(current) * 1000))
+        click.echo("Picked:  {:>9,} iterations, {:>6.0f} ms".format(iterations, elapsed * 1000))
+        click.echo("At PASSWORD_HASH_CONCURRENCY = {}, that is at most {:.0f} logins per second"
+                   .format(app.config["PASSWORD_HASH_CONCURRENCY"],
+                           app.config["PASSWORD_HASH_CONCURRENCY"] / elapsed))
+        click.echo("Set PASSWORD_HASH_ITERATIONS = {}".format(iterations))
@@ -1,17 +1,36 @@
-import os
 import logging
 
-from PIL import Image
 from flask import (
     Blueprint, request, jsonify
 )
-from flask_jwt_extended import jwt_required
 from marshmallow import ValidationError, RAISE
 from sentry_sdk import capture_exception
 
-from .db import get_db
-from .image_utils import decorate_image_filename, resize_image
-from .schemas import PsalmsSchema, PsalmsListSchema
+from .cache import cached_query, catalog_changed, conditional_catalog_response, make_key
+from .db import bulk_replace, get_db, summarize_bulk_results
+from .image_utils import ImageRejected
+from .pagination import PageArgsError, parse_page_args, set_next_page_link, stream_json_array
+from .schemas import PsalmsSchema, get_schema, load_psalms
+from .snapshots import Snapshot
+from .tokens import jwt_required
+from .uploads import accepts_uploads, check_upload, store_batch, store_upload, upload_response
+
+# Fields holding a psalm's image records by image type, which only uploads change
+IMAGE_FIELDS = {
+    "demo": "demoImage",
+    "thumbnail": "thumbnailImage"
+}
+
+# Fields holding a psalm's image paths by image type
+PATH_FIELDS = {
+    "demo": "demoPath",
+    "thumbnail": "thumbnailPath"
+}
+
+
+def psalm_cursor(psalm):
+    """Gets the page cursor of a psalm, its unique number"""
+    return psalm["number"]
 
 
 def build_bp(app):
@@ -22,15 +41,31 @@ def build_bp(app):
 
     @bp.route("/", methods=["GET"])
     def get_psalms():
-        db = get_db()
+        try:
+            limit, after, stream = parse_page_args(app.config["CATALOG_MAX_PAGE_SIZE"])
+        except PageArgsError as e:
+            return jsonify({"msg": str(e)}), 400
+
+        key = make_key("psalms", limit, after, stream)
 
-        query_res = db.database.psalms.find()
-        metadata = []
-        for psalm in query_res:
-            psalm.pop("_id", None)
-            metadata.append(psalm)
+        def find_psalms():
+            query_filter = {} if after is None else {"number": {"$gt": after}}
+            cursor = get_db().database.psalms.find(query_filter, {"_id": 0})
+            if limit is not None or after is not None:
+                cursor = cursor.sort("number")
+            if limit is not None:
+                cursor = cursor.limit(limit)
+            return cursor
 
-        return jsonify(metadata), 200
+        def build_response():
+            if stream:
+                cursor = find_psalms().batch_size(app.config["CATALOG_STREAM_BATCH_SIZE"])
+                return stream_json_array(cursor) or (jsonify([]), 200)
+
+            snapshot = cached_query(key, lambda: Snapshot.build(list(find_psalms())))
+            return set_next_page_link(snapshot.to_response(), "psalms.get_psalms", snapshot, psalm_cursor, limit), 200
+
+        return conditional_catalog_response(key, build_response)
 
     @bp.route("/add", methods=["PUT"])
     @jwt_required
@@ -39,7 +74,7 @@ def build_bp(app):
             return jsonify({"msg": "Request body must be application/json"}), 400
 
         try:
-            psalm = PsalmsSchema().load(request.json, unknown=RAISE)
+            psalm = get_schema(PsalmsSchema).load(request.json, unknown=RAISE)
         except ValidationError as e:
             return jsonify(e.messages), 400
 
@@ -50,12 +85,17 @@ def build_bp(app):
             return jsonify({"msg": "Psalm {} already exists".format(psalm["number"])}), 400
 
         psalms.insert_one(psalm)
+        catalog_changed()
         return jsonify({}), 201
 
     @bp.route("/upload", methods=["POST"])
     @jwt_required
+    @accepts_uploads
     def upload_image_to_metadata_image_store():
-        """Uploads a psalm image to the image store. Function is idempotent."""
+        """Uploads a psalm image to the image store. The original is stored
+        under its content hash straight away and the derivatives are
+        rendered by an image job. Uploading the same bytes again does
+        nothing."""
         if not request.content_type.startswith("multipart/form-data"):
             return jsonify({"msg": "Please use multipart/form-data"}), 400
 
@@ -79,41 +119,63 @@ def build_bp(app):
         if not psalm:
             return jsonify({"msg": "Psalm {} not found".format(number)}), 404
 
-        try:
-            with Image.open(file.stream) as im:
-                base_dir = app.config["IMAGE_STORE_DIR"]
-
-                if not os.path.isdir(base_dir):
-                    os.mkdir(base_dir)
-
-                if image_type == "thumbnail":
-                    base_name = os.path.join(base_dir, psalm["thumbnailPath"] + ".jpg")
-                    try:
-                        im.save(base_name)
-                    except IOError as e:
-                        logging.exception("Error saving thumbnail image: %s", e)
-                        if app.config["ENV"] == "prod":
-                            capture_exception(e)
-                        return jsonify({"msg": "Error saving thumbnail image"}), 500
-                elif image_type == "demo":
-                    base_name = os.path.join(base_dir, psalm["demoPath"])
-                    try:
-                        large_img = resize_image(im, 800)
-                        thumbnail_img = resize_image(im, 64)
-                        large_img.save(decorate_image_filename(base_name, "large"))
-                        thumbnail_img.save(decorate_image_filename(base_name, "thumbnail"))
-                    except IOError as e:
-                        logging.exception("Error processing or saving demo image: %s", e)
-                        if app.config["ENV"] == "prod":
-                            capture_exception(e)
-                        return jsonify({"msg": "Error saving demo image"}), 500
-                else:
-                    return jsonify({"msg": "Please enter a valid image type"}), 400
+        if image_type not in PATH_FIELDS:
+            return jsonify({"msg": "Please enter a valid image type"}), 400
 
+        try:
+            extension = check_upload(file.stream)
+        except ImageRejected as e:
+            return jsonify({"msg": str(e)}), 400
         except IOError:
-            jsonify({"msg": "Please upload a valid image file."}), 400
+            return jsonify({"msg": "Please upload a valid image file."}), 400
 
-        return jsonify({}), 201
+        try:
+            result = store_upload(file.stream, extension, db.database.psalms, psalm, "number",
+                                  IMAGE_FIELDS[image_type], psalm[PATH_FIELDS[image_type]], "psalm-" + image_type,
+                                  app.config["IMAGE_PROFILES"]["psalm-" + image_type])
+        except IOError as e:
+            logging.exception("Error saving original %s image: %s", image_type, e)
+            if app.config["ENV"] == "prod":
+                capture_exception(e)
+            return jsonify({"msg": "Error saving {} image".format(image_type)}), 500
+        return upload_response(result)
+
+    @bp.route("/upload/batch", methods=["POST"])
+    @jwt_required
+    @accepts_uploads
+    def upload_images_to_metadata_image_store():
+        """Uploads images for many psalms at once. Each file part is matched
+        to the number and imageType parts in the same position, and the
+        response lists the outcome for each file."""
+        if not request.content_type.startswith("multipart/form-data"):
+            return jsonify({"msg": "Please use multipart/form-data"}), 400
+
+        files = request.files.getlist("file")
+        numbers = request.form.getlist("number")
+        image_types = request.form.getlist("imageType")
+
+        if not files:
+            return jsonify({"msg": "Request must include a file to upload"}), 400
+        if len(files) > app.config["IMAGE_UPLOAD_BATCH_MAX"]:
+            return jsonify({"msg": "Please upload at most {} files at once"
+                            .format(app.config["IMAGE_UPLOAD_BATCH_MAX"])}), 400
+        if len(numbers) != len(files) or len(image_types) != len(files):
+            return jsonify({"msg": "Please specify a number and image type for each file"}), 400
+        try:
+            numbers = [int(number) for number in numbers]
+        except ValueError:
+            return jsonify({"msg": "Please use a valid Psalm number"}), 400
+        if any(number <= 0 for number in numbers):
+            return jsonify({"msg": "Please use a valid Psalm number"}), 400
+        if any(image_type not in PATH_FIELDS for image_type in image_types):
+            return jsonify({"msg": "Please enter a valid image type"}), 400
+
+        items = [
+            (number, file, IMAGE_FIELDS[image_type], PATH_FIELDS[image_type], "psalm-" + image_type,
+             app.config["IMAGE_PROFILES"]["psalm-" + image_type])
+            for number, file, image_type in zip(numbers, files, image_types)
+        ]
+        return jsonify({"results": store_batch(get_db().database.psalms, "number", items)}), 200
 
     @bp.route("/update", methods=["POST"])
     @jwt_required
@@ -122,16 +184,16 @@ def build_bp(app):
             return jsonify({"msg": "Request body must be application/json"}), 400
 
         try:
-            new_psalms = PsalmsListSchema().load(request.json, unknown=RAISE)
+            new_psalms = load_psalms(request.json)
         except ValidationError as e:
             return jsonify(e.messages), 400
 
         psalms = get_db().database.psalms
+        results = bulk_replace(psalms, "number", new_psalms["psalms"], app.config["BULK_WRITE_CHUNK_SIZE"],
+                               preserve=tuple(IMAGE_FIELDS.values()))
+        catalog_changed()
 
-        for new_psalm in new_psalms["psalms"]:
-            psalms.replace_one({"number": new_psalm["number"]}, new_psalm)
-
-        return jsonify({}), 200
+        return jsonify(summarize_bulk_results(results)), 200
 
     @bp.route("/delete", methods=["DELETE"])
     @jwt_required
@@ -142,6 +204,7 @@ def build_bp(app):
         number = request.json.get("number")
         psalms = get_db().database.psalms
         psalms.delete_one({"number": number})
+        catalog_changed()
         return jsonify({}), 200
 
     # End route definitions
@@ -0,0 +1,263 @@
+import json
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image
+
+from .art import IMAGE_FIELD
+from .image_utils import (
+    FORMAT_EXTENSIONS, ORIGINAL_EXTENSIONS, decorate_image_filename, profile_size, render_profiles,
+    rendered_files, set_max_image_pixels, supported_formats
+)
+from .jobs import JOB_QUEUED, JOB_RUNNING, record_result
+from .psalms import IMAGE_FIELDS, PATH_FIELDS
+from .storage import cached_file, process_storage, storage_settings
+
+# Where a document keeps an image: the field holding its image record, the
+# field holding the path its files are named after and the image job kind
+ImageSlot = namedtuple("ImageSlot", "collection key field path_field kind")
+
+IMAGE_SLOTS = (ImageSlot("art", "title", IMAGE_FIELD, "path", "art"),) + tuple(
+    ImageSlot("psalms", "number", field, PATH_FIELDS[image_type], "psalm-" + image_type)
+    for image_type, field in IMAGE_FIELDS.items()
+)
+
+# Image statuses in a reconcile report
+IMAGE_OK = "ok"
+IMAGE_MISSING = "missing"
+IMAGE_STALE = "stale"
+IMAGE_PENDING = "pending"
+IMAGE_NO_ORIGINAL = "missingOriginal"
+
+
+class Checkpoint:
+    """Records the images a reconcile run has regenerated, one JSON line
+    each, so a run that is interrupted picks up where it stopped."""
+
+    def __init__(self, path, restart=False):
+        self.path = path
+        self.done = set()
+        if restart:
+            self.clear()
+        elif os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        self.done.add(tuple(json.loads(line)))
+                    except ValueError:
+                        pass  # A line cut short when the last run stopped
+
+    @staticmethod
+    def image_id(image):
+        return image["collection"], image["value"], image["field"], image["hash"]
+
+    def __contains__(self, image):
+        return self.image_id(image) in self.done
+
+    def add(self, image):
+        """Records that an image has been regenerated"""
+        self.done.add(self.image_id(image))
+        with open(self.path, "a") as f:
+            f.write(json.dumps(self.image_id(image)) + "\n")
+
+    def clear(self):
+        """Deletes the checkpoint once a run has finished"""
+        self.done = set()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+def expected_derivatives(width, height, profiles):
+    """Gets the derivatives render_profiles gives a width x height original
+    with the current profiles, in the shape it records them"""
+    derivatives = {}
+    for name, profile in profiles.items():
+        size = profile_size(width, height, profile)
+        if size is not None:
+            derivatives[name] = {
+                "width": size[0],
+                "height": size[1],
+                "formats": [FORMAT_EXTENSIONS[image_format] for image_format in supported_formats(profile["formats"])]
+            }
+    return derivatives
+
+
+def original_size(record):
+    """Gets an original's size from its image record, or from the image
+    header for records stored before sizes were recorded
+
+    :return: (width, height), or None if the original is not stored
+    """
+    if record.get("originalSize"):
+        return record["originalSize"]["width"], record["originalSize"]["height"]
+    path = cached_file(record["original"])
+    if path is None:
+        return None
+    with Image.open(path) as im:
+        return im.size
+
+
+def legacy_files(path, profiles):
+    """Lists the files an image uploaded before content-hashed names could
+    have been stored under"""
+    files = [decorate_image_filename(path, "original", extension) for extension in ORIGINAL_EXTENSIONS.values()]
+    for name, profile in profiles.items():
+        files.extend("{}{}.{}".format(path, profile.get("suffix", "-" + name), extension)
+                     for extension in FORMAT_EXTENSIONS.values())
+    return files
+
+
+def scan(database, storage, all_profiles, slots=IMAGE_SLOTS):
+    """Compares the image store with the images the catalog points at.
+
+    Each image record is checked for its original and for the derivatives
+    the current profiles give it. A record whose files are all stored is
+    still stale if its recorded derivatives differ from the profiles, e.g.
+    after a size changes. Stored files no record expects are orphans, except
+    the files of documents that still have an image from before uploads
+    were content-hashed, which are listed as legacy files and kept.
+
+    :param all_profiles: Derivative profiles by job kind
+    :return: {"images": a status and the missing files for each image,
+        "orphans": keys, "legacy": keys}
+    """
+    keys = set(storage.keys())
+    expected = set()
+    legacy = set()
+    images = []
+
+    for slot in slots:
+        profiles = all_profiles[slot.kind]
+        projection = {slot.key: True, slot.field: True, slot.path_field: True}
+        for document in database[slot.collection].find({}, projection):
+            record = document.get(slot.field)
+            if not record:
+                if document.get(slot.path_field):
+                    legacy.update(legacy_files(document[slot.path_field], profiles))
+                continue
+
+            image = {
+                "collection": slot.collection,
+                "key": slot.key,
+                "value": document[slot.key],
+                "field": slot.field,
+                "kind": slot.kind,
+                "name": record["name"],
+                "original": record["original"],
+                "hash": record["hash"],
+                "missing": []
+            }
+            images.append(image)
+            expected.add(record["original"])
+
+            size = original_size(record) if record["original"] in keys else None
+            if size is None:
+                image["status"] = IMAGE_NO_ORIGINAL
+                continue
+
+            derivatives = expected_derivatives(size[0], size[1], profiles)
+            files = rendered_files(record["name"], profiles, {"derivatives": derivatives})
+            expected.update(files)
+            image["missing"] = [key for key in files if key not in keys]
+
+            if record.get("derivatives") is None and is_job_pending(database, record.get("jobId")):
+                image["status"] = IMAGE_PENDING
+            elif image["missing"]:
+                image["status"] = IMAGE_MISSING
+            elif record["derivatives"] != derivatives:
+                image["status"] = IMAGE_STALE
+            else:
+                image["status"] = IMAGE_OK
+
+    return {
+        "images": images,
+        "orphans": sorted(keys - expected - legacy),
+        "legacy": sorted(keys & legacy - expected)
+    }
+
+
+def is_job_pending(database, job_id):
+    """Checks whether an image job is still waiting or running"""
+    job = database.imageJobs.find_one({"_id": job_id}, {"status": True})
+    return job is not None and job["status"] in (JOB_QUEUED, JOB_RUNNING)
+
+
+def regenerate_image(original, base_dir, name, profiles, encode_threads, settings):
+    """Reconcile task that renders an image's derivatives again from its
+    original and stores them. The original is fetched into the image store
+    directory if this host has no copy, and is not stored again.
+
+    :param settings: The storage settings, see storage_settings
+    :return: As for render_profiles
+    """
+    storage = process_storage(settings)
+    source_path = os.path.join(base_dir, original)
+    if not os.path.isfile(source_path) and not storage.fetch(original, source_path):
+        raise IOError("Original {} is not stored".format(original))
+
+    base_name = os.path.join(base_dir, name)
+    rendered = render_profiles(source_path, base_name, profiles, encode_threads)
+    storage.put_files([(os.path.basename(path), path) for path in rendered_files(base_name, profiles, rendered)])
+    return rendered
+
+
+def regenerate(database, images, config, workers, checkpoint, report=None):
+    """Regenerates images on a pool of worker processes, recording each
+    result on its image record and in the checkpoint as it finishes. Images
+    already in the checkpoint are skipped. With workers set to 0, each image
+    is rendered in this process instead, on the app's encoding threads.
+
+    :param report: Called with (image, error) as each image finishes
+    :return: The number of images that failed
+    """
+    base_dir = config["IMAGE_STORE_DIR"]
+    os.makedirs(base_dir, exist_ok=True)
+    settings = storage_settings(config)
+    encode_threads = config["IMAGE_ENCODE_THREADS"] if workers == 0 else 1
+    images = [image for image in images if image not in checkpoint]
+    failed = 0
+
+    def task_args(image):
+        return (image["original"], base_dir, image["name"], config["IMAGE_PROFILES"][image["kind"]],
+                encode_threads, settings)
+
+    def finish(image, result, error):
+        nonlocal failed
+        if error is None:
+            record_result(database, (image["collection"], {image["key"]: image["value"]}, image["field"],
+                                     image["hash"]), result)
+            checkpoint.add(image)
+        else:
+            logging.error("Could not regenerate %s: %s", image["name"], error)
+            failed += 1
+        if report is not None:
+            report(image, error)
+
+    if workers == 0:
+        for image in images:
+            try:
+                result = regenerate_image(*task_args(image))
+            except Exception as e:
+                finish(image, None, e)
+            else:
+                finish(image, result, None)
+        return failed
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_max_image_pixels,
+                             initargs=(config["IMAGE_MAX_PIXELS"],)) as executor:
+        futures = {executor.submit(regenerate_image, *task_args(image)): image for image in images}
+        for future in as_completed(futures):
+            error = future.exception()
+            finish(futures[future], None if error else future.result(), error)
+    return failed
+
+
+def delete_orphans(storage, base_dir, keys):
+    """Deletes orphaned files from the storage backend and the local cache"""
+    for key in keys:
+        storage.delete(key)
+        path = os.path.join(base_dir, key)
+        if os.path.isfile(path):
+            os.remove(path)
@@ -0,0 +1,208 @@
+import datetime
+import hashlib
+import math
+import os
+import threading
+import time
+
+from flask import current_app
+from flask_jwt_extended.config import config
+from flask_jwt_extended.exceptions import RevokedTokenError
+
+from .db import get_db
+
+# How far back an incremental refresh re-reads, so revocations stamped by a
+# host with a slightly slow clock are not skipped
+REFRESH_OVERLAP = datetime.timedelta(seconds=60)
+
+
+class BloomFilter:
+    """A fixed-size Bloom filter of strings. Lookups can give false
+    positives at about error_rate once capacity items are in, but never
+    false negatives."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.sha256(item.encode()).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:16], "big") | 1
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, item):
+        """Adds an item, counting it unless it already seemed to be in
+
+        :return: Whether the item was new
+        """
+        new = False
+        for position in self._positions(item):
+            if not self._bits[position >> 3] & (1 << (position & 7)):
+                self._bits[position >> 3] |= 1 << (position & 7)
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __contains__(self, item):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+def token_entry(jti):
+    """Gets the revocation _id of a single token"""
+    return "jti:" + jti
+
+
+def user_entry(username):
+    """Gets the revocation _id of every token issued to a user before a
+    time. Token iat claims are whole seconds, so the time is too: tokens
+    issued in an earlier second than it are revoked, and tokens issued in
+    the same second or later are not, so a user can log in again straight
+    after revoking every token."""
+    return "user:" + username
+
+
+def live_entries(now):
+    """Builds the query for revocations that have not expired. Entries for
+    tokens issued without an expiry never expire."""
+    return {"$or": [{"expires": {"$gt": now}}, {"expires": None}]}
+
+
+class RevocationList:
+    """Per-worker view of the revokedTokens collection.
+
+    Every revocation is added to a Bloom filter, so a token that was never
+    revoked is cleared without a database round trip; only a possible hit
+    is checked against the collection. Workers read revocations made since
+    their last refresh at most once per check interval, so a token revoked
+    through another worker stops working within that interval. Expired
+    entries are never taken out of the filter, so it is rebuilt from the
+    live entries once it is full, with room for twice as many if there are
+    more than it was sized for.
+    """
+
+    def __init__(self, capacity, error_rate, check_interval):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.check_interval = check_interval
+        self.filter = BloomFilter(capacity, error_rate)
+        self.lookups = 0
+        self.possible_hits = 0
+        self.revoked = 0
+        self._since = None
+        self._last_check = None
+        self._lock = threading.Lock()
+
+    def sync(self, database, force=False):
+        """Adds revocations made since the last refresh to the filter if the
+        check interval has passed"""
+        now = time.monotonic()
+        if not force and self._last_check is not None and now - self._last_check < self.check_interval:
+            return
+
+        rebuild = self._since is None or self.filter.count >= self.filter.capacity
+        if rebuild:
+            query = live_entries(datetime.datetime.utcnow())
+        else:
+            query = {"revoked": {"$gte": self._since - REFRESH_OVERLAP}}
+        entries = list(database.revokedTokens.find(query, {"revoked": True}))
+
+        with self._lock:
+            if rebuild:
+                self.filter = BloomFilter(max(self.capacity, 2 * len(entries)), self.error_rate)
+            for entry in entries:
+                self.filter.add(entry["_id"])
+                if self._since is None or entry["revoked"] > self._since:
+                    self._since = entry["revoked"]
+            if self._since is None:
+                self._since = datetime.datetime.utcnow()
+            self._last_check = now
+
+    def add(self, entry_id):
+        """Adds a revocation made by this worker to the filter"""
+        with self._lock:
+            self.filter.add(entry_id)
+
+    def is_revoked(self, database, claims):
+        """Checks whether a verified token has been revoked"""
+        self.sync(database)
+        candidates = [user_entry(claims[config.identity_claim_key])]
+        if claims.get("jti"):
+            candidates.append(token_entry(claims["jti"]))
+
+        with self._lock:
+            self.lookups += 1
+            candidates = [candidate for candidate in candidates if candidate in self.filter]
+            if not candidates:
+                return False
+            self.possible_hits += 1
+
+        for entry in database.revokedTokens.find({"_id": {"$in": candidates}}):
+            if entry["_id"].startswith("jti:") or claims.get("iat", 0) < entry["before"]:
+                with self._lock:
+                    self.revoked += 1
+                return True
+        return False
+
+    def stats(self):
+        """Gets the filter and lookup counters for this worker"""
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "filterEntries": self.filter.count,
+                "filterCapacity": self.filter.capacity,
+                "lookups": self.lookups,
+                "possibleHits": self.possible_hits,
+                "revoked": self.revoked,
+                "cleared": self.possible_hits - self.revoked
+            }
+
+
+def get_revocations():
+    """Gets the revocation list for the current app"""
+    return current_app.extensions["revocations"]
+
+
+def check_not_revoked(claims):
+    """Raises RevokedTokenError, which flask_jwt_extended answers with a 401,
+    if a verified token has been revoked"""
+    if get_revocations().is_revoked(get_db().database, claims):
+        raise RevokedTokenError()
+
+
+def revoke_token(claims):
+    """Revokes a single token until it would have expired, or for good if it
+    never expires"""
+    entry_id = token_entry(claims["jti"])
+    get_db().database.revokedTokens.update_one({"_id": entry_id}, {"$set": {
+        "username": claims[config.identity_claim_key],
+        "revoked": datetime.datetime.utcnow(),
+        "expires": datetime.datetime.utcfromtimestamp(claims["exp"]) if "exp" in claims else None
+    }}, upsert=True)
+    get_revocations().add(entry_id)
+
+
+def revoke_user_tokens(username):
+    """Revokes every token issued to a user before the current second, until
+    the last of them would have expired, or for good if tokens never
+    expire"""
+    now = datetime.datetime.utcnow()
+    entry_id = user_entry(username)
+    get_db().database.revokedTokens.update_one({"_id": entry_id}, {"$set": {
+        "username": username,
+        "before": int(time.time()),
+        "revoked": now,
+        "expires": now + config.access_expires if config.access_expires else None
+    }}, upsert=True)
+    get_revocations().add(entry_id)
+
+
+def init_app(app):
+    """Sets up the worker's revocation list"""
+    app.extensions["revocations"] = RevocationList(app.config["REVOCATION_FILTER_CAPACITY"],
+                                                   app.config["REVOCATION_FILTER_ERROR_RATE"],
+                                                   app.config["REVOCATION_CHECK_INTERVAL"])
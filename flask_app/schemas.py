@@ -1,11 +1,20 @@
+import functools
+import math
 import re
 
 from werkzeug.utils import secure_filename
-from marshmallow import Schema, fields, post_load, validates, ValidationError, validates_schema
+from marshmallow import RAISE, Schema, fields, post_load, validates, ValidationError, validates_schema
 
 HEX_COLOR_PATTERN = re.compile("^#(?:[0-9a-fA-F]{3}){1,2}$")
 
 
+@functools.lru_cache(maxsize=16384)
+def title_path(title):
+    """Gets the image path of a piece title. Bulk updates send the same
+    titles again and again, so paths are cached."""
+    return secure_filename(title.lower())
+
+
 class PieceSchema(Schema):
     """Schema for a piece of artwork"""
     key = fields.Integer(required=True)
@@ -13,7 +22,7 @@ class PieceSchema(Schema):
     medium = fields.String(required=True)
     size = fields.String(required=True)
     price = fields.Float(required=True)
-    thumbnailColor = fields.Str(required=True)
+    thumbnailColor = fields.Str()
     collection = fields.String(required=True)
     series = fields.String(default="None")
 
@@ -24,7 +33,7 @@ class PieceSchema(Schema):
 
     @validates("thumbnailColor")
     def validate_thumbnail_color(self, value):
-        if not re.match(HEX_COLOR_PATTERN, value):
+        if not HEX_COLOR_PATTERN.match(value):
             raise ValidationError("Thumbnail color is not a valid hex color code")
 
     @validates_schema
@@ -34,7 +43,7 @@ class PieceSchema(Schema):
 
     @post_load
     def build_path(self, in_data, **kwargs):
-        in_data["path"] = secure_filename(in_data["title"].lower())
+        in_data["path"] = title_path(in_data["title"])
         in_data["price"] = round(in_data["price"] * 100)
         return in_data
 
@@ -61,7 +70,7 @@ class PsalmsStatementSchema(Schema):
 
 class PsalmsSchema(Schema):
     number = fields.Int(required=True)
-    demoThumbnailColor = fields.Str(required=True)
+    demoThumbnailColor = fields.Str()
     statement = fields.Nested(PsalmsStatementSchema)
 
     @validates("number")
@@ -71,7 +80,7 @@ class PsalmsSchema(Schema):
 
     @validates("demoThumbnailColor")
     def validate_demo_thumbnail_color(self, value):
-        if not re.match(HEX_COLOR_PATTERN, value):
+        if not HEX_COLOR_PATTERN.match(value):
             raise ValidationError("Demo thumbnail color is not a valid hex color code")
 
     @post_load
@@ -84,3 +93,153 @@ class PsalmsSchema(Schema):
 class PsalmsListSchema(Schema):
     """Schema for a set of psalms"""
     psalms = fields.List(fields.Nested(PsalmsSchema))
+
+
+@functools.lru_cache(maxsize=None)
+def get_schema(schema_class):
+    """Gets this process's instance of a schema. Schemas keep no state
+    between loads, so one instance serves every request."""
+    return schema_class()
+
+
+# Fields of each schema, as the fast loaders check them
+PIECE_FIELDS = frozenset(PieceSchema._declared_fields)
+PIECE_REQUIRED = frozenset(name for name, field in PieceSchema._declared_fields.items() if field.required)
+PSALM_FIELDS = frozenset(PsalmsSchema._declared_fields)
+STATEMENT_FIELDS = frozenset(PsalmsStatementSchema._declared_fields)
+PARAGRAPH_FIELDS = frozenset(PsalmsParagraphSchema._declared_fields)
+
+
+def is_int(value):
+    return type(value) is int
+
+
+def is_str(value):
+    return type(value) is str
+
+
+def is_price(value):
+    # Integers past 2 ** 53 are left to the schema, which reports overflow
+    if type(value) is float:
+        return math.isfinite(value)
+    return type(value) is int and abs(value) < 2 ** 53
+
+
+def is_color(value):
+    return type(value) is str and HEX_COLOR_PATTERN.match(value) is not None
+
+
+def fast_piece(item):
+    """Loads a piece that is valid as sent, as PieceSchema would
+
+    :return: The loaded piece, or None if the item needs the full schema
+    """
+    if type(item) is not dict or not PIECE_REQUIRED <= item.keys() <= PIECE_FIELDS:
+        return None
+    price = item["price"]
+    if not (is_int(item["key"]) and item["key"] >= 0 and is_str(item["title"]) and is_str(item["medium"])
+            and is_str(item["size"]) and is_price(price)
+            and is_str(item["collection"])):
+        return None
+    if "thumbnailColor" in item and not is_color(item["thumbnailColor"]):
+        return None
+    if "series" in item and not is_str(item["series"]):
+        return None
+    if item["collection"] == "Psalms" and item.get("series", "None") == "None":
+        return None
+
+    piece = {
+        "key": item["key"],
+        "title": item["title"],
+        "medium": item["medium"],
+        "size": item["size"],
+        "price": round(float(price) * 100)
+    }
+    if "thumbnailColor" in item:
+        piece["thumbnailColor"] = item["thumbnailColor"]
+    piece["collection"] = item["collection"]
+    if "series" in item:
+        piece["series"] = item["series"]
+    piece["path"] = title_path(item["title"])
+    return piece
+
+
+def fast_statement(statement):
+    """Loads a psalm statement that is valid as sent, or gives None"""
+    if type(statement) is not dict or "title" not in statement or not statement.keys() <= STATEMENT_FIELDS \
+            or not is_str(statement["title"]):
+        return None
+    loaded = {"title": statement["title"]}
+    if "text" in statement:
+        if type(statement["text"]) is not list:
+            return None
+        paragraphs = []
+        for paragraph in statement["text"]:
+            if type(paragraph) is not dict or paragraph.keys() != PARAGRAPH_FIELDS \
+                    or not is_int(paragraph["key"]) or paragraph["key"] < 0 or not is_str(paragraph["text"]):
+                return None
+            paragraphs.append({"key": paragraph["key"], "text": paragraph["text"]})
+        loaded["text"] = paragraphs
+    return loaded
+
+
+def fast_psalm(item):
+    """Loads a psalm that is valid as sent, as PsalmsSchema would
+
+    :return: The loaded psalm, or None if the item needs the full schema
+    """
+    if type(item) is not dict or "number" not in item or not item.keys() <= PSALM_FIELDS:
+        return None
+    number = item["number"]
+    if not is_int(number) or number <= 0:
+        return None
+    if "demoThumbnailColor" in item and not is_color(item["demoThumbnailColor"]):
+        return None
+
+    psalm = {"number": number}
+    if "demoThumbnailColor" in item:
+        psalm["demoThumbnailColor"] = item["demoThumbnailColor"]
+    if "statement" in item:
+        statement = fast_statement(item["statement"])
+        if statement is None:
+            return None
+        psalm["statement"] = statement
+    # A positive number is already a safe filename
+    psalm["demoPath"] = "{}-demo".format(number)
+    psalm["thumbnailPath"] = "{}-thumbnail".format(number)
+    return psalm
+
+
+def load_bulk(schema_class, key, load_item, data):
+    """Loads a {key: [items]} payload as schema_class().load(data,
+    unknown=RAISE) would, checking each item with plain type checks. If any
+    item needs more than that, e.g. a string number or an invalid field,
+    the whole payload goes through the schema instead, so errors are exactly
+    the schema's.
+    """
+    if type(data) is dict and data.keys() == {key} and type(data[key]) is list:
+        items = []
+        for item in data[key]:
+            loaded = load_item(item)
+            if loaded is None:
+                break
+            items.append(loaded)
+        else:
+            return {key: items}
+    return get_schema(schema_class).load(data, unknown=RAISE)
+
+
+def load_pieces(data):
+    """Loads an /art/update payload, see load_bulk
+
+    :raises ValidationError: As PiecesSchema does
+    """
+    return load_bulk(PiecesSchema, "pieces", fast_piece, data)
+
+
+def load_psalms(data):
+    """Loads a /psalms/update payload, see load_bulk
+
+    :raises ValidationError: As PsalmsListSchema does
+    """
+    return load_bulk(PsalmsListSchema, "psalms", fast_psalm, data)
@@ -0,0 +1,72 @@
+import fcntl
+import os
+import random
+import time
+from contextlib import contextmanager
+
+
+class HostSlots:
+    """A counting semaphore shared by every process on the host.
+
+    Each slot is a lock file, and holding a slot is holding an exclusive
+    flock on it. The kernel drops the lock when the holder exits, so a
+    worker killed while holding a slot (harakiri, the OOM killer, SIGKILL
+    on reload) frees it instead of leaking it. Instances only hold the
+    directory and name, so they can be passed to pool processes.
+    """
+
+    def __init__(self, directory, name, count, poll_interval=0.01):
+        self.directory = directory
+        self.name = name
+        self.count = count
+        self.poll_interval = poll_interval
+
+    def path(self, index):
+        """Gets the lock file of a slot"""
+        return os.path.join(self.directory, "{}-{}.lock".format(self.name, index))
+
+    def try_acquire(self):
+        """Takes a free slot if there is one
+
+        :return: The slot's open file descriptor, or None
+        """
+        start = random.randrange(self.count)
+        for offset in range(self.count):
+            fd = os.open(self.path((start + offset) % self.count), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            return fd
+        return None
+
+    def acquire(self, timeout=None):
+        """Waits for a free slot
+
+        :param timeout: Seconds to wait, or None to wait for as long as it takes
+        :return: The slot's open file descriptor, or None on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        os.makedirs(self.directory, exist_ok=True)
+        while True:
+            fd = self.try_acquire()
+            if fd is not None:
+                return fd
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def release(self, fd):
+        """Frees a slot taken with acquire"""
+        os.close(fd)
+
+    @contextmanager
+    def slot(self):
+        """Holds a slot for the duration of a with block, waiting as long as
+        it takes for one"""
+        fd = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(fd)
@@ -0,0 +1,71 @@
+import gzip
+import threading
+
+from flask import current_app, json, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+# Content codings in order of preference when the client accepts several
+ENCODINGS = ("br", "gzip", "identity")
+
+
+class Snapshot:
+    """A catalog response serialized once, with compressed variants.
+
+    Snapshots are what the catalog cache holds, so each is serialized once
+    per catalog change in each worker and every other request is served
+    from the stored bytes with no BSON decoding, dict work or JSON encoding.
+    A compressed variant is only made the first time a client asks for
+    that coding, so a filter or page nobody fetches compressed never pays
+    for compression.
+    """
+
+    def __init__(self, documents, compress_min_size, gzip_level, brotli_quality):
+        body = json.dumps(documents).encode("utf-8")
+
+        self.count = len(documents)
+        self.last = documents[-1] if documents else None
+        self.variants = {"identity": body}
+        self.encodings = ["identity"]
+        if len(body) >= compress_min_size:
+            self.encodings.insert(0, "gzip")
+            if brotli is not None:
+                self.encodings.insert(0, "br")
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self._lock = threading.Lock()
+
+    def variant(self, encoding):
+        """Gets the body in a content coding, compressing it on first use"""
+        if encoding not in self.variants:
+            with self._lock:
+                if encoding not in self.variants:
+                    body = self.variants["identity"]
+                    if encoding == "br":
+                        self.variants["br"] = brotli.compress(body, quality=self.brotli_quality)
+                    else:
+                        self.variants["gzip"] = gzip.compress(body, compresslevel=self.gzip_level)
+        return self.variants[encoding]
+
+    @classmethod
+    def build(cls, documents):
+        """Builds a snapshot with the app's compression settings"""
+        config = current_app.config
+        return cls(documents,
+                   config["CATALOG_COMPRESS_MIN_SIZE"],
+                   config["CATALOG_GZIP_LEVEL"],
+                   config["CATALOG_BROTLI_QUALITY"])
+
+    def to_response(self):
+        """Builds a response from the variant best matching Accept-Encoding"""
+        available = [encoding for encoding in ENCODINGS if encoding in self.encodings]
+        encoding = request.accept_encodings.best_match(available, default="identity")
+
+        response = current_app.response_class(self.variant(encoding), mimetype="application/json")
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        return response
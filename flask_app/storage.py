@@ -0,0 +1,267 @@
+import mimetypes
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, safe_join
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig, create_transfer_manager
+    from botocore.exceptions import ClientError
+except ImportError:  # pragma: no cover - boto3 is only needed for S3 storage
+    boto3 = None
+
+_storage_lock = threading.Lock()
+
+# Backends built in this process, by settings
+_backends = {}
+
+# Missing keys remembered by each process
+MISS_CACHE_MAX_ENTRIES = 4096
+
+
+class LocalStorage:
+    """Keeps the image store in a local directory.
+
+    The directory is the image store directory itself, so files uploaded
+    or rendered there are already stored and nothing is copied.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+
+    def path(self, key):
+        """Gets the local path a file is stored at"""
+        return os.path.join(self.base_dir, key)
+
+    def put_files(self, files):
+        """Stores local files
+
+        :param files: (key, local path) for each file
+        """
+        for key, path in files:
+            if os.path.abspath(path) != os.path.abspath(self.path(key)):
+                shutil.copyfile(path, self.path(key))
+
+    def fetch(self, key, path):
+        """Copies a stored file to a local path
+
+        :return: False if nothing is stored under key
+        """
+        if not os.path.isfile(self.path(key)):
+            return False
+        if os.path.abspath(path) != os.path.abspath(self.path(key)):
+            shutil.copyfile(self.path(key), path)
+        return True
+
+    def exists(self, key):
+        """Checks whether a file is stored under key"""
+        return os.path.isfile(self.path(key))
+
+    def delete(self, key):
+        """Deletes a stored file if it exists"""
+        if os.path.isfile(self.path(key)):
+            os.remove(self.path(key))
+
+    def keys(self):
+        """Lists the keys of every stored file"""
+        if not os.path.isdir(self.base_dir):
+            return
+        for entry in os.scandir(self.base_dir):
+            if entry.is_file() and not entry.name.startswith("."):
+                yield entry.name
+
+
+class S3Storage:
+    """Keeps the image store in an S3-compatible bucket, e.g. AWS S3 or a
+    MinIO server given as the endpoint URL.
+
+    Files are sent with boto3's managed transfers. Files over the multipart
+    threshold go up as multipart uploads, and put_files sends every file of
+    a call through one transfer manager, so parts and whole files are sent
+    in parallel on at most concurrency threads. Credentials come from
+    boto3's usual environment and config file lookup.
+    """
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, region=None, concurrency=8,
+                 multipart_threshold=8 * 1024 * 1024, cache_control=None):
+        if boto3 is None:
+            raise RuntimeError("S3 image storage needs boto3")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.cache_control = cache_control
+        self.client = boto3.session.Session().client("s3", endpoint_url=endpoint_url, region_name=region)
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_threshold,
+                                              multipart_chunksize=multipart_threshold,
+                                              max_concurrency=concurrency)
+
+    def object_key(self, key):
+        """Gets the bucket key a file is stored under"""
+        return self.prefix + key
+
+    def put_files(self, files):
+        """Stores local files, sending them in parallel
+
+        :param files: (key, local path) for each file
+        """
+        with create_transfer_manager(self.client, self.transfer_config) as manager:
+            futures = [
+                manager.upload(path, self.bucket, self.object_key(key), extra_args=self.upload_args(key))
+                for key, path in files
+            ]
+            for future in futures:
+                future.result()
+
+    def upload_args(self, key):
+        """Gets the object headers a file is stored with"""
+        args = {"ContentType": mimetypes.guess_type(key)[0] or "application/octet-stream"}
+        if self.cache_control is not None:
+            args["CacheControl"] = self.cache_control
+        return args
+
+    def fetch(self, key, path):
+        """Downloads a stored file to a local path. boto3 downloads to a
+        temporary name and renames it, so a partial file is never left at
+        path.
+
+        :return: False if nothing is stored under key
+        """
+        try:
+            self.client.download_file(self.bucket, self.object_key(key), path, Config=self.transfer_config)
+        except ClientError as e:
+            if is_not_found(e):
+                return False
+            raise
+        return True
+
+    def exists(self, key):
+        """Checks whether a file is stored under key"""
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+        except ClientError as e:
+            if is_not_found(e):
+                return False
+            raise
+        return True
+
+    def delete(self, key):
+        """Deletes a stored file if it exists"""
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+    def keys(self):
+        """Lists the keys of every stored file"""
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", ()):
+                yield item["Key"][len(self.prefix):]
+
+
+class MissCache:
+    """Per-process record of keys the storage backend did not have, each
+    forgotten after its TTL. Once full, the oldest entry is dropped."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Checks whether key was recently missing"""
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is None:
+                return False
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return False
+            return True
+
+    def add(self, key, ttl):
+        """Remembers that key is missing for ttl seconds"""
+        with self._lock:
+            self._entries[key] = time.monotonic() + ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_misses = MissCache(MISS_CACHE_MAX_ENTRIES)
+
+
+def is_not_found(error):
+    """Checks whether a boto3 error means the object does not exist"""
+    return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+
+def storage_settings(config):
+    """Gets the image storage settings from the app config as a plain dict,
+    so image job processes can build the same backend"""
+    return {
+        "backend": config["IMAGE_STORAGE"],
+        "base_dir": config["IMAGE_STORE_DIR"],
+        "bucket": config["IMAGE_S3_BUCKET"],
+        "prefix": config["IMAGE_S3_PREFIX"],
+        "endpoint_url": config["IMAGE_S3_ENDPOINT_URL"],
+        "region": config["IMAGE_S3_REGION"],
+        "concurrency": config["IMAGE_TRANSFER_CONCURRENCY"],
+        "multipart_threshold": config["IMAGE_MULTIPART_THRESHOLD"],
+        "cache_control": "public, max-age={}, immutable".format(config["IMAGE_CACHE_MAX_AGE"])
+    }
+
+
+def build_storage(settings):
+    """Builds the backend named in the storage settings"""
+    if settings["backend"] == "s3":
+        return S3Storage(settings["bucket"], settings["prefix"], settings["endpoint_url"], settings["region"],
+                         settings["concurrency"], settings["multipart_threshold"], settings["cache_control"])
+    if settings["backend"] == "local":
+        return LocalStorage(settings["base_dir"])
+    raise ValueError("Unknown image storage backend \"{}\"".format(settings["backend"]))
+
+
+def process_storage(settings):
+    """Gets the backend for the storage settings in this process, building
+    it on first use. As with the database client, a backend inherited
+    through a fork is replaced."""
+    key = (os.getpid(), tuple(sorted(settings.items())))
+    if key not in _backends:
+        with _storage_lock:
+            if key not in _backends:
+                _backends[key] = build_storage(settings)
+    return _backends[key]
+
+
+def get_storage():
+    """Gets the image storage backend for the current worker process"""
+    return process_storage(storage_settings(current_app.config))
+
+
+def cached_file(key):
+    """Gets the local path of a stored file. The image store directory is a
+    write-through cache of the backend: files written by this host are
+    already there, and any other file is downloaded into it on first read.
+    A key the backend does not have is remembered for IMAGE_MISS_CACHE_TTL
+    seconds, so asking again does not cost another backend call.
+
+    :return: The path, or None if nothing is stored under key
+    """
+    # Stored keys are flat names
+    if not key or os.path.dirname(key) or key.startswith("."):
+        return None
+    base_dir = os.path.abspath(current_app.config["IMAGE_STORE_DIR"])
+    path = safe_join(base_dir, key)
+    if path is None:
+        return None
+    if os.path.isfile(path):
+        return path
+
+    if _misses.get(key):
+        return None
+    os.makedirs(base_dir, exist_ok=True)
+    if get_storage().fetch(key, path):
+        return path
+    _misses.add(key, current_app.config["IMAGE_MISS_CACHE_TTL"])
+    return None
@@ -0,0 +1,130 @@
+import datetime
+import math
+
+from flask import current_app, jsonify
+from pymongo.errors import DuplicateKeyError
+
+# Times to retry a state update that lost a race with another worker
+UPDATE_ATTEMPTS = 5
+
+
+def throttle_keys(username, address):
+    """Gets the key failed logins are counted under in each of the
+    LOGIN_THROTTLES buckets. Failures are counted per username, so one
+    account attacked from many addresses is throttled, and per client
+    address, so one address trying many usernames is throttled."""
+    return {"username": "username:" + username, "address": "address:" + address}
+
+
+def retry_after(state, now):
+    """Gets the whole seconds until a throttled key may try again, or None if
+    it is not throttled"""
+    if state is None or state.get("lockedUntil") is None or state["lockedUntil"] <= now:
+        return None
+    return math.ceil((state["lockedUntil"] - now).total_seconds())
+
+
+def spend_attempt(state, now, burst, refill, backoff_base, lockout, memory):
+    """Takes a failed attempt out of a key's token bucket.
+
+    The bucket holds burst attempts and regains one every refill seconds,
+    counted from the end of any lock. When it cannot cover another attempt
+    the key is locked until it can, and for at least a backoff that doubles
+    each time this happens, but never for more than lockout seconds. A key
+    that fails nothing for memory seconds starts over.
+
+    :param state: The key's stored state, or None for a new key
+    :return: The new state
+    """
+    if state is None:
+        tokens, lockouts = float(burst), 0
+    else:
+        since = max(state["updated"], state["lockedUntil"] or state["updated"])
+        tokens = min(float(burst), state["tokens"] + max(0.0, (now - since).total_seconds()) / refill)
+        lockouts = state["lockouts"]
+
+    tokens -= 1
+    locked_until = None
+    if tokens < 1:
+        lockouts += 1
+        delay = min(lockout, max((1 - tokens) * refill, backoff_base * 2 ** (lockouts - 1)))
+        locked_until = now + datetime.timedelta(seconds=delay)
+
+    return {
+        "tokens": tokens,
+        "lockouts": lockouts,
+        "updated": now,
+        "lockedUntil": locked_until,
+        "expires": (locked_until or now) + datetime.timedelta(seconds=memory)
+    }
+
+
+def longest_wait(waits):
+    """Gets the longest of several waits, or None if none of them is set"""
+    waits = [wait for wait in waits if wait is not None]
+    return max(waits) if waits else None
+
+
+def check_login(database, keys):
+    """Checks whether a login may be tried now, which it may only if none of
+    its keys is locked
+
+    :param keys: The login's keys, see throttle_keys
+    :return: The seconds until it may, or None if it may now
+    """
+    now = datetime.datetime.utcnow()
+    states = database.loginAttempts.find({"_id": {"$in": list(keys.values())}})
+    return longest_wait(retry_after(state, now) for state in states)
+
+
+def login_failed(database, keys):
+    """Records a failed login in each of its keys' buckets
+
+    :param keys: The login's keys, see throttle_keys
+    :return: The seconds until the login may be tried again, or None if it
+        may now
+    """
+    throttles = current_app.config["LOGIN_THROTTLES"]
+    return longest_wait(spend_key_attempt(database, key, throttles[bucket]) for bucket, key in keys.items())
+
+
+def spend_key_attempt(database, key, limits):
+    """Takes a failed attempt out of one key's bucket in the shared state
+    every worker reads. The update only applies if no other worker changed
+    the key since it was read, and is retried otherwise.
+
+    :param limits: The bucket's burst, refill, backoff_base and lockout
+    :return: The seconds until the key may try again, or None if it may now
+    """
+    memory = current_app.config["LOGIN_THROTTLE_MEMORY"]
+    state = None
+    for _ in range(UPDATE_ATTEMPTS):
+        now = datetime.datetime.utcnow()
+        current = database.loginAttempts.find_one({"_id": key})
+        state = spend_attempt(current, now, memory=memory, **limits)
+        if current is None:
+            try:
+                database.loginAttempts.insert_one(dict(state, _id=key, version=1))
+            except DuplicateKeyError:
+                continue
+            break
+        updated = database.loginAttempts.update_one({"_id": key, "version": current["version"]},
+                                                    {"$set": state, "$inc": {"version": 1}})
+        if updated.modified_count:
+            break
+    return retry_after(state, state["updated"])
+
+
+def login_succeeded(database, keys):
+    """Forgets the failed logins of the account that logged in. Its address
+    keeps its count, so logging in to one account does not give an
+    address a fresh burst against the others."""
+    database.loginAttempts.delete_one({"_id": keys["username"]})
+
+
+def too_many_attempts(seconds):
+    """Builds the 429 response for a throttled login"""
+    response = jsonify({"msg": "Too many failed login attempts, try again in {} seconds".format(seconds)})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(seconds)
+    return response
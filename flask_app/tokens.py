@@ -0,0 +1,132 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import _app_ctx_stack as ctx_stack
+from flask import current_app, jsonify, request
+from flask_jwt_extended import get_raw_jwt, get_raw_jwt_header, verify_jwt_in_request
+from flask_jwt_extended.config import config
+
+from .revocation import check_not_revoked, get_revocations
+
+
+class TokenCache:
+    """Per-worker cache of verified access tokens.
+
+    Entries map the SHA-256 digest of a token that has passed every check
+    to its claims and header, and the least recently used entry is evicted
+    once the cache is full. An entry is never served past the token's exp
+    claim, so a cached token expires exactly when it would have failed
+    verification. A token that differs by a single byte has another digest
+    and is verified from scratch.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now=None):
+        """Gets a token's cached (claims, header), or None if it is missing
+        or the token has expired"""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0]["exp"] <= now:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, claims, header):
+        """Caches a verified token's claims and header"""
+        if "exp" not in claims:
+            return
+        with self._lock:
+            self._entries[key] = (claims, header)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """Gets the hit and miss counters for this worker"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "pid": os.getpid(),
+                "entries": len(self._entries),
+                "maxEntries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0
+            }
+
+
+def get_token_cache():
+    """Gets the verified token cache for the current app"""
+    return current_app.extensions["token_cache"]
+
+
+def encoded_header_token():
+    """Gets the token from a plain "<type> <token>" authorization header, or
+    None for anything else, which is left to flask_jwt_extended"""
+    parts = request.headers.get(config.header_name, "").split()
+    if config.header_type:
+        if len(parts) != 2 or parts[0] != config.header_type:
+            return None
+        return parts[1]
+    return parts[0] if len(parts) == 1 else None
+
+
+def verify_access_token():
+    """Verifies the request's access token as flask_jwt_extended's
+    verify_jwt_in_request does, serving tokens it has already verified from
+    the token cache, then checks that it has not been revoked. Revocation is
+    checked on every call, so a cached token can still be revoked."""
+    if request.method in config.exempt_methods:
+        return
+
+    token = encoded_header_token()
+    if token is None:
+        verify_jwt_in_request()
+        check_not_revoked(get_raw_jwt())
+        return
+
+    cache = get_token_cache()
+    key = hashlib.sha256(token.encode()).digest()
+    entry = cache.get(key)
+    if entry is not None:
+        ctx_stack.top.jwt, ctx_stack.top.jwt_header = entry
+    else:
+        verify_jwt_in_request()
+        cache.set(key, get_raw_jwt(), get_raw_jwt_header())
+    check_not_revoked(get_raw_jwt())
+
+
+def jwt_required(fn):
+    """Protects a view with an access token, like flask_jwt_extended's
+    jwt_required, using the token cache"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        verify_access_token()
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def init_app(app):
+    """Sets up the verified token cache and its stats route"""
+    app.extensions["token_cache"] = TokenCache(app.config["JWT_CACHE_MAX_ENTRIES"])
+
+    @app.route("/tokens/stats", methods=["GET"])
+    @jwt_required
+    def token_stats():
+        """Route for this worker's verified token cache and revocation
+        counters."""
+        return jsonify(dict(get_token_cache().stats(), revocation=get_revocations().stats())), 200
@@ -0,0 +1,318 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+from flask import Request, abort, current_app, jsonify, request
+from sentry_sdk import capture_exception
+
+from .cache import catalog_changed
+from .db import get_db
+from .image_utils import (
+    ImageRejected, decorate_image_filename, original_extension, render_profiles, rendered_files,
+    set_max_image_pixels
+)
+from .jobs import DEFAULT_POOL, JOB_QUEUED, JOB_RUNNING, create_job, job_accepted, submit_job
+from .slots import HostSlots
+from .storage import get_storage, process_storage, storage_settings
+
+# Hex digits of the content hash kept in stored filenames
+HASH_NAME_LENGTH = 16
+
+# Prefix of the temporary files uploads are streamed into
+UPLOAD_PREFIX = ".upload-"
+
+
+class UploadFile:
+    """A file upload streamed to a temporary file in the image store and
+    hashed as it arrives.
+
+    The multipart parser writes the upload in small chunks, so the request
+    never holds more than one chunk in memory. Storing the upload with
+    claim() is a rename on the same filesystem rather than a copy. A file
+    that is never claimed is deleted when the request closes it.
+    """
+
+    def __init__(self, base_dir):
+        fd, self.name = tempfile.mkstemp(prefix=UPLOAD_PREFIX, dir=base_dir)
+        self._file = os.fdopen(fd, "wb+")
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.claimed = False
+
+    def write(self, data):
+        """Writes and hashes the next chunk of the upload"""
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        """Gets the SHA-256 hex digest of everything written"""
+        return self._hash.hexdigest()
+
+    def claim(self, filename):
+        """Moves the upload to filename"""
+        self._file.flush()
+        os.replace(self.name, filename)
+        self.claimed = True
+
+    def close(self):
+        """Closes the file, deleting it unless it has been claimed"""
+        self._file.close()
+        if not self.claimed and os.path.exists(self.name):
+            os.remove(self.name)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    """Request class that streams file uploads into the image store.
+
+    Only file parts are streamed to disk; form fields and JSON bodies are
+    read into memory. So only routes marked with accepts_uploads take
+    bodies up to UPLOAD_MAX_CONTENT_LENGTH, and their form fields are
+    limited to UPLOAD_MAX_FORM_MEMORY_SIZE. Every other route keeps
+    MAX_CONTENT_LENGTH.
+    """
+
+    @property
+    def max_content_length(self):
+        if current_app and getattr(current_app.view_functions.get(self.endpoint), "accepts_uploads", False):
+            return current_app.config["UPLOAD_MAX_CONTENT_LENGTH"]
+        return super().max_content_length
+
+    @property
+    def max_form_memory_size(self):
+        if current_app:
+            return current_app.config["UPLOAD_MAX_FORM_MEMORY_SIZE"]
+        return None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadFile(image_store_dir())
+
+
+def accepts_uploads(fn):
+    """Marks a view as an upload route, which takes bodies up to
+    UPLOAD_MAX_CONTENT_LENGTH"""
+    fn.accepts_uploads = True
+    return fn
+
+
+def image_store_dir():
+    """Gets the image store directory, creating it if needed"""
+    base_dir = current_app.config["IMAGE_STORE_DIR"]
+    if not os.path.isdir(base_dir):
+        os.mkdir(base_dir)
+    return base_dir
+
+
+def check_upload(stream):
+    """Checks an upload's format and size against the app's limits from
+    the image header alone
+
+    :raises IOError: If the upload is not a readable image
+    :raises ImageRejected: If the image is outside the limits
+    :return: The file extension to store the original under
+    """
+    config = current_app.config
+    return original_extension(stream, config["IMAGE_UPLOAD_FORMATS"], config["IMAGE_MAX_PIXELS"],
+                              config["IMAGE_MAX_DIMENSION"])
+
+
+def content_name(path, digest):
+    """Gets the name an image's files are stored under. The name carries the
+    start of the content hash, so a new upload gets new URLs and clients can
+    cache every file forever."""
+    return "{}-{}".format(path, digest[:HASH_NAME_LENGTH])
+
+
+def image_record(digest, name, original, job_id):
+    """Builds the image record a piece or psalm points at"""
+    return {
+        "hash": digest,
+        "name": name,
+        "original": os.path.basename(original),
+        "jobId": job_id,
+        "derivatives": None,
+        "placeholder": None,
+        "originalSize": None
+    }
+
+
+def is_rendered(database, record):
+    """Checks whether an image record's derivatives have been rendered or
+    are still being rendered, so the same upload has nothing left to do"""
+    if record.get("derivatives") is not None:
+        return True
+    job = database.imageJobs.find_one({"_id": record["jobId"]}, {"status": True})
+    return job is not None and job["status"] in (JOB_QUEUED, JOB_RUNNING)
+
+
+def render_slots():
+    """Gets the host-wide slots image jobs render in"""
+    config = current_app.config
+    return HostSlots(config["SLOT_LOCK_DIR"], "image-render", config["IMAGE_RENDER_CONCURRENCY"])
+
+
+def render_and_store(source_path, base_name, profiles, encode_threads, settings, slots, progress=None):
+    """Image job task that renders an upload's derivatives in the image
+    store directory, then stores the original and the derivatives in the
+    storage backend. The local copies stay behind as cached files.
+
+    :param settings: The storage settings, see storage_settings
+    :param slots: The HostSlots to render in, see render_slots
+    :return: As for render_profiles
+    """
+    with slots.slot():
+        rendered = render_profiles(source_path, base_name, profiles, encode_threads, progress)
+    files = [source_path] + rendered_files(base_name, profiles, rendered)
+    process_storage(settings).put_files([(os.path.basename(path), path) for path in files])
+    return rendered
+
+
+def store_upload(stream, extension, collection, document, key, field, path, kind, profiles, pool=DEFAULT_POOL):
+    """Stores an uploaded image under its content hash and starts the job
+    that renders its derivatives.
+
+    The original and the derivatives are written to the image store
+    directory first and handed to the storage backend by the job. Uploads
+    parsed by UploadRequest are already on disk and hashed; any
+    other stream is copied to a temporary file in the image store first. If
+    the document's image record already has the same hash, the temporary
+    file is dropped and nothing else is done, unless the last job for it
+    failed. The catalog is not bumped, so a batch can do that once.
+
+    :param collection: The collection holding the document
+    :param document: The piece or psalm the image belongs to
+    :param key: The field identifying the document, e.g. "title"
+    :param field: The field holding the image record
+    :param path: The document's image path, which stored names start with
+    :param kind: The image job kind
+    :param profiles: The derivative profiles to render
+    :param pool: The image job pool to render on
+    :raises IOError: If the upload cannot be saved
+    :return: {"hash": hash, "name": stored name, "jobId": id, "unchanged": bool}
+    """
+    base_dir = image_store_dir()
+    if isinstance(stream, UploadFile):
+        upload = stream
+    else:
+        upload = UploadFile(base_dir)
+        try:
+            shutil.copyfileobj(stream, upload)
+        except IOError:
+            upload.close()
+            raise
+
+    try:
+        digest = upload.hexdigest()
+        name = content_name(path, digest)
+        base_name = os.path.join(base_dir, name)
+        original = decorate_image_filename(base_name, "original", extension)
+
+        current = document.get(field)
+        if current and current["hash"] == digest and is_rendered(get_db().database, current) and \
+                (os.path.isfile(original) or get_storage().exists(os.path.basename(original))):
+            return {"hash": digest, "name": name, "jobId": current["jobId"], "unchanged": True}
+
+        upload.claim(original)
+    finally:
+        upload.close()
+
+    query = {key: document[key]}
+    job_id = create_job(get_db().database, kind, document[key])
+    collection.update_one(query, {"$set": {field: image_record(digest, name, original, job_id)}})
+
+    config = current_app.config
+    submit_job(job_id, render_and_store, original, base_name, profiles, config["IMAGE_ENCODE_THREADS"],
+               storage_settings(config), render_slots(), record=(collection.name, query, field, digest), pool=pool)
+    return {"hash": digest, "name": name, "jobId": job_id, "unchanged": False}
+
+
+def upload_response(result):
+    """Finishes a single upload: bumps the catalog if the image changed and
+    builds the route's response"""
+    if result["unchanged"]:
+        return jsonify(result), 200
+    catalog_changed()
+    return job_accepted(result["jobId"])
+
+
+def store_batch(collection, key, items):
+    """Stores a batch of uploads for documents in one collection.
+
+    Every target is read with one query. Each image is then checked and
+    stored as a single upload would be, and its derivatives are rendered by
+    its own job on the batch pool, so up to IMAGE_BATCH_WORKERS files of the
+    batch render in parallel. One failed file does not stop the others.
+
+    :param items: (target, file, image field, path field, job kind,
+        profiles) for each file, where target is the document's key value
+    :return: A result for each file in order, with a status of "accepted",
+        "unchanged", "notFound", "duplicate", "invalid" or "error"
+    """
+    targets = [item[0] for item in items]
+    documents = {document[key]: document for document in collection.find({key: {"$in": targets}})}
+
+    results = []
+    seen = set()
+    for target, file, field, path_field, kind, profiles in items:
+        result = {key: target, "file": file.filename}
+        results.append(result)
+
+        document = documents.get(target)
+        if document is None:
+            result["status"] = "notFound"
+            continue
+        if (target, field) in seen:
+            result["status"] = "duplicate"
+            continue
+        seen.add((target, field))
+
+        try:
+            extension = check_upload(file.stream)
+        except ImageRejected as e:
+            result.update(status="invalid", msg=str(e))
+            continue
+        except IOError:
+            result.update(status="invalid", msg="Please upload a valid image file.")
+            continue
+
+        try:
+            stored = store_upload(file.stream, extension, collection, document, key, field, document[path_field],
+                                  kind, profiles, "batch")
+        except IOError as e:
+            logging.exception("Error saving original image for %s: %s", target, e)
+            if current_app.config["ENV"] == "prod":
+                capture_exception(e)
+            result.update(status="error", msg="Error saving image")
+            continue
+
+        result.update(status="unchanged" if stored["unchanged"] else "accepted",
+                      hash=stored["hash"], jobId=stored["jobId"])
+
+    if any(result["status"] == "accepted" for result in results):
+        catalog_changed()
+    return results
+
+
+def init_app(app):
+    """Streams uploads to disk and applies the body and image size limits"""
+    app.request_class = UploadRequest
+    set_max_image_pixels(app.config["IMAGE_MAX_PIXELS"])
+
+    @app.before_request
+    def check_content_length():
+        """Rejects a body over the route's limit before anything reads it.
+        Werkzeug only applies the limit to form data, not to JSON bodies."""
+        if request.content_length is not None and request.max_content_length is not None and \
+                request.content_length > request.max_content_length:
+            abort(413)
+
+    @app.errorhandler(413)
+    def upload_too_large(e):
+        """Handler for requests over the route's body size limit."""
+        return jsonify({"msg": "Requests must be at most {} MB"
+                        .format(request.max_content_length // (1024 * 1024))}), 413
@@ -141,6 +141,100 @@ class TestPost(unittest.TestCase):
         self.assertEqual(404, r.status_code)
         self.assertEqual(expected_response, r.json)
 
+    @patch("flask_app.db.MongoClient")
+    def test_price_with_cents(self, mock_MongoClient):
+        """Checks that prices with cents are converted to dollars"""
+        mock_MongoClient.return_value = self.mock_db
+        self.test_art_docs[2]["price"] = 216055
+        mock_MongoClient().test.art.insert_many(self.test_art_docs)
+
+        r = self.client.post("/art/", json={"collection": "Florals"})
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(2160.55, r.json[0]["price"])
+
+    @patch("flask_app.db.MongoClient")
+    def test_get_florals_not_modified(self, mock_MongoClient):
+        """Revalidates a listing with the ETag from a previous response"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.art.insert_many(self.test_art_docs)
+
+        r = self.client.post("/art/", json={"collection": "Florals"})
+        etag = r.headers["ETag"]
+
+        r = self.client.post("/art/", json={"collection": "Florals"}, headers={"If-None-Match": etag})
+        self.assertEqual(304, r.status_code)
+
+        r = self.client.post("/art/", json={"collection": "Florals"}, headers={"If-None-Match": "W/" + etag})
+        self.assertEqual(304, r.status_code)
+
+        r = self.client.post("/art/", json={"collection": "Psalms"}, headers={"If-None-Match": etag})
+        self.assertEqual(200, r.status_code)
+        self.assertNotEqual(etag, r.headers["ETag"])
+
+    @patch("flask_app.db.MongoClient")
+    def test_get_psalms_by_page(self, mock_MongoClient):
+        """Gets the Psalms series a page at a time in key order"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.art.insert_many(self.test_art_docs)
+
+        test_data = {
+            "collection": "Psalms",
+            "series": "1"
+        }
+
+        r = self.client.post("/art/?limit=1", json=test_data)
+        self.assertEqual([0], [piece["key"] for piece in r.json])
+        self.assertEqual("</art/?limit=1&after=0%3APsalm+One+%E2%80%93+P1.1>; rel=\"next\"", r.headers["Link"])
+
+        r = self.client.post("/art/?limit=1&after=0:Psalm One – P1.1", json=test_data)
+        self.assertEqual([8], [piece["key"] for piece in r.json])
+
+        r = self.client.post("/art/?limit=1&after=8:Beatus Vir – P1.4", json=test_data)
+        self.assertEqual(404, r.status_code)
+
+        r = self.client.post("/art/?limit=1&after=8", json=test_data)
+        self.assertEqual(400, r.status_code)
+
+    @patch("flask_app.db.MongoClient")
+    def test_get_tied_keys_by_page(self, mock_MongoClient):
+        """Pages through pieces that share a key without skipping any"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.art.insert_many(self.test_art_docs)
+        tied_piece = dict(self.test_art_docs[0], title="Another – P1.2")
+        del tied_piece["_id"]
+        mock_MongoClient().test.art.insert_one(tied_piece)
+
+        titles = []
+        url = "/art/?limit=1"
+        r = self.client.post(url, json={"collection": "Psalms", "series": "1"})
+        while r.status_code == 200:
+            titles += [piece["title"] for piece in r.json]
+            url = r.headers["Link"][1:].partition(">")[0]
+            r = self.client.post(url, json={"collection": "Psalms", "series": "1"})
+        self.assertEqual(404, r.status_code)
+        self.assertEqual(["Another – P1.2", "Psalm One – P1.1", "Beatus Vir – P1.4"], titles)
+
+    @patch("flask_app.db.MongoClient")
+    def test_stream_florals(self, mock_MongoClient):
+        """Streams a listing as a JSON array"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.art.insert_many(self.test_art_docs)
+
+        r = self.client.post("/art/?stream=1", json={"collection": "Florals"})
+        self.assertEqual(200, r.status_code)
+        self.assertTrue(r.is_streamed)
+        self.assertEqual([{
+            "key": 1,
+            "path": "florals/orangerie.jpg",
+            "title": "Orangerie",
+            "medium": "Oil, framed, gold impressionist",
+            "size": "18\" x 24\"",
+            "price": 2160
+        }], r.json)
+
+        r = self.client.post("/art/?stream=1", json={"collection": "Nothing"})
+        self.assertEqual(404, r.status_code)
+
     def test_content_type(self):
         """Tries to use form data"""
 
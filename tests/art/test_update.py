@@ -127,6 +127,94 @@ class TestUpdate(unittest.TestCase):
         self.assertEqual(100000, new_piece["price"])
         self.assertEqual("test", new_piece["size"])
 
+    @patch("flask_app.db.MongoClient")
+    def test_update_reports_each_piece(self, mock_MongoClient):
+        """Tries to update a changed piece, an unchanged piece and a missing piece"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+        mock_MongoClient().test.art.insert_many(self.test_art_docs)
+
+        login_data = {
+            "username": "johndoe",
+            "password": "hunter2"
+        }
+
+        login_response = self.client.post("/auth/login", json=login_data)
+
+        unchanged_piece = {
+            "key": 0,
+            "title": "Test Piece",
+            "medium": "Acrylic on canvas",
+            "size": "20\" x 20\"",
+            "price": 1000.00,
+            "thumbnailColor": "#333333",
+            "collection": "Florals"
+        }
+        mock_MongoClient().test.art.update_one({"title": "Test Piece"},
+                                               {"$set": {"path": "test_piece", "price": 100000}})
+
+        test_data = {
+            "pieces": [
+                unchanged_piece,
+                dict(unchanged_piece, title="Test Psalm", collection="Psalms", series="1"),
+                dict(unchanged_piece, title="Missing Piece")
+            ]
+        }
+
+        test_headers = {
+            "Authorization": "Bearer " + login_response.json.get("accessToken")
+        }
+
+        expected_response = {
+            "matched": 2,
+            "modified": 1,
+            "notFound": 1,
+            "results": [
+                {"title": "Test Piece", "status": "matched"},
+                {"title": "Test Psalm", "status": "modified"},
+                {"title": "Missing Piece", "status": "notFound"}
+            ]
+        }
+
+        r = self.client.post("/art/update", json=test_data, headers=test_headers)
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(expected_response, r.json)
+        self.assertIsNone(mock_MongoClient().test.art.find_one({"title": "Missing Piece"}))
+
+    @patch("flask_app.db.MongoClient")
+    def test_update_duplicate_titles(self, mock_MongoClient):
+        """Keeps the last copy of a piece that appears more than once"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+        mock_MongoClient().test.art.insert_many(self.test_art_docs)
+        mock_MongoClient().test.art.update_one({"title": "Test Piece"}, {"$set": {"path": "test_piece"}})
+
+        login_response = self.client.post("/auth/login", json={"username": "johndoe", "password": "hunter2"})
+        test_headers = {
+            "Authorization": "Bearer " + login_response.json.get("accessToken")
+        }
+
+        stored_piece = {
+            "key": 0,
+            "title": "Test Piece",
+            "medium": "Acrylic on canvas",
+            "size": "20\" x 20\"",
+            "price": 2000.00,
+            "thumbnailColor": "#333333",
+            "collection": "Florals"
+        }
+        test_data = {"pieces": [dict(stored_piece, price=500.00), stored_piece]}
+
+        r = self.client.post("/art/update", json=test_data, headers=test_headers)
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(["modified", "modified"], [result["status"] for result in r.json["results"]])
+        self.assertEqual(200000, mock_MongoClient().test.art.find_one({"title": "Test Piece"})["price"])
+
+        test_data = {"pieces": [stored_piece, dict(stored_piece, price=500.00)]}
+        r = self.client.post("/art/update", json=test_data, headers=test_headers)
+        self.assertEqual(["matched", "modified"], [result["status"] for result in r.json["results"]])
+        self.assertEqual(50000, mock_MongoClient().test.art.find_one({"title": "Test Piece"})["price"])
+
     def test_update_piece_without_token(self):
         """Tries to replace a piece without a bearer token"""
 
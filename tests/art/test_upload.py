@@ -1,4 +1,6 @@
 import datetime
+import hashlib
+import io
 import os
 import shutil
 import unittest
@@ -80,7 +82,200 @@ class TestPut(unittest.TestCase):
             builder.files.add_file("file", im, "test.jpg", "image/jpeg")
 
             r = self.client.open(builder)
-            self.assertEqual(201, r.status_code)
+            self.assertEqual(202, r.status_code)
+
+            r = self.client.get("/images/jobs/" + r.json["jobId"], headers=test_headers)
+            self.assertEqual("done", r.json["status"])
+            self.assertEqual("Test Piece", r.json["target"])
+
+            with open("test.jpg", mode="rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            image = mock_MongoClient().test.art.find_one({"title": "Test Piece"})["image"]
+            self.assertEqual(digest, image["hash"])
+            self.assertEqual("test_piece-" + digest[:16], image["name"])
+            self.assertEqual((1000, 750), (image["derivatives"]["large"]["width"],
+                                           image["derivatives"]["large"]["height"]))
+
+            base_dir = self.client.application.config["IMAGE_STORE_DIR"]
+            base_name = os.path.join(base_dir, image["name"])
+            with Image.open(base_name + "-large.jpg") as large:
+                self.assertEqual((1000, 750), large.size)
+            with Image.open(base_name + "-thumbnail.jpg") as thumbnail:
+                self.assertEqual((64, 48), thumbnail.size)
+            self.assertTrue(os.path.exists(base_name + "-full.jpg"))
+            self.assertTrue(os.path.exists(base_name + "-original.jpg"))
+
+    @patch("flask_app.db.MongoClient")
+    def test_upload_same_image_twice(self, mock_MongoClient):
+        """Tries to upload the same bytes twice, which should only render once"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+        mock_MongoClient().test.art.insert_many(self.test_art_docs)
+
+        login_data = {
+            "username": "johndoe",
+            "password": "hunter2"
+        }
+
+        login_response = self.client.post("/auth/login", json=login_data)
+
+        test_headers = {
+            "Content-Type": "multipart/form-data",
+            "Authorization": "Bearer " + login_response.json.get("accessToken")
+        }
+
+        responses = []
+        for _ in range(2):
+            with open("test.jpg", mode="rb") as im:
+                builder = EnvironBuilder(app=self.client.application, path="/art/upload",
+                                         data={"title": "Test Piece"}, method="POST", headers=test_headers)
+                builder.files.add_file("file", im, "test.jpg", "image/jpeg")
+                responses.append(self.client.open(builder))
+
+        self.assertEqual(202, responses[0].status_code)
+        self.assertEqual(200, responses[1].status_code)
+        self.assertTrue(responses[1].json["unchanged"])
+        self.assertEqual(responses[0].json["jobId"], responses[1].json["jobId"])
+        self.assertEqual(1, mock_MongoClient().test.imageJobs.count_documents({}))
+
+        base_dir = self.client.application.config["IMAGE_STORE_DIR"]
+        self.assertFalse([name for name in os.listdir(base_dir) if name.startswith(".upload-")])
+
+        # After a failed job the same upload renders again
+        mock_MongoClient().test.art.update_one({"title": "Test Piece"}, {"$set": {"image.derivatives": None}})
+        mock_MongoClient().test.imageJobs.update_one({"_id": responses[0].json["jobId"]},
+                                                     {"$set": {"status": "failed"}})
+        with open("test.jpg", mode="rb") as im:
+            builder = EnvironBuilder(app=self.client.application, path="/art/upload",
+                                     data={"title": "Test Piece"}, method="POST", headers=test_headers)
+            builder.files.add_file("file", im, "test.jpg", "image/jpeg")
+            r = self.client.open(builder)
+        self.assertEqual(202, r.status_code)
+        self.assertNotEqual(responses[0].json["jobId"], r.json["jobId"])
+
+    @patch("flask_app.db.MongoClient")
+    def test_update_keeps_image(self, mock_MongoClient):
+        """Tries to update a piece after uploading its image"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+        mock_MongoClient().test.art.insert_many(self.test_art_docs)
+
+        login_data = {
+            "username": "johndoe",
+            "password": "hunter2"
+        }
+
+        login_response = self.client.post("/auth/login", json=login_data)
+        auth = "Bearer " + login_response.json.get("accessToken")
+
+        with open("test.jpg", mode="rb") as im:
+            builder = EnvironBuilder(app=self.client.application, path="/art/upload", data={"title": "Test Piece"},
+                                     method="POST", headers={"Content-Type": "multipart/form-data",
+                                                             "Authorization": auth})
+            builder.files.add_file("file", im, "test.jpg", "image/jpeg")
+            self.assertEqual(202, self.client.open(builder).status_code)
+
+        update = {
+            "pieces": [
+                {
+                    "key": 0,
+                    "title": "Test Piece",
+                    "medium": "Oil on canvas",
+                    "size": "20\" x 20\"",
+                    "price": 2000,
+                    "thumbnailColor": "#ffffff",
+                    "collection": "Florals"
+                }
+            ]
+        }
+        r = self.client.post("/art/update", json=update, headers={"Authorization": auth})
+        self.assertEqual(200, r.status_code)
+
+        piece = mock_MongoClient().test.art.find_one({"title": "Test Piece"})
+        self.assertEqual("Oil on canvas", piece["medium"])
+        self.assertIsNotNone(piece["image"]["derivatives"])
+
+    @patch("flask_app.db.MongoClient")
+    def test_upload_batch(self, mock_MongoClient):
+        """Tries to upload several pieces at once"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+        mock_MongoClient().test.art.insert_many(self.test_art_docs + [
+            {
+                "key": 1,
+                "title": "Second Piece",
+                "path": "second_piece",
+                "medium": "Acrylic on canvas",
+                "size": "20\" x 20\"",
+                "price": 200000,
+                "collection": "Florals"
+            }
+        ])
+
+        login_data = {
+            "username": "johndoe",
+            "password": "hunter2"
+        }
+
+        login_response = self.client.post("/auth/login", json=login_data)
+
+        with open("test.jpg", mode="rb") as im:
+            test_data = {
+                "title": ["Test Piece", "Second Piece", "Missing Piece", "Test Piece"]
+            }
+
+            test_headers = {
+                "Content-Type": "multipart/form-data",
+                "Authorization": "Bearer " + login_response.json.get("accessToken")
+            }
+
+            builder = EnvironBuilder(app=self.client.application, path="/art/upload/batch", data=test_data,
+                                     method="POST", headers=test_headers)
+            builder.files.add_file("file", im, "test.jpg", "image/jpeg")
+            builder.files.add_file("file", io.BytesIO(b"not an image"), "second.jpg", "image/jpeg")
+            builder.files.add_file("file", io.BytesIO(b"not an image"), "missing.jpg", "image/jpeg")
+            builder.files.add_file("file", io.BytesIO(b"not an image"), "again.jpg", "image/jpeg")
+
+            r = self.client.open(builder)
+            self.assertEqual(200, r.status_code)
+
+        results = r.json["results"]
+        self.assertEqual(["accepted", "invalid", "notFound", "duplicate"], [result["status"] for result in results])
+        self.assertEqual(["test.jpg", "second.jpg", "missing.jpg", "again.jpg"],
+                         [result["file"] for result in results])
+        self.assertEqual("Please upload a valid image file.", results[1]["msg"])
+
+        job = mock_MongoClient().test.imageJobs.find_one({"_id": results[0]["jobId"]})
+        self.assertEqual("done", job["status"])
+        self.assertEqual("Test Piece", job["target"])
+        self.assertNotIn("image", mock_MongoClient().test.art.find_one({"title": "Second Piece"}))
+
+    @patch("flask_app.db.MongoClient")
+    def test_body_limits(self, mock_MongoClient):
+        """Takes large bodies only on upload routes"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+        mock_MongoClient().test.art.insert_many(self.test_art_docs)
+        self.client.application.config["MAX_CONTENT_LENGTH"] = 1024 * 1024
+
+        r = self.client.post("/auth/login", json={"username": "x" * 1024 * 1024, "password": "hunter2"})
+        self.assertEqual(413, r.status_code)
+        self.assertEqual({"msg": "Requests must be at most 1 MB"}, r.json)
+
+        login_response = self.client.post("/auth/login", json={"username": "johndoe", "password": "hunter2"})
+        test_headers = {
+            "Content-Type": "multipart/form-data",
+            "Authorization": "Bearer " + login_response.json.get("accessToken")
+        }
+        Image.effect_noise((1000, 1000), 64).convert("RGB").save("test.jpg", quality=100)
+        self.assertGreater(os.path.getsize("test.jpg"), 1024 * 1024)
+
+        with open("test.jpg", mode="rb") as im:
+            builder = EnvironBuilder(app=self.client.application, path="/art/upload",
+                                     data={"title": "Test Piece"}, method="POST", headers=test_headers)
+            builder.files.add_file("file", im, "test.jpg", "image/jpeg")
+            r = self.client.open(builder)
+        self.assertEqual(202, r.status_code)
 
     @patch("flask_app.db.MongoClient")
     def test_upload_piece_without_title(self, mock_MongoClient):
@@ -76,6 +76,75 @@ class TestLogin(unittest.TestCase):
         self.assertEqual(400, r.status_code)
         self.assertEqual({"msg": "Incorrect username or password"}, r.json)
 
+    @patch("flask_app.db.MongoClient")
+    def test_login_throttled(self, mock_MongoClient):
+        """Turns a client away after repeated failed logins"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+
+        wrong_data = {
+            "username": "johndoe",
+            "password": "hunter"
+        }
+
+        for _ in range(4):
+            r = self.client.post("/auth/login", json=wrong_data)
+            self.assertEqual(400, r.status_code)
+
+        r = self.client.post("/auth/login", json=wrong_data)
+        self.assertEqual(429, r.status_code)
+        self.assertEqual("60", r.headers["Retry-After"])
+
+        r = self.client.post("/auth/login", json={"username": "johndoe", "password": "hunter2"})
+        self.assertEqual(429, r.status_code)
+
+        r = self.client.post("/auth/login", json={"username": "johndoe", "password": "hunter2"},
+                             environ_base={"REMOTE_ADDR": "10.0.0.2"})
+        self.assertEqual(429, r.status_code)
+
+    @patch("flask_app.db.MongoClient")
+    def test_login_throttled_address(self, mock_MongoClient):
+        """Turns an address away after failed logins to many usernames"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+
+        for n in range(19):
+            r = self.client.post("/auth/login", json={"username": "user{}".format(n), "password": "hunter"})
+            self.assertEqual(400, r.status_code)
+
+        r = self.client.post("/auth/login", json={"username": "user19", "password": "hunter"})
+        self.assertEqual(429, r.status_code)
+
+        r = self.client.post("/auth/login", json={"username": "johndoe", "password": "hunter2"})
+        self.assertEqual(429, r.status_code)
+
+        r = self.client.post("/auth/login", json={"username": "johndoe", "password": "hunter2"},
+                             environ_base={"REMOTE_ADDR": "10.0.0.2"})
+        self.assertEqual(200, r.status_code)
+
+    @patch("flask_app.db.MongoClient")
+    def test_login_throttled_forwarded_address(self, mock_MongoClient):
+        """Throttles clients behind the proxy by their forwarded addresses"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+
+        proxy = {"REMOTE_ADDR": "10.0.0.1"}
+        for n in range(20):
+            self.client.post("/auth/login", json={"username": "user{}".format(n), "password": "hunter"},
+                             headers={"X-Forwarded-For": "203.0.113.1"}, environ_base=proxy)
+
+        r = self.client.post("/auth/login", json={"username": "johndoe", "password": "hunter2"},
+                             headers={"X-Forwarded-For": "203.0.113.1"}, environ_base=proxy)
+        self.assertEqual(429, r.status_code)
+
+        r = self.client.post("/auth/login", json={"username": "johndoe", "password": "hunter2"},
+                             headers={"X-Forwarded-For": "203.0.113.2"}, environ_base=proxy)
+        self.assertEqual(200, r.status_code)
+
+        r = self.client.post("/auth/login", json={"username": "johndoe", "password": "hunter2"},
+                             headers={"X-Forwarded-For": "203.0.113.2, 203.0.113.1"}, environ_base=proxy)
+        self.assertEqual(429, r.status_code)
+
     def test_login_without_username(self):
         """Tests the login endpoint without a username"""
 
@@ -0,0 +1,78 @@
+import datetime
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from mongomock import MongoClient
+from werkzeug.security import check_password_hash, generate_password_hash
+
+import flask_app
+from flask_app.passwords import ITERATION_STEP, PasswordHasher, pick_iterations
+from flask_app.slots import HostSlots
+
+
+class TestPasswordHashing(unittest.TestCase):
+    """Tests hashing passwords on the bounded pool"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.app = flask_app.create_app(test_env="test")
+        self.client = self.app.test_client()
+        self.mock_db = MongoClient()
+
+        self.test_user_docs = [
+            {
+                "username": "johndoe",
+                "password": generate_password_hash("hunter2", "pbkdf2:sha256:1000"),
+                "created": datetime.datetime.utcnow(),
+                "passwordLastUpdated": datetime.datetime.utcnow()
+            }
+        ]
+
+    @patch("flask_app.db.MongoClient")
+    def test_rehash_on_login(self, mock_MongoClient):
+        """Upgrades a hash made with old parameters when its user logs in"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+
+        r = self.client.post("/auth/login", json={"username": "johndoe", "password": "hunter2"})
+        self.assertEqual(200, r.status_code)
+
+        password_hash = mock_MongoClient().test.apiAuth.find_one({"username": "johndoe"})["password"]
+        self.assertTrue(password_hash.startswith("pbkdf2:sha256:150000$"))
+        self.assertTrue(check_password_hash(password_hash, "hunter2"))
+
+        r = self.client.post("/auth/login", json={"username": "johndoe", "password": "hunter2"})
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(password_hash,
+                         mock_MongoClient().test.apiAuth.find_one({"username": "johndoe"})["password"])
+
+        stats = self.app.extensions["password_hasher"].stats()
+        self.assertEqual(3, stats["hashes"])
+        self.assertEqual(0, stats["rejected"])
+
+    @patch("flask_app.db.MongoClient")
+    def test_busy(self, mock_MongoClient):
+        """Refuses a login that cannot get a hashing slot in time"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+
+        with tempfile.TemporaryDirectory() as directory:
+            slots = HostSlots(directory, "password-hash", 1)
+            hasher = PasswordHasher(slots, 0, 150000)
+            self.app.extensions["password_hasher"] = hasher
+            slot = slots.acquire()
+            try:
+                r = self.client.post("/auth/login", json={"username": "johndoe", "password": "hunter2"})
+            finally:
+                slots.release(slot)
+        self.assertEqual(503, r.status_code)
+        self.assertEqual("1", r.headers["Retry-After"])
+        self.assertEqual(1, hasher.stats()["rejected"])
+
+    def test_pick_iterations(self):
+        """Picks the most iterations within the target time"""
+        iterations, elapsed = pick_iterations(0.25, timer=lambda count: count * 1e-6 * (1.2 if count > 20000 else 1))
+        self.assertEqual(200000, iterations)
+        self.assertEqual(0, iterations % ITERATION_STEP)
+        self.assertLessEqual(elapsed, 0.25)
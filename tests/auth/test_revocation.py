@@ -0,0 +1,117 @@
+import datetime
+import time
+import unittest
+from unittest.mock import patch
+
+from mongomock import MongoClient
+
+import flask_app
+from flask_app.revocation import BloomFilter
+
+
+class TestRevocation(unittest.TestCase):
+    """Tests logging out and revoking tokens"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.client = flask_app.create_app(test_env="test").test_client()
+        self.mock_db = MongoClient()
+
+        self.test_user_docs = [
+            {
+                "username": "johndoe",
+                "password": "pbkdf2:sha256:150000$WvnI6aK2$d9fe24da37a15003ef18"
+                            "2f9c2d48da67615b5d92c7a143d3e73c963b38799839",
+                "created": datetime.datetime.utcnow(),
+                "passwordLastUpdated": datetime.datetime.utcnow()
+            }
+        ]
+
+    def login(self, client=None):
+        r = (client or self.client).post("/auth/login", json={"username": "johndoe", "password": "hunter2"})
+        return {"Authorization": "Bearer " + r.json["accessToken"]}
+
+    @patch("flask_app.db.MongoClient")
+    def test_logout(self, mock_MongoClient):
+        """Revokes the token a user logs out with, and only that one"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+        other_worker = flask_app.create_app(test_env="test").test_client()
+
+        headers = self.login()
+        other_headers = self.login()
+        self.assertEqual(200, self.client.post("/auth/verify-token", headers=headers).status_code)
+        self.assertEqual(200, other_worker.post("/auth/verify-token", headers=headers).status_code)
+
+        r = self.client.post("/auth/logout", headers=headers)
+        self.assertEqual(200, r.status_code)
+
+        r = self.client.post("/auth/verify-token", headers=headers)
+        self.assertEqual(401, r.status_code)
+        self.assertEqual({"msg": "Token has been revoked"}, r.json)
+        self.assertEqual(200, self.client.post("/auth/verify-token", headers=other_headers).status_code)
+
+        other_worker.application.extensions["revocations"].sync(self.mock_db.test, force=True)
+        self.assertEqual(401, other_worker.post("/auth/verify-token", headers=headers).status_code)
+
+        stats = self.client.get("/tokens/stats", headers=other_headers).json["revocation"]
+        self.assertEqual(1, stats["revoked"])
+
+    @patch("flask_app.db.MongoClient")
+    def test_revoke_all(self, mock_MongoClient):
+        """Revokes every token a user has been issued so far"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+
+        headers = self.login()
+        other_headers = self.login()
+
+        # Token issue times are in whole seconds, and only tokens from
+        # earlier seconds are revoked
+        time.sleep(1.1)
+        r = self.client.post("/auth/revoke-all", headers=headers)
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(401, self.client.post("/auth/verify-token", headers=headers).status_code)
+        self.assertEqual(401, self.client.post("/auth/verify-token", headers=other_headers).status_code)
+
+        self.assertEqual(200, self.client.post("/auth/verify-token", headers=self.login()).status_code)
+
+    @patch("flask_app.db.MongoClient")
+    def test_revoke_without_expiry(self, mock_MongoClient):
+        """Keeps revocations of tokens that never expire when the filter is rebuilt"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+        self.client.application.config["JWT_ACCESS_TOKEN_EXPIRES"] = False
+
+        headers = self.login()
+        other_headers = self.login()
+        time.sleep(1.1)
+        self.assertEqual(200, self.client.post("/auth/revoke-all", headers=headers).status_code)
+        self.assertIsNone(self.mock_db.test.revokedTokens.find_one({"_id": "user:johndoe"})["expires"])
+
+        new_worker = flask_app.create_app(test_env="test").test_client()
+        self.assertEqual(401, new_worker.post("/auth/verify-token", headers=headers).status_code)
+        self.assertEqual(401, new_worker.post("/auth/verify-token", headers=other_headers).status_code)
+
+    @patch("flask_app.db.MongoClient")
+    def test_filter_count(self, mock_MongoClient):
+        """Counts each revocation in the filter once however often it is read"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+
+        headers = self.login()
+        self.client.post("/auth/logout", headers=headers)
+        revocations = self.client.application.extensions["revocations"]
+        for _ in range(5):
+            revocations.sync(self.mock_db.test, force=True)
+        self.assertEqual(1, revocations.stats()["filterEntries"])
+
+    def test_bloom_filter(self):
+        """Finds every item added and few that were not"""
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add("jti:{}".format(i))
+        self.assertTrue(all("jti:{}".format(i) in bloom for i in range(1000)))
+        false_positives = sum("jti:{}".format(i) in bloom for i in range(1000, 11000))
+        self.assertLess(false_positives, 300)
+        self.assertFalse(bloom.add("jti:0"))
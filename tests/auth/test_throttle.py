@@ -0,0 +1,41 @@
+import datetime
+import unittest
+
+from flask_app.throttle import retry_after, spend_attempt
+
+
+class TestSpendAttempt(unittest.TestCase):
+    """Tests the failed login token bucket"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.now = datetime.datetime(2020, 6, 1)
+        self.settings = {"burst": 3, "refill": 10, "backoff_base": 30, "lockout": 100, "memory": 3600}
+
+    def spend(self, state, seconds):
+        return spend_attempt(state, self.now + datetime.timedelta(seconds=seconds), **self.settings)
+
+    def test_burst(self):
+        """Locks a key once its burst is spent"""
+        state = self.spend(self.spend(None, 0), 0)
+        self.assertIsNone(retry_after(state, self.now))
+
+        state = self.spend(state, 0)
+        self.assertEqual(30, retry_after(state, self.now))
+        self.assertEqual(1, state["lockouts"])
+
+        state = self.spend(None, 0)
+        state = self.spend(state, 20)
+        state = self.spend(state, 20)
+        self.assertIsNone(retry_after(state, self.now))
+
+    def test_backoff(self):
+        """Doubles the wait each time the bucket runs dry, up to the lockout"""
+        state = self.spend(self.spend(self.spend(None, 0), 0), 0)
+        elapsed = 0
+        waits = []
+        for _ in range(4):
+            elapsed += retry_after(state, self.now + datetime.timedelta(seconds=elapsed))
+            state = self.spend(state, elapsed)
+            waits.append(retry_after(state, self.now + datetime.timedelta(seconds=elapsed)))
+        self.assertEqual([60, 100, 100, 100], waits)
@@ -0,0 +1,65 @@
+import datetime
+import unittest
+from unittest.mock import patch
+
+from mongomock import MongoClient
+
+import flask_app
+from flask_app.tokens import TokenCache
+
+
+class TestTokenCache(unittest.TestCase):
+    """Tests the verified token cache"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.client = flask_app.create_app(test_env="test").test_client()
+        self.mock_db = MongoClient()
+
+        self.test_user_docs = [
+            {
+                "username": "johndoe",
+                "password": "pbkdf2:sha256:150000$WvnI6aK2$d9fe24da37a15003ef18"
+                            "2f9c2d48da67615b5d92c7a143d3e73c963b38799839",
+                "created": datetime.datetime.utcnow(),
+                "passwordLastUpdated": datetime.datetime.utcnow()
+            }
+        ]
+
+    @patch("flask_app.db.MongoClient")
+    def test_repeat_token(self, mock_MongoClient):
+        """Verifies a token once and serves repeat calls from the cache"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+
+        login_response = self.client.post("/auth/login", json={"username": "johndoe", "password": "hunter2"})
+        token = login_response.json["accessToken"]
+
+        for _ in range(3):
+            r = self.client.post("/auth/verify-token", headers={"Authorization": "Bearer " + token})
+            self.assertEqual(200, r.status_code)
+
+        r = self.client.post("/auth/verify-token", headers={"Authorization": "Bearer " + token[:-2] + "xx"})
+        self.assertEqual(422, r.status_code)
+        r = self.client.post("/auth/verify-token")
+        self.assertEqual(401, r.status_code)
+
+        r = self.client.get("/tokens/stats", headers={"Authorization": "Bearer " + token})
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(3, r.json["hits"])
+        self.assertEqual(2, r.json["misses"])
+        self.assertEqual(1, r.json["entries"])
+
+    def test_expiry_and_eviction(self):
+        """Drops tokens at their exp claim and the least recently used token
+        when full"""
+        cache = TokenCache(2)
+        cache.set(b"a", {"exp": 100}, {})
+        cache.set(b"b", {"exp": 200}, {})
+        self.assertIsNotNone(cache.get(b"a", now=99))
+        self.assertIsNone(cache.get(b"a", now=100))
+
+        cache.set(b"a", {"exp": 100}, {})
+        cache.set(b"c", {"exp": 300}, {})
+        self.assertIsNone(cache.get(b"b", now=0))
+        self.assertIsNotNone(cache.get(b"c", now=0))
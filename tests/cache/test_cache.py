@@ -0,0 +1,127 @@
+import datetime
+import unittest
+from unittest.mock import patch
+
+from mongomock import MongoClient
+
+import flask_app
+from flask_app.cache import CatalogCache
+from flask_app.snapshots import Snapshot
+
+
+class TestCatalogCache(unittest.TestCase):
+    """Tests the catalog cache"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.database = MongoClient().test
+        self.cache = CatalogCache(max_entries=2, ttl=60, check_interval=0)
+        self.cache.sync_generation(self.database)
+
+    def test_hit_and_miss(self):
+        """Counts a miss, then a hit"""
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("a", [1])
+        self.assertEqual([1], self.cache.get("a"))
+        self.assertEqual(1, self.cache.stats()["hits"])
+        self.assertEqual(1, self.cache.stats()["misses"])
+
+    def test_size_bound(self):
+        """Evicts the least recently used entry"""
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+
+        self.assertEqual(1, self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(3, self.cache.get("c"))
+
+    @patch("flask_app.cache.time.monotonic")
+    def test_ttl(self, mock_monotonic):
+        """Expires an entry after the TTL"""
+        mock_monotonic.return_value = 1000
+        self.cache.set("a", 1)
+
+        mock_monotonic.return_value = 1059
+        self.assertEqual(1, self.cache.get("a"))
+        mock_monotonic.return_value = 1061
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_snapshot_compresses_on_demand(self):
+        """Compresses a snapshot only once a coding is asked for"""
+        snapshot = Snapshot([{"number": n} for n in range(100)], 1024, 6, 5)
+        self.assertEqual(["identity"], list(snapshot.variants))
+        self.assertIn("gzip", snapshot.encodings)
+
+        body = snapshot.variant("gzip")
+        self.assertIs(body, snapshot.variant("gzip"))
+        self.assertEqual(["identity", "gzip"], list(snapshot.variants))
+
+    def test_generation_from_another_worker(self):
+        """Drops entries when another worker bumps the generation"""
+        other_worker = CatalogCache(max_entries=2, ttl=60, check_interval=0)
+        self.cache.set("a", 1)
+
+        other_worker.bump_generation(self.database)
+        self.cache.sync_generation(self.database)
+
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(1, self.cache.generation)
+
+
+class TestCachedRoutes(unittest.TestCase):
+    """Tests caching on the catalog routes"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.client = flask_app.create_app(test_env="test").test_client()
+        self.mock_db = MongoClient()
+
+        self.test_user_docs = [
+            {
+                "username": "johndoe",
+                "password": "pbkdf2:sha256:150000$WvnI6aK2$d9fe24da37a15003ef18"
+                            "2f9c2d48da67615b5d92c7a143d3e73c963b38799839",
+                "created": datetime.datetime.utcnow(),
+                "passwordLastUpdated": datetime.datetime.utcnow()
+            }
+        ]
+
+    @patch("flask_app.db.MongoClient")
+    def test_write_invalidates(self, mock_MongoClient):
+        """Serves psalms from the cache until a psalm is added"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+        mock_MongoClient().test.psalms.insert_one({"number": 1, "demoThumbnailColor": "#1482cd"})
+
+        self.assertEqual(1, len(self.client.get("/psalms/").json))
+
+        # Not visible until a write goes through the API
+        mock_MongoClient().test.psalms.insert_one({"number": 3, "demoThumbnailColor": "#1482cd"})
+        self.assertEqual(1, len(self.client.get("/psalms/").json))
+
+        login_data = {
+            "username": "johndoe",
+            "password": "hunter2"
+        }
+
+        login_response = self.client.post("/auth/login", json=login_data)
+        test_headers = {
+            "Authorization": "Bearer " + login_response.json.get("accessToken")
+        }
+
+        r = self.client.put("/psalms/add", json={"number": 2, "demoThumbnailColor": "#1482cd"},
+                            headers=test_headers)
+        self.assertEqual(201, r.status_code)
+        self.assertEqual(3, len(self.client.get("/psalms/").json))
+
+        r = self.client.get("/cache/stats", headers=test_headers)
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(1, r.json["hits"])
+        self.assertEqual(2, r.json["misses"])
+        self.assertEqual(1, r.json["generation"])
+
+
+if __name__ == '__main__':
+    unittest.main()
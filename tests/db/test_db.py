@@ -0,0 +1,63 @@
+import unittest
+from unittest.mock import patch
+
+from mongomock import MongoClient
+
+import flask_app
+from flask_app.db import get_db
+
+
+class TestDb(unittest.TestCase):
+    """Tests the pooled database client"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.app = flask_app.create_app(test_env="test")
+
+    @patch("flask_app.db.MongoClient")
+    def test_client_reused_across_requests(self, mock_MongoClient):
+        """Checks that one client serves every request in a worker"""
+        mock_MongoClient.side_effect = lambda *args, **kwargs: MongoClient()
+
+        with self.app.app_context():
+            first = get_db()
+        with self.app.app_context():
+            second = get_db()
+
+        self.assertIs(first, second)
+        self.assertEqual(1, mock_MongoClient.call_count)
+
+    @patch("flask_app.db.os.getpid")
+    @patch("flask_app.db.MongoClient")
+    def test_client_rebuilt_after_fork(self, mock_MongoClient, mock_getpid):
+        """Checks that a forked worker does not reuse its parent's client"""
+        mock_MongoClient.side_effect = lambda *args, **kwargs: MongoClient()
+
+        mock_getpid.return_value = 100
+        with self.app.app_context():
+            parent = get_db()
+
+        mock_getpid.return_value = 101
+        with self.app.app_context():
+            child = get_db()
+
+        self.assertIsNot(parent, child)
+        self.assertEqual(2, mock_MongoClient.call_count)
+
+    @patch("flask_app.db.MongoClient")
+    def test_client_uses_pool_config(self, mock_MongoClient):
+        """Checks that pool settings come from the config"""
+        mock_MongoClient.return_value = MongoClient()
+
+        with self.app.app_context():
+            get_db()
+
+        kwargs = mock_MongoClient.call_args[1]
+        self.assertFalse(kwargs["connect"])
+        self.assertEqual(self.app.config["MONGO_MAX_POOL_SIZE"], kwargs["maxPoolSize"])
+        self.assertEqual(self.app.config["MONGO_SERVER_SELECTION_TIMEOUT_MS"],
+                         kwargs["serverSelectionTimeoutMS"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,11 @@
+import io
+import os
+import shutil
+import tempfile
 import unittest
+from unittest.mock import patch
 
-from PIL import Image
+from PIL import Image, JpegImagePlugin
 
 from flask_app.image_utils import *
 
@@ -38,3 +43,186 @@ class TestImageUtils(unittest.TestCase):
     def test_decorate_image_filename(self):
         """Tests filename decoration"""
         self.assertEqual("test-big.jpg", decorate_image_filename("test", "big"))
+
+    def test_fit_size(self):
+        """Scales the longer axis to the given length"""
+        self.assertEqual((1000, 667), fit_size(3000, 2000, 1000))
+        self.assertEqual((667, 1000), fit_size(2000, 3000, 1000))
+        self.assertEqual((64, 64), fit_size(500, 500, 64))
+
+
+class TestOriginalExtension(unittest.TestCase):
+    """Tests checking uploads from the image header"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.stream = io.BytesIO()
+        Image.new(mode="RGB", size=(400, 300)).save(self.stream, "PNG")
+        self.stream.seek(0)
+
+    def test_within_limits(self):
+        self.assertEqual("png", original_extension(self.stream, ("JPEG", "PNG"), 120000, 400))
+        self.assertEqual(0, self.stream.tell())
+
+    def test_format_rejected(self):
+        with self.assertRaises(ImageRejected):
+            original_extension(self.stream, formats=("JPEG",))
+
+    def test_dimension_rejected(self):
+        with self.assertRaises(ImageRejected):
+            original_extension(self.stream, max_dimension=399)
+
+    def test_pixels_rejected(self):
+        with self.assertRaises(ImageRejected):
+            original_extension(self.stream, max_pixels=119999)
+        self.assertEqual(0, self.stream.tell())
+
+    def test_decompression_bomb_rejected(self):
+        with patch.object(Image, "MAX_IMAGE_PIXELS", 1000):
+            with self.assertRaises(ImageRejected):
+                original_extension(self.stream)
+
+
+class TestPlaceholders(unittest.TestCase):
+    """Tests computing image placeholders"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.image = Image.new(mode="RGB", size=(32, 24), color="#1482cd")
+        self.image.paste((255, 255, 255), (0, 0, 8, 24))
+
+    def test_dominant_color(self):
+        self.assertEqual("#1482cd", dominant_color(self.image))
+
+    def test_blurhash(self):
+        """Matches the reference encoder"""
+        self.image.paste((255, 255, 255), (0, 0, 16, 24))
+        self.assertEqual("L~LrA6~ot6IXt7oej@azfQfQfQfQ", blurhash(self.image))
+        self.assertEqual("00HC1R", blurhash(Image.radial_gradient("L").resize((32, 32)), (1, 1)))
+
+    def test_image_placeholder(self):
+        """Computes the placeholder from a small copy of a large image"""
+        placeholder = image_placeholder(self.image.resize((3200, 2400)))
+        self.assertEqual("#1482cd", placeholder["color"])
+        self.assertEqual(28, len(placeholder["blurhash"]))
+
+
+class TestRenderDerivatives(unittest.TestCase):
+    """Tests rendering derivatives from an original"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.work_dir = tempfile.mkdtemp()
+        self.original = os.path.join(self.work_dir, "original.jpg")
+        Image.new(mode="RGB", size=(3200, 2400), color="#1482cd").save(self.original)
+
+    def tearDown(self):
+        """Runs after each test method"""
+        shutil.rmtree(self.work_dir)
+
+    def path(self, name):
+        return os.path.join(self.work_dir, name)
+
+    def test_render_profiles(self):
+        """Renders every profile at its size and reports progress"""
+        progress = []
+        profiles = {
+            "thumbnail": {"max_axis": 64, "formats": {"JPEG": 75}},
+            "full": {"formats": {"JPEG": 90}},
+            "large": {"max_axis": 1000, "formats": {"JPEG": 85, "WEBP": 80}},
+            "w640": {"width": 640, "formats": {"JPEG": 80}},
+            "w4000": {"width": 4000, "formats": {"JPEG": 80}},
+            "main": {"max_axis": 100, "formats": {"JPEG": 80}, "suffix": ""}
+        }
+
+        rendered = render_profiles(self.original, self.path("piece"), profiles,
+                                   progress=lambda done, total: progress.append((done, total)))
+
+        expected_sizes = {
+            "piece-full.jpg": (3200, 2400),
+            "piece-large.jpg": (1000, 750),
+            "piece-large.webp": (1000, 750),
+            "piece-w640.jpg": (640, 480),
+            "piece.jpg": (100, 75),
+            "piece-thumbnail.jpg": (64, 48)
+        }
+        for name, size in expected_sizes.items():
+            with Image.open(self.path(name)) as derivative:
+                self.assertEqual(size, derivative.size)
+
+        self.assertFalse(os.path.exists(self.path("piece-w4000.jpg")))
+        self.assertNotIn("w4000", rendered["derivatives"])
+        self.assertEqual({"width": 1000, "height": 750, "formats": ["jpg", "webp"]}, rendered["derivatives"]["large"])
+        self.assertEqual({"color", "blurhash"}, set(rendered["placeholder"]))
+        self.assertEqual([(n, 6) for n in range(7)], progress)
+
+    def test_render_profiles_in_parallel(self):
+        """Encodes on the shared thread pool with the same output"""
+        progress = []
+        profiles = {
+            "full": {"formats": {"JPEG": 90, "WEBP": 80}},
+            "large": {"max_axis": 1000, "formats": {"JPEG": 85, "WEBP": 80}},
+            "thumbnail": {"max_axis": 64, "formats": {"JPEG": 75}}
+        }
+
+        rendered = render_profiles(self.original, self.path("piece"), profiles, encode_threads=3,
+                                   progress=lambda done, total: progress.append((done, total)))
+
+        large = rendered["derivatives"]["large"]
+        self.assertEqual((1000, 750), (large["width"], large["height"]))
+        for name in ("piece-full.jpg", "piece-full.webp", "piece-large.jpg", "piece-large.webp",
+                     "piece-thumbnail.jpg"):
+            with Image.open(self.path(name)) as derivative:
+                derivative.load()
+        self.assertEqual([(n, 5) for n in range(6)], progress)
+        self.assertIs(get_encode_executor(3), get_encode_executor(3))
+
+    def test_render_profiles_encoding(self):
+        """Saves progressive JPEGs without the original's metadata"""
+        exif = Image.Exif()
+        exif[0x010F] = "Test Camera"
+        Image.new(mode="RGB", size=(1600, 1200)).save(self.original, exif=exif)
+
+        render_profiles(self.original, self.path("piece"), {"large": {"max_axis": 1000, "formats": {"JPEG": 85}}})
+
+        with Image.open(self.path("piece-large.jpg")) as large:
+            self.assertTrue(large.info.get("progressive"))
+            self.assertNotIn("exif", large.info)
+
+    def test_unsupported_format_skipped(self):
+        """Skips formats the Pillow build cannot write"""
+        self.assertEqual(["JPEG"], supported_formats(["JPEG", "NOT-A-FORMAT"]))
+
+    def test_format_report(self):
+        """Compares formats over derivatives that have a JPEG copy"""
+        store = self.path("store")
+        os.mkdir(store)
+        for name, size in (("a-large.jpg", 100), ("a-large.webp", 60), ("b-large.jpg", 300),
+                           ("b-large.webp", 150), ("c-large.webp", 999), ("a-original.jpg", 5000)):
+            with open(os.path.join(store, name), "wb") as f:
+                f.write(b"x" * size)
+
+        report = format_report(store)
+
+        self.assertEqual({"files": 2, "bytes": 400, "jpegBytes": 400}, report["jpg"])
+        self.assertEqual({"files": 2, "bytes": 210, "jpegBytes": 400}, report["webp"])
+
+    def test_render_profiles_with_draft(self):
+        """Decodes a JPEG at reduced scale when no full-size output is wanted"""
+        drafts = []
+        original_draft = JpegImagePlugin.JpegImageFile.draft
+
+        def record_draft(image, mode, size):
+            drafts.append(size)
+            return original_draft(image, mode, size)
+
+        profiles = {
+            "large": {"max_axis": 800, "formats": {"JPEG": 85}},
+            "thumbnail": {"max_axis": 64, "formats": {"JPEG": 75}}
+        }
+        with patch.object(JpegImagePlugin.JpegImageFile, "draft", record_draft):
+            render_profiles(self.original, self.path("demo"), profiles)
+
+        self.assertEqual([(800, 600)], drafts)
+        with Image.open(self.path("demo-large.jpg")) as large:
+            self.assertEqual((800, 600), large.size)
@@ -0,0 +1,102 @@
+import os
+import shutil
+import unittest
+
+from PIL import Image
+
+import flask_app
+
+
+class TestGet(unittest.TestCase):
+    """Tests serving images from the image store"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.client = flask_app.create_app(test_env="test").test_client()
+        self.base_dir = self.client.application.config["IMAGE_STORE_DIR"]
+        os.mkdir(self.base_dir)
+
+        test_image = Image.new(mode="RGB", size=(100, 80), color="#1482cd")
+        test_image.save(os.path.join(self.base_dir, "test_piece-large.jpg"))
+        test_image.save(os.path.join(self.base_dir, "test_piece-large.webp"))
+        test_image.save(os.path.join(self.base_dir, "test_piece-original.jpg"))
+
+        with open(os.path.join(self.base_dir, "test_piece-large.jpg"), "rb") as f:
+            self.jpeg_bytes = f.read()
+
+    def tearDown(self):
+        """Runs after each test method"""
+        shutil.rmtree(self.base_dir)
+
+    def test_get_image(self):
+        """Gets a JPEG derivative with immutable caching"""
+        r = self.client.get("/images/test_piece-large.jpg")
+        self.assertEqual(200, r.status_code)
+        self.assertEqual("image/jpeg", r.mimetype)
+        self.assertEqual(self.jpeg_bytes, r.data)
+        self.assertEqual("public, max-age=31536000, immutable", r.headers["Cache-Control"])
+        self.assertIn("Accept", r.headers["Vary"])
+        r.close()
+
+    def test_get_image_as_webp(self):
+        """Serves the WebP copy to a client that accepts it"""
+        r = self.client.get("/images/test_piece-large.jpg", headers={"Accept": "image/avif,image/webp,*/*"})
+        self.assertEqual(200, r.status_code)
+        self.assertEqual("image/webp", r.mimetype)
+        r.close()
+
+        r = self.client.get("/images/test_piece-large.jpg", headers={"Accept": "image/webp;q=0,*/*"})
+        self.assertEqual("image/jpeg", r.mimetype)
+        r.close()
+
+    def test_get_image_range(self):
+        """Gets part of an image"""
+        r = self.client.get("/images/test_piece-large.jpg", headers={"Range": "bytes=0-9"})
+        self.assertEqual(206, r.status_code)
+        self.assertEqual(self.jpeg_bytes[:10], r.data)
+        r.close()
+
+    def test_head_image(self):
+        """Gets an image's headers without the body"""
+        r = self.client.head("/images/test_piece-large.jpg")
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(str(len(self.jpeg_bytes)), r.headers["Content-Length"])
+        self.assertEqual(b"", r.data)
+        r.close()
+
+    def test_get_original(self):
+        """Tries to get an original upload"""
+        r = self.client.get("/images/test_piece-original.jpg")
+        self.assertEqual(404, r.status_code)
+
+    def test_get_hidden_file(self):
+        """Tries to get a file being uploaded and other hidden files"""
+        with open(os.path.join(self.base_dir, ".upload-abc"), "wb") as f:
+            f.write(self.jpeg_bytes)
+        self.assertEqual(404, self.client.get("/images/.upload-abc").status_code)
+        self.assertEqual(404, self.client.get("/images/.reconcile-checkpoint").status_code)
+        self.assertEqual(404, self.client.get("/images/x/.hidden/test_piece-large.jpg").status_code)
+
+    def test_get_missing_image(self):
+        """Tries to get images that are not in the store"""
+        self.assertEqual(404, self.client.get("/images/nothing-large.jpg").status_code)
+        self.assertEqual(404, self.client.get("/images/../config.py").status_code)
+        self.assertEqual(404, self.client.get("/images/test_piece-large.png").status_code)
+
+    def test_get_nested_path(self):
+        """Tries to get a path below the flat store without creating it"""
+        self.assertEqual(404, self.client.get("/images/a/b/c/d.jpg").status_code)
+        self.assertFalse(os.path.exists(os.path.join(self.base_dir, "a")))
+
+    def test_get_image_with_x_accel(self):
+        """Hands the file to nginx in x-accel mode"""
+        self.client.application.config["IMAGE_SERVE_MODE"] = "x-accel"
+
+        r = self.client.get("/images/test_piece-large.jpg", headers={"Accept": "image/webp"})
+        self.assertEqual(200, r.status_code)
+        self.assertEqual("/protected-images/test_piece-large.webp", r.headers["X-Accel-Redirect"])
+        self.assertEqual(b"", r.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import copy
+import json
+import os
+import shutil
+import unittest
+from unittest.mock import patch
+
+from PIL import Image
+from mongomock import MongoClient
+
+import flask_app
+
+
+class TestReconcile(unittest.TestCase):
+    """Tests reconciling the image store with the catalog"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.app = flask_app.create_app(test_env="test")
+        self.runner = self.app.test_cli_runner()
+        self.mock_db = MongoClient()
+        self.base_dir = self.app.config["IMAGE_STORE_DIR"]
+        os.mkdir(self.base_dir)
+
+        Image.new(mode="RGB", size=(1600, 1200)).save(self.path("test_piece-0123-original.jpg"))
+        Image.new(mode="RGB", size=(100, 80)).save(self.path("deleted_piece-4567-large.jpg"))
+        Image.new(mode="RGB", size=(100, 80)).save(self.path("psalm_1_demo-large.jpg"))
+
+        self.test_art_docs = [
+            {
+                "title": "Test Piece",
+                "path": "test_piece",
+                "image": {
+                    "hash": "0123",
+                    "name": "test_piece-0123",
+                    "original": "test_piece-0123-original.jpg",
+                    "jobId": None,
+                    "derivatives": None,
+                    "placeholder": None,
+                    "originalSize": None
+                }
+            }
+        ]
+
+        self.test_psalm_docs = [
+            {
+                "number": 1,
+                "demoPath": "psalm_1_demo",
+                "thumbnailPath": "psalm_1_thumbnail"
+            }
+        ]
+
+    def tearDown(self):
+        """Runs after each test method"""
+        shutil.rmtree(self.base_dir)
+
+    def path(self, name):
+        return os.path.join(self.base_dir, name)
+
+    def set_up_db(self, mock_MongoClient):
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.art.insert_many(self.test_art_docs)
+        mock_MongoClient().test.psalms.insert_many(self.test_psalm_docs)
+
+    @patch("flask_app.db.MongoClient")
+    def test_dry_run(self, mock_MongoClient):
+        """Reports missing derivatives and orphans without changing anything"""
+        self.set_up_db(mock_MongoClient)
+
+        r = self.runner.invoke(args=["images", "reconcile", "--dry-run", "--delete-orphans"])
+        self.assertEqual(0, r.exit_code, r.output)
+        self.assertIn("test_piece-0123-large.jpg", r.output)
+        self.assertIn("orphan           deleted_piece-4567-large.jpg", r.output)
+        self.assertNotIn("psalm_1_demo-large.jpg", r.output)
+        self.assertIn("Dry run: would regenerate 1 images and delete 1 orphans", r.output)
+
+        self.assertFalse(os.path.exists(self.path("test_piece-0123-large.jpg")))
+        self.assertTrue(os.path.exists(self.path("deleted_piece-4567-large.jpg")))
+
+    @patch("flask_app.db.MongoClient")
+    def test_reconcile(self, mock_MongoClient):
+        """Regenerates missing derivatives and deletes orphans"""
+        self.set_up_db(mock_MongoClient)
+
+        r = self.runner.invoke(args=["images", "reconcile", "--workers", "0", "--delete-orphans"])
+        self.assertEqual(0, r.exit_code, r.output)
+        self.assertIn("regenerated      art 'Test Piece' image", r.output)
+
+        with Image.open(self.path("test_piece-0123-large.jpg")) as large:
+            self.assertEqual((1000, 750), large.size)
+        self.assertFalse(os.path.exists(self.path("deleted_piece-4567-large.jpg")))
+        self.assertTrue(os.path.exists(self.path("psalm_1_demo-large.jpg")))
+        self.assertFalse(os.path.exists(self.path(".reconcile-checkpoint")))
+
+        image = mock_MongoClient().test.art.find_one({"title": "Test Piece"})["image"]
+        self.assertEqual({"width": 1600, "height": 1200}, image["originalSize"])
+        self.assertEqual(1000, image["derivatives"]["large"]["width"])
+
+        r = self.runner.invoke(args=["images", "reconcile", "--workers", "0"])
+        self.assertIn("1 images: 1 ok", r.output)
+
+        self.app.config["IMAGE_PROFILES"] = copy.deepcopy(self.app.config["IMAGE_PROFILES"])
+        self.app.config["IMAGE_PROFILES"]["art"]["large"]["max_axis"] = 1200
+        r = self.runner.invoke(args=["images", "reconcile", "--dry-run"])
+        self.assertIn("1 stale", r.output)
+
+    @patch("flask_app.db.MongoClient")
+    def test_resume(self, mock_MongoClient):
+        """Skips images an interrupted run already regenerated"""
+        self.set_up_db(mock_MongoClient)
+        with open(self.path(".reconcile-checkpoint"), "w") as f:
+            f.write(json.dumps(["art", "Test Piece", "image", "0123"]) + "\n[\"art\", \"Tes")
+
+        r = self.runner.invoke(args=["images", "reconcile", "--workers", "0"])
+        self.assertEqual(0, r.exit_code, r.output)
+        self.assertNotIn("regenerated", r.output)
+        self.assertFalse(os.path.exists(self.path("test_piece-0123-large.jpg")))
+
+        r = self.runner.invoke(args=["images", "reconcile", "--workers", "0", "--restart"])
+        self.assertIn("regenerated", r.output)
+        self.assertTrue(os.path.exists(self.path("test_piece-0123-large.jpg")))
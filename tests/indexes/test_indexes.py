@@ -0,0 +1,84 @@
+import os
+import unittest
+
+from mongomock import MongoClient
+from pymongo import MongoClient as LiveMongoClient
+
+from flask_app.indexes import INDEXES, ROUTE_QUERIES, ensure_indexes, explain_query, uses_collscan
+
+TEST_MONGO_URI = os.environ.get("TEST_MONGO_URI")
+
+
+class TestIndexes(unittest.TestCase):
+    """Tests the index registry"""
+
+    def test_ensure_indexes(self):
+        """Creates the registered indexes twice"""
+        database = MongoClient().test
+
+        ensure_indexes(database)
+        ensure_indexes(database)
+
+        for collection, models in INDEXES.items():
+            info = database[collection].index_information()
+            for model in models:
+                self.assertIn(model.document["name"], info)
+
+        self.assertTrue(database.art.index_information()["title_unique"]["unique"])
+        self.assertTrue(database.psalms.index_information()["number_unique"]["unique"])
+        self.assertTrue(database.apiAuth.index_information()["username_unique"]["unique"])
+
+    def test_uses_collscan(self):
+        """Finds a collection scan nested in a plan"""
+        plan = {
+            "queryPlanner": {
+                "winningPlan": {
+                    "stage": "PROJECTION_DEFAULT",
+                    "inputStage": {"stage": "COLLSCAN"}
+                }
+            }
+        }
+        self.assertTrue(uses_collscan(plan))
+
+    def test_uses_index(self):
+        """Accepts a plan that uses an index"""
+        plan = {
+            "stages": [{
+                "$cursor": {
+                    "queryPlanner": {
+                        "winningPlan": {
+                            "stage": "FETCH",
+                            "inputStage": {"stage": "IXSCAN", "indexName": "collection_series_key_title"}
+                        }
+                    }
+                }
+            }]
+        }
+        self.assertFalse(uses_collscan(plan))
+
+
+@unittest.skipUnless(TEST_MONGO_URI, "TEST_MONGO_URI is not set")
+class TestRouteQueryPlans(unittest.TestCase):
+    """Explains the route queries against a real MongoDB server"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.client = LiveMongoClient(TEST_MONGO_URI)
+        self.database = self.client.ecfa_index_check
+        ensure_indexes(self.database)
+
+    def tearDown(self):
+        """Runs after each test method"""
+        self.client.drop_database(self.database)
+        self.client.close()
+
+    def test_route_queries_use_indexes(self):
+        """Fails if any route query is planned as a collection scan"""
+        for collection, query in ROUTE_QUERIES:
+            with self.subTest(collection=collection, query=query):
+                plan = explain_query(self.database, collection, query)
+                self.assertFalse(uses_collscan(plan))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import time
+import unittest
+from unittest.mock import patch
+
+from mongomock import MongoClient
+
+import flask_app
+from flask_app.db import get_db
+from flask_app.jobs import create_job, get_executor, get_job, submit_job, shutdown_executor
+
+
+def succeed(value, progress=None):
+    """Job task that finishes"""
+    return value
+
+
+def fail(progress=None):
+    """Job task that raises"""
+    raise ValueError("bad image")
+
+
+class TestJobs(unittest.TestCase):
+    """Tests running image jobs on the process pool"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.app = flask_app.create_app(test_env="test")
+        self.app.config["IMAGE_JOB_WORKERS"] = 1
+        self.mock_db = MongoClient()
+
+    def tearDown(self):
+        """Runs after each test method"""
+        shutdown_executor(self.app)
+
+    def wait_for_job(self, job_id):
+        """Waits for the done callback to record the outcome"""
+        for _ in range(100):
+            job = get_job(self.mock_db.test, job_id)
+            if job["status"] in ("done", "failed"):
+                return job
+            time.sleep(0.05)
+        self.fail("Job {} did not finish".format(job_id))
+
+    @patch("flask_app.db.MongoClient")
+    def test_job_done(self, mock_MongoClient):
+        """Runs a job in a pool process"""
+        mock_MongoClient.return_value = self.mock_db
+
+        with self.app.test_request_context():
+            job_id = create_job(get_db().database, "art", "Test Piece")
+            self.assertEqual("queued", get_job(self.mock_db.test, job_id)["status"])
+            future = submit_job(job_id, succeed, 5)
+
+        self.assertEqual(5, future.result(timeout=30))
+        job = self.wait_for_job(job_id)
+        self.assertEqual("done", job["status"])
+        self.assertIsNone(job["error"])
+
+    @patch("flask_app.db.MongoClient")
+    def test_batch_pool(self, mock_MongoClient):
+        """Runs batch jobs on their own pool"""
+        mock_MongoClient.return_value = self.mock_db
+        self.app.config["IMAGE_BATCH_WORKERS"] = 2
+
+        with self.app.test_request_context():
+            job_id = create_job(get_db().database, "art", "Test Piece")
+            future = submit_job(job_id, succeed, 5, pool="batch")
+            self.assertIsNot(get_executor("jobs"), get_executor("batch"))
+
+        self.assertEqual(5, future.result(timeout=30))
+        self.assertEqual("done", self.wait_for_job(job_id)["status"])
+
+    @patch("flask_app.db.MongoClient")
+    def test_job_failed(self, mock_MongoClient):
+        """Records the error from a failed job"""
+        mock_MongoClient.return_value = self.mock_db
+
+        with self.app.test_request_context():
+            job_id = create_job(get_db().database, "art", "Test Piece")
+            submit_job(job_id, fail)
+
+        job = self.wait_for_job(job_id)
+        self.assertEqual("failed", job["status"])
+        self.assertEqual("bad image", job["error"])
+
+
+if __name__ == '__main__':
+    unittest.main()
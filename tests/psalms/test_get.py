@@ -1,9 +1,12 @@
+import datetime
+import gzip
 import unittest
 from unittest.mock import patch
 
 from mongomock import MongoClient
 
 import flask_app
+from flask_app.snapshots import brotli
 
 
 class TestGet(unittest.TestCase):
@@ -42,6 +45,124 @@ class TestGet(unittest.TestCase):
         self.assertEqual(200, r.status_code)
         self.assertEqual(expected_response, r.json)
 
+    @patch("flask_app.db.MongoClient")
+    def test_get_psalms_not_modified(self, mock_MongoClient):
+        """Revalidates the Psalms with the ETag from a previous response"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.psalms.insert_many(self.test_metadata_docs)
+
+        r = self.client.get("/psalms/")
+        self.assertEqual(200, r.status_code)
+        etag = r.headers["ETag"]
+
+        r = self.client.get("/psalms/", headers={"If-None-Match": etag})
+        self.assertEqual(304, r.status_code)
+        self.assertEqual(etag, r.headers["ETag"])
+        self.assertEqual(b"", r.data)
+
+        r = self.client.get("/psalms/", headers={"If-None-Match": "\"stale\""})
+        self.assertEqual(200, r.status_code)
+
+    @patch("flask_app.db.MongoClient")
+    def test_get_psalms_modified_since(self, mock_MongoClient):
+        """Revalidates the Psalms by date before and after a catalog change"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.psalms.insert_many(self.test_metadata_docs)
+        mock_MongoClient().test.meta.insert_one({
+            "_id": "catalog",
+            "generation": 1,
+            "updated": datetime.datetime(2020, 6, 1, 12, 0, 0, 500000)
+        })
+
+        r = self.client.get("/psalms/")
+        self.assertEqual("Mon, 01 Jun 2020 12:00:00 GMT", r.headers["Last-Modified"])
+
+        r = self.client.get("/psalms/", headers={"If-Modified-Since": "Mon, 01 Jun 2020 12:00:00 GMT"})
+        self.assertEqual(304, r.status_code)
+
+        r = self.client.get("/psalms/", headers={"If-Modified-Since": "Sun, 31 May 2020 12:00:00 GMT"})
+        self.assertEqual(200, r.status_code)
+
+    @patch("flask_app.db.MongoClient")
+    def test_get_psalms_by_page(self, mock_MongoClient):
+        """Walks the Psalms a page at a time"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.psalms.insert_many([
+            {"number": n, "demoThumbnailColor": "#1482cd"} for n in (3, 1, 2)
+        ])
+
+        r = self.client.get("/psalms/?limit=2")
+        self.assertEqual([1, 2], [psalm["number"] for psalm in r.json])
+        self.assertEqual("</psalms/?limit=2&after=2>; rel=\"next\"", r.headers["Link"])
+
+        r = self.client.get("/psalms/?limit=2&after=2")
+        self.assertEqual([3], [psalm["number"] for psalm in r.json])
+        self.assertNotIn("Link", r.headers)
+
+    def test_get_psalms_with_invalid_limit(self):
+        """Tries to get a page with a bad limit"""
+        r = self.client.get("/psalms/?limit=0")
+        self.assertEqual(400, r.status_code)
+        self.assertEqual({"msg": "limit must be between 1 and 500"}, r.json)
+
+        r = self.client.get("/psalms/?limit=ten")
+        self.assertEqual(400, r.status_code)
+        self.assertEqual({"msg": "limit must be an integer"}, r.json)
+
+    @patch("flask_app.db.MongoClient")
+    def test_stream_psalms(self, mock_MongoClient):
+        """Streams the Psalms as a JSON array"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.psalms.insert_many([
+            {"number": n, "demoThumbnailColor": "#1482cd"} for n in (1, 2, 3)
+        ])
+
+        r = self.client.get("/psalms/?stream=true&after=1")
+        self.assertEqual(200, r.status_code)
+        self.assertTrue(r.is_streamed)
+        self.assertEqual([2, 3], [psalm["number"] for psalm in r.json])
+
+        r = self.client.get("/psalms/?stream=true&after=3")
+        self.assertEqual([], r.json)
+
+    @patch("flask_app.db.MongoClient")
+    def test_get_psalms_compressed(self, mock_MongoClient):
+        """Gets the Psalms with each content coding the client accepts"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.psalms.insert_many([
+            {"number": n, "demoThumbnailColor": "#1482cd", "statement": {"title": "Psalm", "text": []}}
+            for n in range(1, 151)
+        ])
+
+        r = self.client.get("/psalms/")
+        self.assertNotIn("Content-Encoding", r.headers)
+        self.assertIn("Accept-Encoding", r.headers["Vary"])
+        expected_body = r.data
+        etag = r.headers["ETag"]
+
+        r = self.client.get("/psalms/", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual("gzip", r.headers["Content-Encoding"])
+        self.assertEqual(expected_body, gzip.decompress(r.data))
+        self.assertEqual(etag[:-1] + "-gzip\"", r.headers["ETag"])
+
+        r = self.client.get("/psalms/", headers={"If-None-Match": r.headers["ETag"]})
+        self.assertEqual(304, r.status_code)
+
+        if brotli is not None:
+            r = self.client.get("/psalms/", headers={"Accept-Encoding": "gzip, deflate, br"})
+            self.assertEqual("br", r.headers["Content-Encoding"])
+            self.assertEqual(expected_body, brotli.decompress(r.data))
+
+    @patch("flask_app.db.MongoClient")
+    def test_get_small_psalms_uncompressed(self, mock_MongoClient):
+        """Skips compression for a small catalog"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.psalms.insert_many(self.test_metadata_docs)
+
+        r = self.client.get("/psalms/", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", r.headers)
+        self.assertEqual(1, len(r.json))
+
 
 if __name__ == '__main__':
     unittest.main()
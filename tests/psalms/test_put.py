@@ -146,14 +146,13 @@ class TestPut(unittest.TestCase):
 
         r = self.client.put("/psalms/add", json=test_data, headers=test_headers)
         self.assertEqual(400, r.status_code)
-        self.assertEqual({"demoThumbnailColor": ["Missing data for required field."],
-                          "statement": {
+        self.assertEqual({"statement": {
                               "text": {
                                   "0": {
                                       "text": ["Missing data for required field."]
                                   }
                               }
-                          }}, r.json)
+                         }}, r.json)
 
     @patch("flask_app.db.MongoClient")
     def test_psalm_twice(self, mock_MongoClient):
@@ -0,0 +1,123 @@
+import unittest
+import datetime
+from unittest.mock import patch
+
+from mongomock import MongoClient
+
+import flask_app
+
+
+class TestUpdate(unittest.TestCase):
+    """Tests the POST method of the psalms/update endpoint"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.client = flask_app.create_app(test_env="test").test_client()
+        self.mock_db = MongoClient()
+
+        self.test_user_docs = [
+            {
+                "username": "johndoe",
+                "password": "pbkdf2:sha256:150000$WvnI6aK2$d9fe24da37a15003ef18"
+                            "2f9c2d48da67615b5d92c7a143d3e73c963b38799839",
+                "created": datetime.datetime.utcnow(),
+                "passwordLastUpdated": datetime.datetime.utcnow()
+            }
+        ]
+
+        self.test_psalm_docs = [
+            {
+                "number": 1,
+                "demoThumbnailColor": "#1482cd",
+                "demoPath": "1-demo",
+                "thumbnailPath": "1-thumbnail"
+            }
+        ]
+
+    @patch("flask_app.db.MongoClient")
+    def test_update_psalms(self, mock_MongoClient):
+        """Tries to update an existing psalm and a missing psalm"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+        mock_MongoClient().test.psalms.insert_many(self.test_psalm_docs)
+
+        login_data = {
+            "username": "johndoe",
+            "password": "hunter2"
+        }
+
+        login_response = self.client.post("/auth/login", json=login_data)
+
+        test_data = {
+            "psalms": [
+                {
+                    "number": 1,
+                    "demoThumbnailColor": "#333333"
+                },
+                {
+                    "number": 2,
+                    "demoThumbnailColor": "#333333"
+                }
+            ]
+        }
+
+        test_headers = {
+            "Authorization": "Bearer " + login_response.json.get("accessToken")
+        }
+
+        expected_response = {
+            "matched": 1,
+            "modified": 1,
+            "notFound": 1,
+            "results": [
+                {"number": 1, "status": "modified"},
+                {"number": 2, "status": "notFound"}
+            ]
+        }
+
+        r = self.client.post("/psalms/update", json=test_data, headers=test_headers)
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(expected_response, r.json)
+
+        new_psalm = mock_MongoClient().test.psalms.find_one({"number": 1})
+        self.assertEqual("#333333", new_psalm["demoThumbnailColor"])
+        self.assertIsNone(mock_MongoClient().test.psalms.find_one({"number": 2}))
+
+    @patch("flask_app.db.MongoClient")
+    def test_update_in_chunks(self, mock_MongoClient):
+        """Tries an update larger than one bulk write chunk"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+        mock_MongoClient().test.psalms.insert_many([
+            {"number": n, "demoThumbnailColor": "#1482cd"} for n in range(1, 6)
+        ])
+        self.client.application.config["BULK_WRITE_CHUNK_SIZE"] = 2
+
+        login_data = {
+            "username": "johndoe",
+            "password": "hunter2"
+        }
+
+        login_response = self.client.post("/auth/login", json=login_data)
+
+        test_data = {
+            "psalms": [{"number": n, "demoThumbnailColor": "#333333"} for n in range(1, 6)]
+        }
+
+        test_headers = {
+            "Authorization": "Bearer " + login_response.json.get("accessToken")
+        }
+
+        r = self.client.post("/psalms/update", json=test_data, headers=test_headers)
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(5, r.json["modified"])
+        self.assertEqual(5, mock_MongoClient().test.psalms.count_documents({"demoThumbnailColor": "#333333"}))
+
+    def test_update_psalm_without_token(self):
+        """Tries to update a psalm without a bearer token"""
+        r = self.client.post("/psalms/update", json={"psalms": []})
+        self.assertEqual(401, r.status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import datetime
+import io
 import os
 import shutil
 import unittest
@@ -87,10 +88,89 @@ class TestPut(unittest.TestCase):
             builder.files.add_file("file", im, "test.jpg", "image/jpeg")
 
             r = self.client.open(builder)
-            self.assertEqual(201, r.status_code)
+            self.assertEqual(202, r.status_code)
 
-            base_dir = self.client.application.config["IMAGE_STORE_DIR"]
-            self.assertTrue(os.path.exists(os.path.join(base_dir, "test_thumbnail_path.jpg")))
+            r = self.client.get(r.headers["Location"], headers=test_headers)
+            self.assertEqual("done", r.json["status"])
+            self.assertEqual(r.json["progress"]["total"], r.json["progress"]["done"])
+            derivatives = r.json["result"]["derivatives"]
+            self.assertEqual({"main", "w320", "w640"}, set(derivatives))
+            self.assertEqual(640, derivatives["main"]["width"])
+            self.assertIn("webp", derivatives["main"]["formats"])
+
+            image = mock_MongoClient().test.psalms.find_one({"number": 2})["thumbnailImage"]
+            self.assertTrue(image["name"].startswith("test_thumbnail_path-"))
+            self.assertEqual("#000000", image["placeholder"]["color"])
+
+            base_name = os.path.join(self.client.application.config["IMAGE_STORE_DIR"], image["name"])
+            self.assertTrue(os.path.exists(base_name + ".jpg"))
+            self.assertTrue(os.path.exists(base_name + "-original.jpg"))
+
+    @patch("flask_app.db.MongoClient")
+    def test_upload_batch(self, mock_MongoClient):
+        """Tries to upload a demo and a thumbnail image at once"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+        mock_MongoClient().test.psalms.insert_many(self.test_psalm_docs)
+
+        login_data = {
+            "username": "johndoe",
+            "password": "hunter2"
+        }
+
+        login_response = self.client.post("/auth/login", json=login_data)
+
+        with open("test.jpg", mode="rb") as demo, open("test.jpg", mode="rb") as thumbnail:
+            test_data = {
+                "number": [2, 2],
+                "imageType": ["demo", "thumbnail"]
+            }
+
+            test_headers = {
+                "Content-Type": "multipart/form-data",
+                "Authorization": "Bearer " + login_response.json.get("accessToken")
+            }
+
+            builder = EnvironBuilder(app=self.client.application, path="/psalms/upload/batch", data=test_data,
+                                     method="POST", headers=test_headers)
+            builder.files.add_file("file", demo, "demo.jpg", "image/jpeg")
+            builder.files.add_file("file", thumbnail, "thumbnail.jpg", "image/jpeg")
+
+            r = self.client.open(builder)
+            self.assertEqual(200, r.status_code)
+            self.assertEqual(["accepted", "accepted"], [result["status"] for result in r.json["results"]])
+
+        psalm = mock_MongoClient().test.psalms.find_one({"number": 2})
+        self.assertIsNotNone(psalm["demoImage"]["derivatives"])
+        self.assertIsNotNone(psalm["thumbnailImage"]["derivatives"])
+
+    @patch("flask_app.db.MongoClient")
+    def test_upload_batch_with_missing_image_type(self, mock_MongoClient):
+        """Tries to upload a batch without an image type for every file"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+        mock_MongoClient().test.psalms.insert_many(self.test_psalm_docs)
+
+        login_data = {
+            "username": "johndoe",
+            "password": "hunter2"
+        }
+
+        login_response = self.client.post("/auth/login", json=login_data)
+
+        test_headers = {
+            "Content-Type": "multipart/form-data",
+            "Authorization": "Bearer " + login_response.json.get("accessToken")
+        }
+
+        builder = EnvironBuilder(app=self.client.application, path="/psalms/upload/batch",
+                                 data={"number": [2, 2], "imageType": ["demo"]}, method="POST", headers=test_headers)
+        builder.files.add_file("file", io.BytesIO(b"a"), "a.jpg", "image/jpeg")
+        builder.files.add_file("file", io.BytesIO(b"b"), "b.jpg", "image/jpeg")
+
+        r = self.client.open(builder)
+        self.assertEqual(400, r.status_code)
+        self.assertEqual({"msg": "Please specify a number and image type for each file"}, r.json)
 
     @patch("flask_app.db.MongoClient")
     def test_upload_with_missing_psalm(self, mock_MongoClient):
@@ -155,11 +235,83 @@ class TestPut(unittest.TestCase):
             builder.files.add_file("file", im, "test.jpg", "image/jpeg")
 
             r = self.client.open(builder)
-            self.assertEqual(201, r.status_code)
+            self.assertEqual(202, r.status_code)
+
+            psalm = mock_MongoClient().test.psalms.find_one({"number": 2})
+            self.assertNotIn("thumbnailImage", psalm)
+
+            base_name = os.path.join(self.client.application.config["IMAGE_STORE_DIR"], psalm["demoImage"]["name"])
+            self.assertTrue(os.path.exists(base_name + "-large.jpg"))
+            self.assertTrue(os.path.exists(base_name + "-thumbnail.jpg"))
+
+    @patch("flask_app.db.MongoClient")
+    def test_upload_invalid_image(self, mock_MongoClient):
+        """Tries to upload a file that is not an image"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+        mock_MongoClient().test.psalms.insert_many(self.test_psalm_docs)
+
+        login_data = {
+            "username": "johndoe",
+            "password": "hunter2"
+        }
+
+        login_response = self.client.post("/auth/login", json=login_data)
+
+        test_data = {
+            "number": 2,
+            "imageType": "demo"
+        }
+
+        test_headers = {
+            "Content-Type": "multipart/form-data",
+            "Authorization": "Bearer " + login_response.json.get("accessToken")
+        }
+
+        builder = EnvironBuilder(app=self.client.application, path="/psalms/upload", data=test_data,
+                                 method="POST", headers=test_headers)
+        builder.files.add_file("file", io.BytesIO(b"not an image"), "test.jpg", "image/jpeg")
+
+        r = self.client.open(builder)
+        self.assertEqual(400, r.status_code)
+        self.assertEqual({"msg": "Please upload a valid image file."}, r.json)
+
+    @patch("flask_app.db.MongoClient")
+    def test_upload_oversized_image(self, mock_MongoClient):
+        """Tries to upload an image larger than the dimension limit"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+        mock_MongoClient().test.psalms.insert_many(self.test_psalm_docs)
+        self.client.application.config["IMAGE_MAX_DIMENSION"] = 1000
+
+        login_data = {
+            "username": "johndoe",
+            "password": "hunter2"
+        }
+
+        login_response = self.client.post("/auth/login", json=login_data)
+
+        with open("test.jpg", mode="rb") as im:
+            test_data = {
+                "number": 2,
+                "imageType": "demo"
+            }
+
+            test_headers = {
+                "Content-Type": "multipart/form-data",
+                "Authorization": "Bearer " + login_response.json.get("accessToken")
+            }
+
+            builder = EnvironBuilder(app=self.client.application, path="/psalms/upload", data=test_data,
+                                     method="POST", headers=test_headers)
+            builder.files.add_file("file", im, "test.jpg", "image/jpeg")
+
+            r = self.client.open(builder)
+            self.assertEqual(400, r.status_code)
+            self.assertEqual({"msg": "Image is 1600 x 1200 pixels; each side must be at most 1000"}, r.json)
 
-            base_dir = self.client.application.config["IMAGE_STORE_DIR"]
-            self.assertTrue(os.path.exists(os.path.join(base_dir, "test_demo_path-large.jpg")))
-            self.assertTrue(os.path.exists(os.path.join(base_dir, "test_demo_path-thumbnail.jpg")))
+        self.assertEqual([], os.listdir(self.client.application.config["IMAGE_STORE_DIR"]))
+        self.assertEqual(0, mock_MongoClient().test.imageJobs.count_documents({}))
 
     @patch("flask_app.db.MongoClient")
     def test_upload_image_with_invalid_number(self, mock_MongoClient):
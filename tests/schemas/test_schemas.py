@@ -0,0 +1,104 @@
+import copy
+import unittest
+
+from marshmallow import RAISE, ValidationError
+
+from flask_app.schemas import PiecesSchema, PsalmsListSchema, get_schema, load_pieces, load_psalms
+
+
+def schema_load(schema_class, data):
+    """Loads data with a fresh schema, as the handlers used to"""
+    try:
+        return schema_class().load(copy.deepcopy(data), unknown=RAISE), None
+    except ValidationError as e:
+        return None, e.messages
+
+
+def fast_load(load, data):
+    try:
+        return load(copy.deepcopy(data)), None
+    except ValidationError as e:
+        return None, e.messages
+
+
+class TestBulkLoading(unittest.TestCase):
+    """Tests that the fast bulk loaders match the schemas exactly"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.piece = {
+            "key": 0,
+            "title": "Rosé in the Garden",
+            "medium": "Acrylic on canvas",
+            "size": "20\" x 20\"",
+            "price": 2000.5,
+            "thumbnailColor": "#a1b2c3",
+            "collection": "Florals"
+        }
+        self.psalm = {
+            "number": 23,
+            "demoThumbnailColor": "#fff",
+            "statement": {
+                "title": "The Lord is my shepherd",
+                "text": [{"key": 0, "text": "He maketh me to lie down"}]
+            }
+        }
+
+    def check_pieces(self, data):
+        self.assertEqual(schema_load(PiecesSchema, data), fast_load(load_pieces, data))
+
+    def check_psalms(self, data):
+        self.assertEqual(schema_load(PsalmsListSchema, data), fast_load(load_psalms, data))
+
+    def test_valid_pieces(self):
+        """Loads valid pieces exactly as the schema does"""
+        other = dict(self.piece, key=1, title="Psalm 1", price=300, collection="Psalms", series="1")
+        del other["thumbnailColor"]
+        data = {"pieces": [self.piece, other]}
+        self.check_pieces(data)
+        self.check_pieces({"pieces": []})
+
+    def test_invalid_pieces(self):
+        """Gives exactly the schema's errors for invalid pieces"""
+        bad_values = {
+            "key": [-1, "1", 1.5, True, None],
+            "title": [1, None],
+            "price": ["12.50", float("nan"), True, 10 ** 400, None],
+            "thumbnailColor": ["#12345", "red", 1],
+            "series": [1, None],
+            "collection": [None]
+        }
+        for field, values in bad_values.items():
+            for value in values:
+                self.check_pieces({"pieces": [self.piece, dict(self.piece, **{field: value})]})
+
+        self.check_pieces({"pieces": [dict(self.piece, collection="Psalms", series="None")]})
+        self.check_pieces({"pieces": [dict(self.piece, extra=1)]})
+        self.check_pieces({"pieces": [{"title": "Untitled"}]})
+        self.check_pieces({"pieces": [self.piece], "extra": 1})
+        self.check_pieces({"pieces": "none"})
+        self.check_pieces({})
+        self.check_pieces([])
+
+    def test_valid_psalms(self):
+        """Loads valid psalms exactly as the schema does"""
+        self.check_psalms({"psalms": [self.psalm, {"number": 24}, {"number": 25, "statement": {"title": "Lift up"}}]})
+
+    def test_invalid_psalms(self):
+        """Gives exactly the schema's errors for invalid psalms"""
+        for psalm in [
+            dict(self.psalm, number=0),
+            dict(self.psalm, number="23"),
+            dict(self.psalm, demoThumbnailColor="#ggg"),
+            dict(self.psalm, statement=None),
+            dict(self.psalm, statement={"text": []}),
+            dict(self.psalm, statement={"title": "Title", "text": [{"key": -1, "text": "Text"}]}),
+            dict(self.psalm, statement={"title": "Title", "text": [{"key": 0}]}),
+            dict(self.psalm, statement={"title": "Title", "extra": 1}),
+            dict(self.psalm, extra=1)
+        ]:
+            self.check_psalms({"psalms": [self.psalm, psalm]})
+
+    def test_schema_instances(self):
+        """Reuses one schema instance per class"""
+        self.assertIs(get_schema(PiecesSchema), get_schema(PiecesSchema))
@@ -0,0 +1,62 @@
+import multiprocessing
+import os
+import signal
+import tempfile
+import unittest
+
+from flask_app.slots import HostSlots
+
+
+def hold_slot(slots, ready):
+    """Takes a slot and waits to be killed"""
+    slots.acquire()
+    ready.set()
+    signal.pause()
+
+
+class TestHostSlots(unittest.TestCase):
+    """Tests the host-wide slots"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.directory = tempfile.TemporaryDirectory()
+        self.slots = HostSlots(self.directory.name, "test", 2)
+
+    def tearDown(self):
+        """Runs after each test method"""
+        self.directory.cleanup()
+
+    def test_count(self):
+        """Gives out at most count slots at once"""
+        first = self.slots.acquire(timeout=0)
+        second = self.slots.acquire(timeout=0)
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(second)
+        self.assertIsNone(self.slots.acquire(timeout=0.05))
+
+        self.slots.release(first)
+        third = self.slots.acquire(timeout=0)
+        self.assertIsNotNone(third)
+        self.slots.release(second)
+        self.slots.release(third)
+
+    def test_killed_holder(self):
+        """Frees the slots of a process killed while holding them"""
+        ready = multiprocessing.Event()
+        holders = [multiprocessing.Process(target=hold_slot, args=(self.slots, ready)) for _ in range(2)]
+        for holder in holders:
+            ready.clear()
+            holder.start()
+            self.assertTrue(ready.wait(timeout=10))
+        self.assertIsNone(self.slots.acquire(timeout=0))
+
+        for holder in holders:
+            os.kill(holder.pid, signal.SIGKILL)
+            holder.join()
+        fd = self.slots.acquire(timeout=1)
+        self.assertIsNotNone(fd)
+        self.slots.release(fd)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import boto3
+from PIL import Image
+from flask.testing import EnvironBuilder
+from mongomock import MongoClient
+from moto import mock_s3
+
+import flask_app
+from flask_app.storage import LocalStorage, S3Storage
+
+
+class TestLocalStorage(unittest.TestCase):
+    """Tests the local filesystem storage backend"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.work_dir = tempfile.mkdtemp()
+        self.storage = LocalStorage(self.work_dir)
+
+    def tearDown(self):
+        """Runs after each test method"""
+        shutil.rmtree(self.work_dir)
+
+    def test_files_in_place(self):
+        """Keeps files already in the store directory where they are"""
+        path = os.path.join(self.work_dir, "piece-large.jpg")
+        with open(path, "wb") as f:
+            f.write(b"image")
+        open(os.path.join(self.work_dir, ".upload-abc"), "wb").close()
+
+        self.storage.put_files([("piece-large.jpg", path)])
+        self.assertTrue(self.storage.exists("piece-large.jpg"))
+        self.assertEqual(["piece-large.jpg"], list(self.storage.keys()))
+        self.assertFalse(self.storage.fetch("missing.jpg", os.path.join(self.work_dir, "missing.jpg")))
+
+        self.storage.delete("piece-large.jpg")
+        self.assertFalse(self.storage.exists("piece-large.jpg"))
+
+
+class TestS3Storage(unittest.TestCase):
+    """Tests the S3 storage backend against a local stand-in"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.mock_s3 = mock_s3()
+        self.mock_s3.start()
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="images")
+
+        self.work_dir = tempfile.mkdtemp()
+        self.storage = S3Storage("images", "store/", region="us-east-1", concurrency=4,
+                                 multipart_threshold=5 * 1024 * 1024, cache_control="public, immutable")
+
+    def tearDown(self):
+        """Runs after each test method"""
+        self.mock_s3.stop()
+        shutil.rmtree(self.work_dir)
+
+    def path(self, name):
+        return os.path.join(self.work_dir, name)
+
+    def test_put_and_fetch(self):
+        """Stores several files, one of them as a multipart upload"""
+        with open(self.path("piece-original.jpg"), "wb") as f:
+            f.write(os.urandom(11 * 1024 * 1024))
+        Image.new(mode="RGB", size=(100, 80)).save(self.path("piece-large.webp"))
+
+        self.storage.put_files([("piece-original.jpg", self.path("piece-original.jpg")),
+                                ("piece-large.webp", self.path("piece-large.webp"))])
+
+        self.assertEqual({"piece-original.jpg", "piece-large.webp"}, set(self.storage.keys()))
+        head = self.storage.client.head_object(Bucket="images", Key="store/piece-large.webp")
+        self.assertEqual("image/webp", head["ContentType"])
+        self.assertEqual("public, immutable", head["CacheControl"])
+        head = self.storage.client.head_object(Bucket="images", Key="store/piece-original.jpg")
+        self.assertTrue(head["ETag"].endswith("-3\""))
+
+        self.assertTrue(self.storage.fetch("piece-original.jpg", self.path("copy.jpg")))
+        with open(self.path("piece-original.jpg"), "rb") as original, open(self.path("copy.jpg"), "rb") as copy:
+            self.assertEqual(original.read(), copy.read())
+
+    def test_missing_file(self):
+        """Reports files that are not stored"""
+        self.assertFalse(self.storage.exists("missing.jpg"))
+        self.assertFalse(self.storage.fetch("missing.jpg", self.path("missing.jpg")))
+        self.assertFalse(os.path.exists(self.path("missing.jpg")))
+
+    def test_delete(self):
+        """Deletes a stored file"""
+        with open(self.path("piece.jpg"), "wb") as f:
+            f.write(b"image")
+        self.storage.put_files([("piece.jpg", self.path("piece.jpg"))])
+        self.assertTrue(self.storage.exists("piece.jpg"))
+
+        self.storage.delete("piece.jpg")
+        self.assertFalse(self.storage.exists("piece.jpg"))
+
+
+class TestS3ImageStore(unittest.TestCase):
+    """Tests uploading and serving images with S3 storage"""
+
+    def setUp(self):
+        """Runs before each test method"""
+        self.mock_s3 = mock_s3()
+        self.mock_s3.start()
+        self.bucket = boto3.resource("s3", region_name="us-east-1").create_bucket(Bucket="images")
+
+        app = flask_app.create_app(test_env="test")
+        app.config.update(IMAGE_STORAGE="s3", IMAGE_S3_BUCKET="images", IMAGE_S3_REGION="us-east-1")
+        self.client = app.test_client()
+        self.mock_db = MongoClient()
+
+        self.test_user_docs = [
+            {
+                "username": "johndoe",
+                "password": "pbkdf2:sha256:150000$WvnI6aK2$d9fe24da37a15003ef18"
+                            "2f9c2d48da67615b5d92c7a143d3e73c963b38799839",
+                "created": datetime.datetime.utcnow(),
+                "passwordLastUpdated": datetime.datetime.utcnow()
+            }
+        ]
+
+        self.test_art_docs = [
+            {
+                "key": 0,
+                "title": "Test Piece",
+                "path": "test_piece",
+                "medium": "Acrylic on canvas",
+                "size": "20\" x 20\"",
+                "price": 200000,
+                "collection": "Florals"
+            }
+        ]
+
+        Image.new(mode="RGB", size=(1600, 1200)).save("test.jpg")
+
+    def tearDown(self):
+        """Runs after each test method"""
+        self.mock_s3.stop()
+        os.remove("test.jpg")
+        base_dir = self.client.application.config["IMAGE_STORE_DIR"]
+        if os.path.isdir(base_dir):
+            shutil.rmtree(base_dir)
+
+    @patch("flask_app.db.MongoClient")
+    def test_upload_and_serve(self, mock_MongoClient):
+        """Uploads a piece, then serves it on a host without a local copy"""
+        mock_MongoClient.return_value = self.mock_db
+        mock_MongoClient().test.apiAuth.insert_many(self.test_user_docs)
+        mock_MongoClient().test.art.insert_many(self.test_art_docs)
+
+        login_data = {
+            "username": "johndoe",
+            "password": "hunter2"
+        }
+
+        login_response = self.client.post("/auth/login", json=login_data)
+
+        with open("test.jpg", mode="rb") as im:
+            test_headers = {
+                "Content-Type": "multipart/form-data",
+                "Authorization": "Bearer " + login_response.json.get("accessToken")
+            }
+
+            builder = EnvironBuilder(app=self.client.application, path="/art/upload", data={"title": "Test Piece"},
+                                     method="POST", headers=test_headers)
+            builder.files.add_file("file", im, "test.jpg", "image/jpeg")
+
+            r = self.client.open(builder)
+            self.assertEqual(202, r.status_code)
+
+        name = mock_MongoClient().test.art.find_one({"title": "Test Piece"})["image"]["name"]
+        keys = {item.key for item in self.bucket.objects.all()}
+        self.assertIn(name + "-original.jpg", keys)
+        self.assertIn(name + "-large.jpg", keys)
+        self.assertIn(name + "-w1280.webp", keys)
+
+        shutil.rmtree(self.client.application.config["IMAGE_STORE_DIR"])
+
+        r = self.client.get("/images/{}-large.jpg".format(name))
+        self.assertEqual(200, r.status_code)
+        cached = os.path.join(self.client.application.config["IMAGE_STORE_DIR"], name + "-large.jpg")
+        with open(cached, "rb") as f:
+            self.assertEqual(f.read(), r.data)
+        with Image.open(cached) as large:
+            self.assertEqual((1000, 750), large.size)
+        r.close()
+
+        r = self.client.get("/images/missing-large.jpg")
+        self.assertEqual(404, r.status_code)
+
+        with patch.object(S3Storage, "fetch", return_value=False) as mock_fetch:
+            self.assertEqual(404, self.client.get("/images/missing-large.jpg").status_code)
+            self.assertEqual(404, self.client.get("/images/missing-large.txt").status_code)
+            mock_fetch.assert_not_called()